@@ -3,10 +3,13 @@
 import json
 import logging
 import hashlib
+import threading
 import time
 from typing import Dict, Any, Optional, Tuple, Union
 import requests
 import urllib3
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from utils.exceptions import (
     SapODataError, 
     AuthenticationError, 
@@ -20,6 +23,13 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 logger = logging.getLogger("SAPB1Client")
 
+# Connection pool sizing for the shared HTTP session
+POOL_CONNECTIONS = 16
+POOL_MAXSIZE = 32
+
+# Default OData page size (Service Layer defaults to 20 records per page)
+DEFAULT_TOP = 200
+
 class SAPB1EnhancedClient:
     
     def __init__(self, service_layer_url=None, company_db=None, username=None, password=None):
@@ -33,6 +43,9 @@ class SAPB1EnhancedClient:
         self.session_id = None
         self.csrf_token = None
         self.session_valid_until = 0
+        # The client is shared by worker threads: only one of them logs in at a time, the
+        # others then find its session valid
+        self._login_lock = threading.Lock()
         
         # Response caching (simple in-memory cache)
         self.cache = {}
@@ -41,8 +54,27 @@ class SAPB1EnhancedClient:
         # Demo mode flag for testing without SAP
         self.demo_mode = False
         
+        # OData page size - higher means fewer round trips but larger responses
+        self.page_size = DEFAULT_TOP
+        
+        # Shared HTTP session so connections are reused across requests
+        self.session = self._create_session()
+        
         logger.info(f"SAP Client initialized with URL: {self.service_layer_url}, DB: {self.company_db}")
     
+    def _create_session(self) -> requests.Session:
+        """Create a pooled HTTP session with retries on transient failures"""
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=POOL_CONNECTIONS,
+            pool_maxsize=POOL_MAXSIZE,
+            max_retries=Retry(total=3, backoff_factor=0.2)
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.verify = False  # For development only
+        return session
+    
     def _generate_cache_key(self, url: str, method: str, data: Optional[Dict] = None) -> str:
         """Generate a cache key for a request"""
         key_parts = [url, method]
@@ -54,15 +86,17 @@ class SAPB1EnhancedClient:
     
     def _is_cached_response_valid(self, cache_key: str) -> bool:
         """Check if a cached response is still valid"""
-        if cache_key not in self.cache:
-            return False
-            
-        cache_entry = self.cache[cache_key]
-        return time.time() < cache_entry["expires_at"]
+        cache_entry = self.cache.get(cache_key)
+        return cache_entry is not None and time.time() < cache_entry["expires_at"]
     
     
     def login(self) -> bool:
         """Login to SAP B1 Service Layer and establish a session."""
+        with self._login_lock:
+            return self._login()
+    
+    def _login(self) -> bool:
+        """Login while holding the login lock."""
         # Check if we already have a valid session
         if self.session_id and time.time() < self.session_valid_until:
             logger.info("Using existing valid session")
@@ -104,7 +138,7 @@ class SAPB1EnhancedClient:
             }
             
             # Make login request with SSL verification disabled for development/testing
-            response = requests.post(
+            response = self.session.post(
                 login_url,
                 data=json.dumps(login_data),
                 headers=headers,
@@ -170,9 +204,11 @@ class SAPB1EnhancedClient:
             cache_key = self._generate_cache_key(url, method, data)
             
             # Check cache for GET requests
-            if method == "GET" and cache and self._is_cached_response_valid(cache_key):
+            # One read of the entry: another thread may evict it meanwhile
+            cache_entry = self.cache.get(cache_key) if method == "GET" and cache else None
+            if cache_entry is not None and time.time() < cache_entry["expires_at"]:
                 logger.info(f"Using cached response for: {url}")
-                return self.cache[cache_key]["data"]
+                return cache_entry["data"]
         
         # Ensure we're logged in
         if not self.session_id or time.time() >= self.session_valid_until:
@@ -200,6 +236,10 @@ class SAPB1EnhancedClient:
             "Content-Type": "application/json"
         }
         
+        # Ask the Service Layer for larger pages to cut round trips
+        if method == "GET" and not raw_response:
+            request_headers["Prefer"] = f"odata.maxpagesize={self.page_size}"
+        
         # If requesting XML metadata, set appropriate Accept header
         if url.endswith('$metadata') and raw_response:
             request_headers["Accept"] = "application/xml"
@@ -214,13 +254,13 @@ class SAPB1EnhancedClient:
         try:
             # Execute request with proper error handling
             if method == "GET":
-                response = requests.get(full_url, headers=request_headers, verify=False)
+                response = self.session.get(full_url, headers=request_headers, verify=False)
             elif method == "POST":
-                response = requests.post(full_url, headers=request_headers, json=data, verify=False)
+                response = self.session.post(full_url, headers=request_headers, json=data, verify=False)
             elif method == "PATCH":
-                response = requests.patch(full_url, headers=request_headers, json=data, verify=False)
+                response = self.session.patch(full_url, headers=request_headers, json=data, verify=False)
             elif method == "DELETE":
-                response = requests.delete(full_url, headers=request_headers, verify=False)
+                response = self.session.delete(full_url, headers=request_headers, verify=False)
             else:
                 raise RequestError(f"Unsupported method: {method}")
             
@@ -493,7 +533,7 @@ class SAPB1EnhancedClient:
             if self.csrf_token:
                 headers["x-csrf-token"] = self.csrf_token
             
-            response = requests.post(
+            response = self.session.post(
                 logout_url,
                 headers=headers,
                 verify=False  # For development only
@@ -517,12 +557,12 @@ class SAPB1EnhancedClient:
         if url_pattern:
             # Clear only matching cache entries
             keys_to_remove = []
-            for cache_key in self.cache:
+            for cache_key in list(self.cache):
                 if url_pattern in cache_key:
                     keys_to_remove.append(cache_key)
             
             for key in keys_to_remove:
-                del self.cache[key]
+                self.cache.pop(key, None)
                 
             logger.info(f"Cleared {len(keys_to_remove)} cache entries matching pattern: {url_pattern}")
         else:
@@ -1,7 +1,7 @@
 # graph/enhanced_workflow.py
 
 import os
-from typing import Dict, Any, TypedDict, Optional, List, Union
+from typing import Dict, Any, TypedDict, Optional, List, Union, Iterator
 from typing_extensions import TypedDict
 from langchain.schema import BaseMessage
 from langgraph.graph import StateGraph, END
@@ -16,6 +16,7 @@ from integration.enhanced_sap_client import SAPB1EnhancedClient
 from integration.entity_registry_integration import EntityRegistryIntegration
 from metadata.manager import MetadataManager
 from utils.exceptions import format_user_friendly_error
+from utils.sap_context import SAP_CTX, SAPResources
 # Import the enhanced error utilities
 from utils.enhanced_errors import (
     SAPAssistantError, 
@@ -29,8 +30,26 @@ from tools.support_tools import SupportToolsIntegration
 import logging
 import time
 import re
+import hashlib
+import threading
+from functools import lru_cache
 logger = logging.getLogger(__name__)
 
+try:
+    import diskcache
+except ImportError:  # Optional - results are then not persisted across restarts
+    diskcache = None
+
+# Bump when the shape of workflow results changes to invalidate persisted entries
+RESULT_CACHE_SCHEMA_VERSION = "1"
+RESULT_CACHE_TTL = 600  # seconds
+RESULT_CACHE_SIZE_LIMIT = 500_000_000  # bytes
+
+# Input validation applied before any LLM or SAP call is made
+MAX_QUERY_LEN = 2000
+NO_WORD_CHARS_PATTERN = re.compile(r"^\W+$")
+NON_PRINTABLE_PATTERN = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+
 # Define the state schema using TypedDict
 class EnhancedSAPWorkflowState(TypedDict, total=False):
     query: str                     # Natural language query from user
@@ -44,9 +63,6 @@ class EnhancedSAPWorkflowState(TypedDict, total=False):
     output: str                    # Formatted output for user
     output_format: str             # Desired output format (table, json, csv)
     retry_count: int               # Retry counter to prevent infinite loops
-    metadata_manager: Any          # Reference to the metadata manager
-    sap_client: Any                # Reference to the SAP client
-    entity_registry: Any           # Reference to the entity registry
 
 class EnhancedSAPDataWorkflow:
     
@@ -70,6 +86,17 @@ class EnhancedSAPDataWorkflow:
         self.request_tool = RequestExecutorTool(sap_client=self.sap_client)
         self.format_agent = ResultFormattingAgent()
         
+        # Fast paths for recurring canned queries that map straight to a fixed OData call
+        self._fast_paths = [
+            (re.compile(r"^(?:show |list |get )?top (\d+) customers$", re.I), self._fast_top_customers),
+            (re.compile(r"^(?:show |list |get )?(?:all )?open (?:sales )?orders$", re.I), self._fast_open_orders),
+            (re.compile(r"^(?:show |list |get )?(?:all )?open invoices$", re.I), self._fast_open_invoices),
+        ]
+        self.fast_path_hits = {}
+        
+        # Persistent (query, output_format) -> result store shared across processes/restarts
+        self._disk_cache = self._open_result_cache()
+        
         # Initialize Gmail components with LLM-only approach
         try:
             # Get OpenAI API key from environment
@@ -220,10 +247,6 @@ class EnhancedSAPDataWorkflow:
     def _extract_intent(self, state: EnhancedSAPWorkflowState) -> EnhancedSAPWorkflowState:
         """Simplified intent extraction using the new 2-method approach."""
         try:
-            # Add shared objects to state
-            state["metadata_manager"] = self.metadata_manager
-            state["entity_registry"] = self.entity_registry
-            
             # Use the simplified intent recognition manager
             if self.intent_recognition_manager:
                 logger.info("Using simplified intent recognition...")
@@ -260,7 +283,7 @@ class EnhancedSAPDataWorkflow:
                     "entity_type": state.get("endpoint", ""),
                     "filter_conditions": [],
                     "fields": [],
-                    "top": 50,
+                    "top": self.sap_client.page_size,
                     "skip": 0,
                     "order_by": "",
                     "expand": []
@@ -299,6 +322,94 @@ class EnhancedSAPDataWorkflow:
             )
         return {"error": "Intent recognition manager not available"}
     
+    def _match_fast_path(self, inputs: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Answer canned queries with a pre-bound OData call, bypassing the LLM graph"""
+        query = inputs.get("query", "").strip().rstrip("?.!")
+        
+        for pattern, handler in self._fast_paths:
+            match = pattern.match(query)
+            if not match:
+                continue
+            
+            self.fast_path_hits[handler.__name__] = self.fast_path_hits.get(handler.__name__, 0) + 1
+            logger.info(f"Fast path hit: {handler.__name__} for query: {query}")
+            
+            # Same initialization as the graph path, even when this is the first query
+            self.ensure_initialized()
+            
+            state: EnhancedSAPWorkflowState = {
+                "query": inputs.get("query", ""),
+                "output_format": inputs.get("output_format", "table"),
+                "retry_count": 0
+            }
+            state.update(handler(match))
+            
+            token = self._bind_resources()
+            try:
+                state = self.request_tool.invoke(state)
+                return self.format_agent.invoke(state)
+            finally:
+                SAP_CTX.reset(token)
+        
+        return None
+    
+    def _fast_top_customers(self, match: re.Match) -> Dict[str, Any]:
+        """Customers ranked by current account balance"""
+        # User-supplied count: keep it to one page of results
+        top = max(1, min(int(match.group(1)), self.sap_client.page_size))
+        return {
+            "intent": "BusinessPartners.TopCustomers",
+            "endpoint": "BusinessPartners",
+            "odata_url": f"/BusinessPartners?$filter=CardType eq 'C'&$orderby=CurrentAccountBalance desc&$top={top}"
+        }
+    
+    def _fast_open_orders(self, match: re.Match) -> Dict[str, Any]:
+        """Open sales orders"""
+        return {
+            "intent": "Orders.ListOpenOrders",
+            "endpoint": "Orders",
+            "odata_url": f"/Orders?$filter=DocumentStatus eq 'bost_Open'&$top={self.sap_client.page_size}"
+        }
+    
+    def _fast_open_invoices(self, match: re.Match) -> Dict[str, Any]:
+        """Open A/R invoices"""
+        return {
+            "intent": "Invoices.ListOpenInvoices",
+            "endpoint": "Invoices",
+            "odata_url": f"/Invoices?$filter=DocumentStatus eq 'bost_Open'&$top={self.sap_client.page_size}"
+        }
+    
+    def _open_result_cache(self):
+        """Open the on-disk result cache, or return None if it is unavailable"""
+        if diskcache is None:
+            logger.info("diskcache not installed - workflow results will not be persisted")
+            return None
+        
+        try:
+            return diskcache.Cache(
+                os.getenv("WF_CACHE_DIR", "./.wf_cache"),
+                size_limit=RESULT_CACHE_SIZE_LIMIT
+            )
+        except Exception as e:
+            logger.warning(f"Could not open workflow result cache: {str(e)}")
+            return None
+    
+    def _result_cache_key(self, query: str, output_format: str) -> str:
+        """Content-addressed key for a workflow result"""
+        # The cache is shared by every process on the host: scope it to the SAP system and company
+        key_string = (
+            f"{self.sap_client.service_layer_url}|{self.sap_client.company_db}|"
+            f"{query.strip().lower()}|{output_format}|{RESULT_CACHE_SCHEMA_VERSION}"
+        )
+        return hashlib.sha1(key_string.encode()).hexdigest()
+    
+    def get_fast_path_stats(self) -> Dict[str, Any]:
+        """Get fast-path hit counts for monitoring."""
+        return {
+            "total_hits": sum(self.fast_path_hits.values()),
+            "hits_by_path": dict(self.fast_path_hits)
+        }
+    
     def _understand_query(self, state: EnhancedSAPWorkflowState) -> EnhancedSAPWorkflowState:
         """Process the query through the query understanding agent with entity registry enhancement"""
         try:
@@ -349,7 +460,7 @@ class EnhancedSAPDataWorkflow:
             if self.entity_registry and "structured_query" in result:
                 # Enrich the structured query with additional entity information
                 result["structured_query"] = self.entity_registry.enrich_structured_query(
-                    result["structured_query"], result["query"]
+                    result["structured_query"], result["query"], inplace=True
                 )
             
             return result
@@ -426,21 +537,22 @@ class EnhancedSAPDataWorkflow:
             }
         
         try:
-            messages = self.gmail_tool.get_messages(query)
+            # Classify each message as soon as its fetch batch arrives
+            messages = [
+                {
+                    "message_id": msg.message_id,
+                    "sender": msg.sender,
+                    "subject": msg.subject,
+                    "body": msg.body,
+                    "received_at": msg.received_at.isoformat(),
+                    "is_invoice_request": self.gmail_tool.is_invoice_request(msg)
+                }
+                for msg in self.gmail_tool.iter_messages(query)
+            ]
             return {
                 "status": "success",
                 "message_count": len(messages),
-                "messages": [
-                    {
-                        "message_id": msg.message_id,
-                        "sender": msg.sender,
-                        "subject": msg.subject,
-                        "body": msg.body,
-                        "received_at": msg.received_at.isoformat(),
-                        "is_invoice_request": self.gmail_tool.is_invoice_request(msg)
-                    }
-                    for msg in messages
-                ]
+                "messages": messages
             }
         except Exception as e:
             logger.error(f"Error getting Gmail messages: {str(e)}")
@@ -487,14 +599,8 @@ class EnhancedSAPDataWorkflow:
             }
         
         try:
-            import asyncio
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            
             logger.info(f"Starting Gmail monitoring with {check_interval} second intervals")
-            loop.run_until_complete(
-                self.gmail_agent.monitor_gmail_continuously(check_interval)
-            )
+            self.gmail_agent.run_monitor(check_interval)
             
         except KeyboardInterrupt:
             logger.info("Gmail monitoring stopped by user")
@@ -608,6 +714,79 @@ class EnhancedSAPDataWorkflow:
             logger.info(f"Updated {len(dynamic_rules)} dynamic correction rules")
     
     
+    def _validate_query(self, query: str) -> Optional[str]:
+        """Return a user-facing message if the query cannot be processed, else None"""
+        query = query.strip()
+        if not query:
+            return "Please enter a query."
+        if len(query) > MAX_QUERY_LEN:
+            return f"Your query is too long ({len(query)} characters). Please keep it under {MAX_QUERY_LEN} characters."
+        if NON_PRINTABLE_PATTERN.search(query) or NO_WORD_CHARS_PATTERN.match(query):
+            return "Your query could not be understood. Please describe the SAP data you are looking for."
+        return None
+    
+    def _prepare_workflow_state(self, inputs: Dict[str, Any]) -> EnhancedSAPWorkflowState:
+        """Run pre-flight housekeeping and build the initial SAP workflow state"""
+        # NEW: Trigger pattern analysis before processing SAP workflow
+        self._maybe_trigger_pattern_analysis()
+
+        # Ensure initialization before processing SAP workflow
+        self.ensure_initialized()
+
+        # Prepare initial state with retry counter; shared objects travel via SAP_CTX
+        # so the state stays small and serializable
+        initial_state: EnhancedSAPWorkflowState = {
+            "query": inputs.get("query", ""),
+            "output_format": inputs.get("output_format", "table"),
+            "retry_count": 0
+        }
+        return initial_state
+
+    def _bind_resources(self):
+        """Bind the shared SAP objects to the current context for workflow nodes"""
+        return SAP_CTX.set(SAPResources(
+            metadata_manager=self.metadata_manager,
+            sap_client=self.sap_client,
+            entity_registry=self.entity_registry
+        ))
+
+    def invoke_stream(self, inputs: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """
+        Execute the SAP workflow and yield each node's state update as soon as it completes.
+
+        Yields dicts of the form {"node": <node name>, "update": <partial state>} so callers
+        can surface early progress (e.g. the recognized intent) before the request finishes.
+        Gmail actions are not graph-based and are yielded as a single final update.
+        """
+        if "gmail_action" in inputs:
+            yield {"node": "gmail_action", "update": self.invoke(inputs)}
+            return
+
+        validation_message = self._validate_query(inputs.get("query", ""))
+        if validation_message:
+            yield {"node": "validation", "update": {"output": validation_message}}
+            return
+
+        initial_state = self._prepare_workflow_state(inputs)
+
+        token = self._bind_resources()
+        try:
+            print(f"Streaming enhanced workflow with query: {initial_state['query']}")
+            for chunk in self.workflow.stream(initial_state, stream_mode="updates"):
+                for node_name, update in chunk.items():
+                    yield {"node": node_name, "update": update}
+            print("Workflow stream completed successfully")
+        except Exception as e:
+            print(f"Workflow execution error: {str(e)}")
+            yield {
+                "node": "error",
+                "update": {
+                    "output": f"Error processing your query: {str(e)}\nPlease try a different query or contact support."
+                }
+            }
+        finally:
+            SAP_CTX.reset(token)
+
     def invoke(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
         """Execute the workflow with the given inputs (enhanced with Gmail support and pattern analysis)"""
 
@@ -643,31 +822,67 @@ class EnhancedSAPDataWorkflow:
                 invoice_id = inputs.get("invoice_id", "")
                 return self.generate_invoice_report(invoice_id)
 
-        # NEW: Trigger pattern analysis before processing SAP workflow
-        self._maybe_trigger_pattern_analysis()
+        # Reject empty or malformed queries before spending any LLM/SAP round trips
+        validation_message = self._validate_query(inputs.get("query", ""))
+        if validation_message:
+            return {"output": validation_message}
 
-        # Ensure initialization before processing SAP workflow
-        self.ensure_initialized()
+        # Canned queries skip the LLM-driven graph entirely
+        fast_result = self._match_fast_path(inputs)
+        if fast_result is not None:
+            return fast_result
 
-        # Prepare initial state with retry counter and common objects
-        initial_state: EnhancedSAPWorkflowState = {
-            "query": inputs.get("query", ""),
-            "output_format": inputs.get("output_format", "table"),
-            "retry_count": 0,
-            "metadata_manager": self.metadata_manager,
-            "sap_client": self.sap_client,
-            "entity_registry": self.entity_registry
-        }
+        # Serve previously computed results from the persistent cache
+        cache_key = None
+        if self._disk_cache is not None:
+            cache_key = self._result_cache_key(
+                inputs.get("query", ""), inputs.get("output_format", "table")
+            )
+            cached_result = self._disk_cache.get(cache_key)
+            if cached_result is not None:
+                logger.info(f"Using cached workflow result for: {inputs.get('query', '')}")
+                return cached_result
+
+        initial_state = self._prepare_workflow_state(inputs)
 
         # Execute the SAP workflow with the given inputs
+        token = self._bind_resources()
         try:
             print(f"Starting enhanced workflow with query: {initial_state['query']}")
             result = self.workflow.invoke(initial_state)
             print("Workflow completed successfully")
+            
+            # Only successful results are worth persisting
+            if cache_key is not None and not result.get("error"):
+                try:
+                    self._disk_cache.set(cache_key, result, expire=RESULT_CACHE_TTL)
+                except Exception as e:
+                    logger.warning(f"Could not persist workflow result: {str(e)}")
             return result
         except Exception as e:
             print(f"Workflow execution error: {str(e)}")
             # Return a graceful error message if the workflow fails
             return {
                 "output": f"Error processing your query: {str(e)}\nPlease try a different query or contact support."
-            }
\ No newline at end of file
+            }
+        finally:
+            SAP_CTX.reset(token)
+
+# Shared workflow instance - building one loads metadata, the SAP client, the entity
+# registry and compiles the graph, so callers should use get_workflow().invoke(...)
+# instead of constructing EnhancedSAPDataWorkflow per request.
+_workflow_lock = threading.Lock()
+
+@lru_cache(maxsize=1)
+def _build_shared_workflow() -> EnhancedSAPDataWorkflow:
+    return EnhancedSAPDataWorkflow()
+
+def get_workflow() -> EnhancedSAPDataWorkflow:
+    """Return the process-wide workflow, creating it on first use"""
+    with _workflow_lock:
+        return _build_shared_workflow()
+
+def reset_workflow():
+    """Drop the shared workflow so the next get_workflow() rebuilds it (e.g. after credential rotation)"""
+    with _workflow_lock:
+        _build_shared_workflow.cache_clear()
\ No newline at end of file
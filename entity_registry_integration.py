@@ -1,17 +1,214 @@
 # integration/entity_registry_integration.py
 
 import logging
-from typing import Dict, Any, List, Optional
+import atexit
+import difflib
+from typing import Dict, Any, List, Mapping, Optional
 import asyncio
 import re
 import sqlite3
 import json
 import os
+import sys
+import tempfile
 import time
+import weakref
 from datetime import datetime
+from functools import lru_cache
+from itertools import islice
+from types import MappingProxyType
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib json module
+    orjson = None
+
+try:
+    from rapidfuzz import fuzz, process as fuzz_process
+except ImportError:  # Fall back to difflib for close-match suggestions
+    fuzz = fuzz_process = None
 
 logger = logging.getLogger("EntityRegistryIntegration")
 
+
+def _casefold(text: str) -> str:
+    """Case-insensitive lookup key for a field name or value (plain lower() for ASCII)"""
+    return text.lower() if text.isascii() else text.casefold()
+
+
+# ISO (2024-01-31), slash (2024/01/31) and US (01/31/2024) date prefixes
+_DATE_RE = re.compile(r'^(?:\d{4}-\d{2}-\d{2}|\d{4}/\d{2}/\d{2}|\d{2}/\d{2}/\d{4})')
+
+# OData type for each JSON-decoded primitive (exact types, so no MRO walk is needed)
+_TYPE_MAP = {
+    bool: "Edm.Boolean",
+    int: "Edm.Int32",
+    float: "Edm.Double",
+    dict: "Complex",
+    list: "Collection"
+}
+
+# Terms that map straight to an entity in suggest_entity_type, checked in this order
+_PRIORITY_ENTITY_TERMS = (
+    ("order", "Orders"),
+    ("invoice", "Invoices"),
+    ("customer", "BusinessPartners"),
+    ("item", "Items")
+)
+
+# Context keywords used as a last resort by suggest_entity_type, in priority order
+_ORDER_KW = frozenset({"buy", "sell", "selling", "purchase", "order"})
+_INVOICE_KW = frozenset({"invoice", "bill", "payment", "paid"})
+_ITEM_KW = frozenset({"stock", "inventory", "product", "item"})
+_BP_KW = frozenset({"customer", "client", "account"})
+_FALLBACK_ENTITY_KEYWORDS = (
+    ("Orders", _ORDER_KW),
+    ("Invoices", _INVOICE_KW),
+    ("Items", _ITEM_KW),
+    ("BusinessPartners", _BP_KW)
+)
+_FALLBACK_ENTITY_PRIORITY = tuple(entity for entity, _ in _FALLBACK_ENTITY_KEYWORDS)
+
+# One alternation over all keywords; each named group is the entity type it points to.
+# Longest keywords first so e.g. "selling" is preferred over "sell" (substring matching,
+# like the original `in` checks, so plurals such as "orders" still hit)
+_FALLBACK_ENTITY_RE = re.compile("|".join(
+    f"(?P<{entity}>" + "|".join(sorted(keywords, key=lambda kw: (-len(kw), kw))) + ")"
+    for entity, keywords in _FALLBACK_ENTITY_KEYWORDS
+))
+
+# Read-only query patterns and trigger phrases attached to the schemas of well-known entities
+_STATIC_SCHEMA_EXTENSIONS = MappingProxyType({
+    "BusinessPartners": {
+        "query_patterns": {
+            "FindCustomer": "/BusinessPartners?$filter=CardType eq 'C' and CardName eq '{{CardName}}'",
+            "ListCustomers": "/BusinessPartners?$filter=CardType eq 'C'",
+            "FindSupplier": "/BusinessPartners?$filter=CardType eq 'S' and CardName eq '{{CardName}}'",
+            "ListSuppliers": "/BusinessPartners?$filter=CardType eq 'S'"
+        },
+        "common_phrases": {
+            "FindCustomer": ["find customer", "get customer", "show customer", "customer details"],
+            "ListCustomers": ["list customers", "show all customers", "get customers"],
+            "FindSupplier": ["find supplier", "get supplier", "show supplier", "supplier details"],
+            "ListSuppliers": ["list suppliers", "show all suppliers", "get suppliers"]
+        }
+    },
+    "Items": {
+        "query_patterns": {
+            "FindItem": "/Items?$filter=ItemCode eq '{{ItemCode}}' or ItemName eq '{{ItemName}}'",
+            "ListItems": "/Items"
+        },
+        "common_phrases": {
+            "FindItem": ["find item", "get item", "show item", "item details", "product details"],
+            "ListItems": ["list items", "show all items", "get items", "list products"]
+        }
+    },
+    "Orders": {
+        "query_patterns": {
+            "FindSpecificOrder": "/Orders?$filter=DocNum eq {{DocNum}}",
+            "FindOrdersByCustomer": "/Orders?$filter=CardCode eq '{{CardCode}}' or CardName eq '{{CardName}}'"
+        },
+        "common_phrases": {
+            "FindSpecificOrder": ["find order", "get order", "show order", "order details", "order number"],
+            "FindOrdersByCustomer": ["orders for customer", "customer orders", "find orders by customer"]
+        }
+    },
+    "Invoices": {
+        "query_patterns": {
+            "FindInvoice": "/Invoices?$filter=DocNum eq {{DocNum}}",
+            "FindInvoicesByCustomer": "/Invoices?$filter=CardCode eq '{{CardCode}}' or CardName eq '{{CardName}}'"
+        },
+        "common_phrases": {
+            "FindInvoice": ["find invoice", "get invoice", "show invoice", "invoice details", "invoice number"],
+            "FindInvoicesByCustomer": ["invoices for customer", "customer invoices", "find invoices by customer"]
+        }
+    }
+})
+
+# Common field aliases per entity type, merged into get_entity_field_mapping when the
+# target field exists in the schema (keys are already lowercase)
+_COMMON_FIELD_MAPPINGS = MappingProxyType({
+    "BusinessPartners": {
+        "customer id": "CardCode",
+        "customer code": "CardCode",
+        "customer name": "CardName",
+        "phone": "Phone1",
+        "email": "EmailAddress",
+        "type": "CardType",
+        "group": "GroupCode",
+        "balance": "CurrentAccountBalance"
+    },
+    "Items": {
+        "item code": "ItemCode",
+        "item number": "ItemCode",
+        "product code": "ItemCode",
+        "product id": "ItemCode",
+        "item name": "ItemName",
+        "product name": "ItemName",
+        "description": "ItemName",
+        "price": "Price",
+        "stock": "QuantityOnStock",
+        "inventory": "QuantityOnStock",
+        "unit": "InventoryUOM",
+        "group": "ItemGroupCode"
+    },
+    "Orders": {
+        "order id": "DocNum",
+        "order number": "DocNum",
+        "order date": "DocDate",
+        "customer": "CardCode",
+        "customer name": "CardName",
+        "total": "DocTotal",
+        "status": "DocumentStatus",
+        "due date": "DocDueDate"
+    },
+    "Invoices": {
+        "invoice id": "DocNum",
+        "invoice number": "DocNum",
+        "invoice date": "DocDate",
+        "due date": "DocDueDate",
+        "customer": "CardCode",
+        "customer name": "CardName",
+        "total": "DocTotal",
+        "paid": "Paid"
+    }
+})
+
+# Common relationships in SAP B1 (relationship name -> related entity type)
+_COMMON_RELATIONSHIPS = MappingProxyType({
+    "BusinessPartners": MappingProxyType({
+        "orders": "Orders",
+        "invoices": "Invoices",
+        "contacts": "Contacts",
+        "addresses": "Addresses"
+    }),
+    "Items": MappingProxyType({
+        "warehouses": "WarehouseItemInfo",
+        "prices": "ItemPrices",
+        "inventory": "InventoryGenEntries"
+    }),
+    "Orders": MappingProxyType({
+        "customer": "BusinessPartners",
+        "items": "DocumentLines",
+        "delivery": "DeliveryNotes"
+    }),
+    "Invoices": MappingProxyType({
+        "customer": "BusinessPartners",
+        "items": "DocumentLines",
+        "payments": "IncomingPayments"
+    })
+})
+_EMPTY_MAPPING = MappingProxyType({})
+
+# Aliases used for any entity type without its own entry above
+_DEFAULT_COMMON_FIELD_MAPPINGS = MappingProxyType({
+    "id": "Code",
+    "code": "Code",
+    "name": "Name",
+    "date": "Date",
+    "description": "Description"
+})
+
 class HybridEntityRegistry:
     def __init__(self, service_layer_client):
         self.client = service_layer_client
@@ -44,24 +241,35 @@ class HybridEntityRegistry:
         self.discovered_schemas = {}
         self.entity_set_mappings = {}  # Maps endpoint names to entity types
         
+        # Union of all known entity types, maintained as entities are added
+        self._all_types = set(self.core_schemas)
+        
     async def initialize(self):
         """Initialize the registry with both pre-defined and discovered schemas"""
         # Fetch entity sets mapping (endpoint names to entity types)
         self._discover_entity_sets()
         
-        # Initialize entity metadata for core schemas
-        for entity_type in self.core_schemas:
-            if entity_type not in self.discovered_schemas:
-                try:
-                    schema = await self._discover_entity_schema(entity_type)
-                    # Merge with pre-defined schema
-                    self.discovered_schemas[entity_type] = {
-                        **schema,
-                        "common_filters": self.core_schemas[entity_type].get("common_filters", {}),
-                        "descriptive_field": self.core_schemas[entity_type].get("descriptive_field")
-                    }
-                except Exception as e:
-                    logger.warning(f"Could not discover schema for core entity {entity_type}: {str(e)}")
+        # Initialize entity metadata for core schemas, fetching the samples concurrently
+        pending_types = [et for et in self.core_schemas if et not in self.discovered_schemas]
+        results = await asyncio.gather(
+            *[self._discover_entity_schema(et) for et in pending_types],
+            return_exceptions=True
+        )
+        
+        for entity_type, schema in zip(pending_types, results):
+            if isinstance(schema, Exception):
+                logger.warning(f"Could not discover schema for core entity {entity_type}: {str(schema)}")
+                continue
+            # Merge with pre-defined schema (the discovered dict is already ours, so
+            # assign in place instead of unpacking into a new one)
+            core_schema = self.core_schemas[entity_type]
+            common_filters = core_schema.get("common_filters")
+            if common_filters is not None:
+                schema["common_filters"] = common_filters
+            descriptive_field = core_schema.get("descriptive_field")
+            if descriptive_field is not None:
+                schema["descriptive_field"] = descriptive_field
+            self.discovered_schemas[entity_type] = schema
         
     def _discover_entity_sets(self):
         """Discover all entity sets (endpoints) from the service document"""
@@ -75,12 +283,21 @@ class HybridEntityRegistry:
                 
             # Extract entity sets from service document
             if "value" in response:
-                # Handle format from the enhanced client
-                for entity_set in response.get("value", []):
-                    if isinstance(entity_set, str):
-                        self.entity_set_mappings[entity_set] = entity_set
-                    elif isinstance(entity_set, dict) and "name" in entity_set:
-                        self.entity_set_mappings[entity_set["name"]] = entity_set["name"]
+                # Handle format from the enhanced client (locals bound once for the loop)
+                mappings = self.entity_set_mappings
+                all_types = self._all_types
+                for entity_set in response.get("value", ()):
+                    entity_set_type = type(entity_set)
+                    if entity_set_type is str:
+                        name = entity_set
+                    elif entity_set_type is dict:
+                        name = entity_set.get("name")
+                        if not name:
+                            continue
+                    else:
+                        continue
+                    mappings[name] = name
+                    all_types.add(name)
             
             logger.info(f"Discovered {len(self.entity_set_mappings)} entity sets")
             
@@ -96,7 +313,10 @@ class HybridEntityRegistry:
         try:
             # Approach: Infer schema from a sample entity
             endpoint = self.entity_set_mappings.get(entity_type, entity_type)
-            response = self.client.execute_request(f"/{endpoint}?$top=1")
+            # The client is synchronous; run it in the default executor so concurrent
+            # discoveries overlap their round trips
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(None, self.client.execute_request, f"/{endpoint}?$top=1")
             
             if isinstance(response, dict) and "error" in response:
                 raise Exception(f"Failed to fetch sample for {entity_type}: {response.get('error')}")
@@ -122,8 +342,9 @@ class HybridEntityRegistry:
                 # We can't reliably determine keys from sample data alone
                 # so we'll assume the ID field or first property is the key
                 key_fields = []
-                for key_candidate in ["Id", f"{entity_type}ID", "Code", f"{entity_type}Code"]:
-                    if any(p["name"] == key_candidate for p in properties):
+                property_names = {p["name"] for p in properties}
+                for key_candidate in ("Id", f"{entity_type}ID", "Code", f"{entity_type}Code"):
+                    if key_candidate in property_names:
                         key_fields = [key_candidate]
                         break
                 
@@ -138,6 +359,7 @@ class HybridEntityRegistry:
                 
                 # Cache this schema
                 self.discovered_schemas[entity_type] = schema
+                self._all_types.add(entity_type)
                 return schema
             else:
                 raise Exception(f"No sample data available for {entity_type}")
@@ -156,36 +378,20 @@ class HybridEntityRegistry:
         """Infer property type from a value"""
         if value is None:
             return "Edm.String"  # Default assumption
-        elif isinstance(value, bool):
-            return "Edm.Boolean"
-        elif isinstance(value, int):
-            return "Edm.Int32"
-        elif isinstance(value, float):
-            return "Edm.Double"
-        elif isinstance(value, str):
+        
+        value_type = type(value)
+        if value_type is str:
             # Check if it looks like a date
-            if self._is_date_format(value):
-                return "Edm.DateTime"
-            return "Edm.String"
-        elif isinstance(value, dict):
-            return "Complex"
-        elif isinstance(value, list):
-            return "Collection"
-        else:
-            return "Edm.String"  # Default fallback
+            return "Edm.DateTime" if self._is_date_format(value) else "Edm.String"
+        
+        return _TYPE_MAP.get(value_type, "Edm.String")  # Default fallback
     
     def _is_date_format(self, value):
         """Check if a string looks like a date"""
-        # Simple date format check
-        date_patterns = [
-            r'\d{4}-\d{2}-\d{2}',  # ISO format
-            r'\d{4}/\d{2}/\d{2}',  # Slash format
-            r'\d{2}/\d{2}/\d{4}'   # US format
-        ]
-        for pattern in date_patterns:
-            if re.match(pattern, value):
-                return True
-        return False
+        # Cheap pre-filter: every supported format is 10+ chars and starts with two digits
+        if len(value) < 10 or not value[:2].isdigit():
+            return False
+        return _DATE_RE.match(value) is not None
         
     async def get_entity_schema(self, entity_type):
         """Get schema for an entity type, discovering it if needed"""
@@ -206,10 +412,21 @@ class HybridEntityRegistry:
         
     def get_all_entity_types(self):
         """Get all known entity types"""
-        # Combine pre-defined and discovered entities
-        return list(set(list(self.core_schemas.keys()) + 
-                       list(self.discovered_schemas.keys()) + 
-                       list(self.entity_set_mappings.keys())))
+        return list(self._all_types)
+    
+    def reindex_entity_types(self):
+        """Rebuild the entity type index after the schema dicts were replaced wholesale"""
+        self._all_types = set(self.core_schemas) | set(self.discovered_schemas) | set(self.entity_set_mappings)
+
+
+# Live integrations, flushed once at interpreter exit without keeping them alive until then
+_live_integrations = weakref.WeakSet()
+
+@atexit.register
+def _flush_live_integrations():
+    """Make sure schemas discovered since the last write are not lost on shutdown"""
+    for integration in list(_live_integrations):
+        integration.flush()
 
 
 class EntityRegistryIntegration:
@@ -218,6 +435,18 @@ class EntityRegistryIntegration:
     to enable dynamic entity discovery and improved entity coverage.
     """
     
+    # Common names that always map to a specific entity type
+    _DEFAULT_ENTITY_MAPPINGS = MappingProxyType({
+        "customer": "BusinessPartners",
+        "customers": "BusinessPartners",
+        "item": "Items",
+        "items": "Items",
+        "order": "Orders",
+        "orders": "Orders",
+        "invoice": "Invoices",
+        "invoices": "Invoices"
+    })
+    
     def __init__(self, sap_client):
         """
         Initialize the integration with a SAP client.
@@ -227,20 +456,36 @@ class EntityRegistryIntegration:
         """
         self.registry = HybridEntityRegistry(sap_client)
         self.initialized = False
-        self.known_entity_types = set()
+        # Immutable snapshot, replaced as a whole (never mutated) so concurrent readers
+        # always see a consistent set
+        self.known_entity_types = frozenset()
+        self._lc_known_types = {}  # Casefolded entity type -> actual entity type
+        self._entity_types_list = []  # known_entity_types as a list, for fuzzy matching
+        self._closest_entity_type = lru_cache(maxsize=512)(self._find_closest_entity_type)
         self.entity_type_mappings = {}  # Maps common names to actual entity types
+        self._enriched_schema_cache = {}  # Fully enriched schemas keyed by mapped entity type
+        self._intent_template_cache = {}  # Query templates keyed by intent
+        self._field_mapping_cache = {}  # Merged field mappings keyed by entity type
+        # Event loop -> {entity type: lock} coalescing concurrent schema fetches; asyncio locks
+        # are bound to one loop, and each loop's locks go away with it
+        self._schema_fetch_locks = weakref.WeakKeyDictionary()
         
         # Cache configuration
         self.cache_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache")
         self.cache_file = os.path.join(self.cache_dir, "entity_registry_cache.json")
         self.cache_ttl = 86400 * 7  # Cache time-to-live in seconds (7 days)
+        self.cache_save_interval = 30  # Minimum seconds between incremental cache writes
+        self._cache_dirty = False
+        self._last_cache_save = 0.0
+        
+        # Flushed at exit by _flush_live_integrations
+        _live_integrations.add(self)
         
         # Ensure cache directory exists
-        if not os.path.exists(self.cache_dir):
-            try:
-                os.makedirs(self.cache_dir)
-            except Exception as e:
-                logger.error(f"Failed to create cache directory: {str(e)}")
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+        except OSError as e:
+            logger.error(f"Failed to create cache directory: {str(e)}")
         
         # ADD: SAP B1 specific field mappings
         self.sap_b1_field_mappings = {
@@ -295,45 +540,94 @@ class EntityRegistryIntegration:
                 "s": "S"
             }
         }
+        
+        # Case-insensitive lookup views of the tables above, built once
+        self._sap_b1_field_mappings_cf = {
+            etype: {_casefold(k): v for k, v in mappings.items()}
+            for etype, mappings in self.sap_b1_field_mappings.items()
+        }
+        # Enum values keyed by (field name, casefolded value), for exact field-name matches
+        self._enum_flat = {
+            (field, _casefold(value)): enum_value
+            for field, mappings in self.sap_b1_enum_mappings.items()
+            for value, enum_value in mappings.items()
+        }
+        self._enum_fields = frozenset(self.sap_b1_enum_mappings)
+        self._condition_resolvers = {}  # Entity type -> filter condition fixer
     
-    def _is_cache_valid(self):
-        """Check if cache file exists and is not expired."""
-        if not os.path.exists(self.cache_file):
-            return False
-            
+    def _read_cache_file(self) -> Dict[str, Any]:
+        """Parse the cache file, using orjson when available"""
+        if orjson is not None:
+            with open(self.cache_file, 'rb') as f:
+                return orjson.loads(f.read())
+        with open(self.cache_file, 'r') as f:
+            return json.load(f)
+    
+    def _write_cache_file(self, cache_data: Dict[str, Any]):
+        """Serialize cache data to the cache file, using orjson when available"""
+        # Write to a uniquely named temp file and swap it in, so readers never see a partial
+        # file and concurrent writers (other instances or processes) don't clobber each other
+        f = tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix="entity_registry_cache.",
+                                        suffix=".tmp", delete=False)
+        try:
+            with f:
+                if orjson is not None:
+                    f.write(orjson.dumps(cache_data, option=orjson.OPT_INDENT_2))
+                else:
+                    f.write(json.dumps(cache_data, indent=2).encode("utf-8"))
+            os.replace(f.name, self.cache_file)
+        except BaseException:
+            try:
+                os.remove(f.name)
+            except OSError:
+                pass
+            raise
+    
+    def _try_load_cache(self) -> Optional[Dict[str, Any]]:
+        """
+        Read and validate the cache file in a single pass.
+        
+        Returns:
+            The parsed cache data, or None if the cache is missing, expired or invalid
+        """
         try:
-            # Check file modification time
+            # Check file modification time (also fails if the file does not exist)
             modified_time = os.path.getmtime(self.cache_file)
+        except OSError:
+            return None
+            
+        try:
             current_time = time.time()
             
             # Check if cache is expired
             if current_time - modified_time > self.cache_ttl:
                 logger.info(f"Cache is expired ({(current_time - modified_time) / 86400:.1f} days old)")
-                return False
+                return None
                 
             # Check if cache file is valid JSON
-            with open(self.cache_file, 'r') as f:
-                cache_data = json.load(f)
+            cache_data = self._read_cache_file()
                 
             # Check if cache has required keys
             required_keys = ["metadata", "entity_types", "entity_schemas", "entity_mappings"]
             if not all(key in cache_data for key in required_keys):
                 logger.warning(f"Cache file is missing required keys")
-                return False
+                return None
                 
-            return True
+            return cache_data
         except Exception as e:
             logger.warning(f"Error validating cache: {str(e)}")
-            return False
+            return None
     
-    def _load_from_cache(self):
-        """Load entity registry data from cache file."""
+    def _is_cache_valid(self):
+        """Check if cache file exists and is not expired."""
+        return self._try_load_cache() is not None
+    
+    def _apply_cache(self, cache_data: Dict[str, Any]):
+        """Load entity registry data from already-parsed cache data."""
         try:
-            with open(self.cache_file, 'r') as f:
-                cache_data = json.load(f)
-                
             # Load entity types
-            self.known_entity_types = set(cache_data["entity_types"])
+            self.known_entity_types = frozenset(cache_data["entity_types"])
+            self._index_known_entity_types()
             
             # Load entity mappings
             self.entity_type_mappings = cache_data["entity_mappings"]
@@ -341,6 +635,10 @@ class EntityRegistryIntegration:
             # Load entity schemas into registry
             self.registry.core_schemas = cache_data.get("core_schemas", self.registry.core_schemas)
             self.registry.discovered_schemas = cache_data["entity_schemas"]
+            self.registry.reindex_entity_types()
+            self._enriched_schema_cache = {}
+            self._intent_template_cache = {}
+            self._field_mapping_cache = {}
             
             logger.info(f"Loaded {len(self.known_entity_types)} entity types from cache")
             return True
@@ -362,8 +660,9 @@ class EntityRegistryIntegration:
                 "core_schemas": self.registry.core_schemas
             }
             
-            with open(self.cache_file, 'w') as f:
-                json.dump(cache_data, f, indent=2)
+            self._write_cache_file(cache_data)
+            self._cache_dirty = False
+            self._last_cache_save = time.time()
                 
             logger.info(f"Saved {len(self.known_entity_types)} entity types to cache")
             return True
@@ -371,31 +670,42 @@ class EntityRegistryIntegration:
             logger.error(f"Error saving to cache: {str(e)}")
             return False
     
+    def _mark_cache_dirty(self):
+        """Record unsaved registry changes, writing them out at most every cache_save_interval seconds"""
+        self._cache_dirty = True
+        if time.time() - self._last_cache_save >= self.cache_save_interval:
+            self._save_to_cache()
+    
+    def flush(self) -> bool:
+        """Write pending registry changes to the cache file, if there are any"""
+        if not self._cache_dirty:
+            return True
+        return self._save_to_cache()
+    
+    def _index_known_entity_types(self):
+        """Rebuild the casefolded lookup index for known entity types"""
+        self._lc_known_types = {_casefold(t): t for t in self.known_entity_types}
+        self._entity_types_list = list(self.known_entity_types)
+        # Fresh memo for close-match suggestions, so results for the old set are dropped
+        self._closest_entity_type = lru_cache(maxsize=512)(self._find_closest_entity_type)
+    
     def _build_entity_mappings(self):
         """Create mappings for common entity names to actual entity types"""
-        self.entity_type_mappings = {
-            "customer": "BusinessPartners",
-            "customers": "BusinessPartners", 
-            "item": "Items",
-            "items": "Items",
-            "order": "Orders",
-            "orders": "Orders",
-            "invoice": "Invoices",
-            "invoices": "Invoices"
-        }
-        # Add mappings from known entity types
-        for entity_type in self.known_entity_types:
-            self.entity_type_mappings[entity_type.lower()] = entity_type
+        self.entity_type_mappings = dict(self._DEFAULT_ENTITY_MAPPINGS)
+        # Add mappings from known entity types (reusing the lowercase index)
+        self.entity_type_mappings.update(self._lc_known_types)
     
     def refresh_cache(self, force=False):
         """Force a refresh of the entity registry cache."""
         if force or not self._is_cache_valid():
             self.initialized = False
-            if os.path.exists(self.cache_file):
-                try:
-                    os.remove(self.cache_file)
-                except:
-                    pass
+            self._enriched_schema_cache = {}
+            self._intent_template_cache = {}
+            self._field_mapping_cache = {}
+            try:
+                os.remove(self.cache_file)
+            except OSError:
+                pass
             asyncio.run(self.initialize())
             return True
         return False
@@ -408,8 +718,9 @@ class EntityRegistryIntegration:
         try:
             logger.info("Initializing entity registry...")
             
-            # Try to load from cache first
-            if self._is_cache_valid() and self._load_from_cache():
+            # Try to load from cache first (parsed once, then applied)
+            cache_data = self._try_load_cache()
+            if cache_data is not None and self._apply_cache(cache_data):
                 # Build entity mappings from cached data
                 self._build_entity_mappings()
                 self.initialized = True
@@ -418,7 +729,8 @@ class EntityRegistryIntegration:
                 
             # If cache is invalid or loading failed, initialize from API
             await self.registry.initialize()
-            self.known_entity_types = set(await self.registry.get_all_entity_types())
+            self.known_entity_types = frozenset(self.registry.get_all_entity_types())
+            self._index_known_entity_types()
             
             # Create mappings for common entity names to actual entity types
             self._build_entity_mappings()
@@ -432,7 +744,8 @@ class EntityRegistryIntegration:
             logger.error(f"Error initializing entity registry: {str(e)}")
             # Instead of raising, continue with minimal functionality
             self.initialized = True
-            self.known_entity_types = set(self.registry.core_schemas.keys())
+            self.known_entity_types = frozenset(self.registry.core_schemas)
+            self._index_known_entity_types()
             logger.info(f"Fallback to pre-defined schemas: {len(self.known_entity_types)} entity types")
 
     # Update the get_entity_schema method to use the cache
@@ -453,60 +766,25 @@ class EntityRegistryIntegration:
         # Map entity type if a common name was used
         mapped_entity_type = self.map_entity_type(entity_type)
         
+        # Serve the already-enriched schema when we have one
+        cached_schema = self._enriched_schema_cache.get(mapped_entity_type)
+        if cached_schema is not None:
+            return cached_schema
+        
         # Get the schema from the registry
         try:
             # Check if schema is in the cache
-            if mapped_entity_type in self.registry.discovered_schemas:
-                schema = self.registry.discovered_schemas[mapped_entity_type]
-            else:
-                # If not in cache, fetch from registry and add to cache
-                schema = await self.registry.get_entity_schema(mapped_entity_type)
-                # Save new schema to cache
-                self.registry.discovered_schemas[mapped_entity_type] = schema
-                self._save_to_cache()
+            schema = self.registry.discovered_schemas.get(mapped_entity_type)
+            if schema is None:
+                schema = await self._fetch_entity_schema(mapped_entity_type)
             
             # Add query_patterns for known entity types
-            if mapped_entity_type == "BusinessPartners":
-                schema["query_patterns"] = {
-                    "FindCustomer": "/BusinessPartners?$filter=CardType eq 'C' and CardName eq '{{CardName}}'",
-                    "ListCustomers": "/BusinessPartners?$filter=CardType eq 'C'",
-                    "FindSupplier": "/BusinessPartners?$filter=CardType eq 'S' and CardName eq '{{CardName}}'",
-                    "ListSuppliers": "/BusinessPartners?$filter=CardType eq 'S'"
-                }
-                schema["common_phrases"] = {
-                    "FindCustomer": ["find customer", "get customer", "show customer", "customer details"],
-                    "ListCustomers": ["list customers", "show all customers", "get customers"],
-                    "FindSupplier": ["find supplier", "get supplier", "show supplier", "supplier details"],
-                    "ListSuppliers": ["list suppliers", "show all suppliers", "get suppliers"]
-                }
-            elif mapped_entity_type == "Items":
-                schema["query_patterns"] = {
-                    "FindItem": "/Items?$filter=ItemCode eq '{{ItemCode}}' or ItemName eq '{{ItemName}}'",
-                    "ListItems": "/Items"
-                }
-                schema["common_phrases"] = {
-                    "FindItem": ["find item", "get item", "show item", "item details", "product details"],
-                    "ListItems": ["list items", "show all items", "get items", "list products"]
-                }
-            elif mapped_entity_type == "Orders":
-                schema["query_patterns"] = {
-                    "FindSpecificOrder": "/Orders?$filter=DocNum eq {{DocNum}}",
-                    "FindOrdersByCustomer": "/Orders?$filter=CardCode eq '{{CardCode}}' or CardName eq '{{CardName}}'"
-                }
-                schema["common_phrases"] = {
-                    "FindSpecificOrder": ["find order", "get order", "show order", "order details", "order number"],
-                    "FindOrdersByCustomer": ["orders for customer", "customer orders", "find orders by customer"]
-                }
-            elif mapped_entity_type == "Invoices":
-                schema["query_patterns"] = {
-                    "FindInvoice": "/Invoices?$filter=DocNum eq {{DocNum}}",
-                    "FindInvoicesByCustomer": "/Invoices?$filter=CardCode eq '{{CardCode}}' or CardName eq '{{CardName}}'"
-                }
-                schema["common_phrases"] = {
-                    "FindInvoice": ["find invoice", "get invoice", "show invoice", "invoice details", "invoice number"],
-                    "FindInvoicesByCustomer": ["invoices for customer", "customer invoices", "find invoices by customer"]
-                }
+            # (attached by reference on a copy so the stored schema is left untouched)
+            extensions = _STATIC_SCHEMA_EXTENSIONS.get(mapped_entity_type)
+            if extensions:
+                schema = {**schema, **extensions}
             
+            self._enriched_schema_cache[mapped_entity_type] = schema
             return schema
         except Exception as e:
             logger.error(f"Error getting schema for {mapped_entity_type}: {str(e)}")
@@ -518,6 +796,39 @@ class EntityRegistryIntegration:
                 "error": str(e)
             }
             
+    async def _fetch_entity_schema(self, entity_type: str) -> Dict[str, Any]:
+        """Fetch a schema missing from the cache, letting concurrent callers share one request"""
+        # Locks are kept (at most one per entity type per loop): dropping one while other
+        # tasks still queue on it would let a newcomer start a second fetch
+        loop = asyncio.get_running_loop()
+        loop_locks = self._schema_fetch_locks.get(loop)
+        if loop_locks is None:
+            loop_locks = self._schema_fetch_locks[loop] = {}
+        lock = loop_locks.get(entity_type)
+        if lock is None:
+            lock = loop_locks[entity_type] = asyncio.Lock()
+        
+        async with lock:
+            # Another task may have fetched it while we were waiting
+            schema = self.registry.discovered_schemas.get(entity_type)
+            if schema is None:
+                # If not in cache, fetch from registry and add to cache
+                schema = await self.registry.get_entity_schema(entity_type)
+                # Save new schema to cache (written out lazily)
+                self.registry.discovered_schemas[entity_type] = schema
+                self._mark_cache_dirty()
+            return schema
+    
+    def invalidate_schema(self, entity_type: str):
+        """Drop the cached schema for an entity type so the next lookup fetches it again"""
+        mapped_entity_type = self.map_entity_type(entity_type)
+        self._enriched_schema_cache.pop(mapped_entity_type, None)
+        # Field mappings are keyed by the caller's name (possibly an alias), so drop them all
+        self._field_mapping_cache = {}
+        self._intent_template_cache = {}
+        if self.registry.discovered_schemas.pop(mapped_entity_type, None) is not None:
+            self._mark_cache_dirty()
+    
     # Add this method to the EntityRegistryIntegration class
     async def get_query_template_for_intent(self, intent: str) -> Optional[str]:
         """
@@ -529,6 +840,10 @@ class EntityRegistryIntegration:
         Returns:
             A template string or None if no template is available
         """
+        # Intents come from a small fixed set, so templates are memoized per intent
+        if intent in self._intent_template_cache:
+            return self._intent_template_cache[intent]
+        
         try:
             if "." not in intent:
                 return None
@@ -541,26 +856,31 @@ class EntityRegistryIntegration:
             # Get schema for this entity type
             schema = await self.get_entity_schema(mapped_entity_type)
             
+            template = None
+            
             # Look for query patterns in schema
             if "query_patterns" in schema and action in schema["query_patterns"]:
-                return schema["query_patterns"][action]
+                template = schema["query_patterns"][action]
             
             # If no specific pattern, generate a basic one
-            if action.startswith("FindBy") and len(action) > 6:
+            elif action.startswith("FindBy") and len(action) > 6:
                 field = action[6:]  # Extract field name from "FindByX"
-                return f"/{mapped_entity_type}?$filter={field} eq '{{{{{field}}}}}'"
+                template = f"/{mapped_entity_type}?$filter={field} eq '{{{{{field}}}}}'"
             elif action == "Find":
                 # Get key fields from schema
                 key_fields = schema.get("key_fields", [])
                 if key_fields:
                     primary_key = key_fields[0]
-                    return f"/{mapped_entity_type}?$filter={primary_key} eq '{{{{{primary_key}}}}}'"
+                    template = f"/{mapped_entity_type}?$filter={primary_key} eq '{{{{{primary_key}}}}}'"
                 else:
-                    return f"/{mapped_entity_type}?$top=1"  # Fallback
+                    template = f"/{mapped_entity_type}?$top=1"  # Fallback
             elif action == "List":
-                return f"/{mapped_entity_type}"
+                template = f"/{mapped_entity_type}"
             
-            return None
+            # Don't pin results derived from a fallback (error) schema
+            if "error" not in schema:
+                self._intent_template_cache[intent] = template
+            return template
         except Exception as e:
             logger.error(f"Error getting query template for intent {intent}: {str(e)}")
             return None        
@@ -579,13 +899,17 @@ class EntityRegistryIntegration:
             return entity_type
             
         # Check for direct match (case insensitive)
-        entity_lower = entity_type.lower()
+        entity_lower = _casefold(entity_type)
         if entity_lower in self.entity_type_mappings:
             return self.entity_type_mappings[entity_lower]
+        
+        direct = self._lc_known_types.get(entity_lower)
+        if direct:
+            return direct
             
         # Try to match with partial name
-        for known_type in self.known_entity_types:
-            if known_type.lower().startswith(entity_lower) or entity_lower.startswith(known_type.lower()):
+        for known_lower, known_type in self._lc_known_types.items():
+            if known_lower.startswith(entity_lower) or entity_lower.startswith(known_lower):
                 return known_type
                 
         # Return original if no mapping found
@@ -604,16 +928,14 @@ class EntityRegistryIntegration:
         if not self.initialized:
             await self.initialize()
 
+        return self._suggest_entity_type_sync(query_text)
+    
+    def _suggest_entity_type_sync(self, query_text: str) -> Optional[str]:
+        """Synchronous core of suggest_entity_type; assumes the registry is initialized"""
         query_lower = query_text.lower()
 
         # ✅ IMPLEMENT PRIORITY MAP (higher precedence than normal logic)
-        priority_map = {
-            "order": "Orders",
-            "invoice": "Invoices",
-            "customer": "BusinessPartners",
-            "item": "Items"
-        }
-        for term, entity in priority_map.items():
+        for term, entity in _PRIORITY_ENTITY_TERMS:
             if term in query_lower and entity in self.known_entity_types:
                 print(f"🎯 Priority mapping matched term '{term}' to entity '{entity}'")
                 return entity
@@ -623,44 +945,45 @@ class EntityRegistryIntegration:
             if common_name in query_lower and entity_type in self.known_entity_types:
                 return entity_type
 
-        # Default fallbacks based on query context
-        if any(word in query_lower for word in ["buy", "sell", "selling", "purchase", "order"]):
-            if "Orders" in self.known_entity_types:
-                return "Orders"
-
-        if any(word in query_lower for word in ["invoice", "bill", "payment", "paid"]):
-            if "Invoices" in self.known_entity_types:
-                return "Invoices"
-
-        if any(word in query_lower for word in ["stock", "inventory", "product", "item"]):
-            if "Items" in self.known_entity_types:
-                return "Items"
-
-        if any(word in query_lower for word in ["customer", "client", "account"]):
-            if "BusinessPartners" in self.known_entity_types:
-                return "BusinessPartners"
+        # Default fallbacks based on query context (single regex pass over the query)
+        matched = {m.lastgroup for m in _FALLBACK_ENTITY_RE.finditer(query_lower)}
+        for entity in _FALLBACK_ENTITY_PRIORITY:
+            if entity in matched and entity in self.known_entity_types:
+                return entity
 
         return None
     
-    def enrich_structured_query(self, structured_query: Dict[str, Any], query_text: str) -> Dict[str, Any]:
+    def enrich_structured_query(self, structured_query: Dict[str, Any], query_text: str,
+                                inplace: bool = False) -> Dict[str, Any]:
         """
         Enrich a structured query with additional entity information from the registry.
         
         Args:
             structured_query: The structured query to enrich
             query_text: The original query text
+            inplace: If True, mutate structured_query directly instead of returning a copy
             
         Returns:
-            The enriched structured query
+            The enriched structured query (the original object when nothing changed)
         """
-        # Make a copy to avoid modifying the original
-        enriched_query = structured_query.copy()
+        enriched_query = structured_query
+        
+        def _writable() -> Dict[str, Any]:
+            # Copy-on-write: only pay for a copy once a key actually changes
+            nonlocal enriched_query
+            if not inplace and enriched_query is structured_query:
+                enriched_query = dict(structured_query)
+            return enriched_query
         
         # If no entity type is specified, try to suggest one
         if not enriched_query.get("entity_type"):
-            entity_type = asyncio.run(self.suggest_entity_type(query_text))
+            # Suggestion is pure in-memory lookup once initialized, so only the cold
+            # path needs an event loop
+            if not self.initialized:
+                asyncio.run(self.initialize())
+            entity_type = self._suggest_entity_type_sync(query_text)
             if entity_type:
-                enriched_query["entity_type"] = entity_type
+                _writable()["entity_type"] = entity_type
                 logger.info(f"Suggested entity type: {entity_type} for query: {query_text}")
         else:
             # Map the entity type if it's a common name
@@ -668,7 +991,7 @@ class EntityRegistryIntegration:
             mapped_type = self.map_entity_type(original_type)
             
             if mapped_type != original_type:
-                enriched_query["entity_type"] = mapped_type
+                _writable()["entity_type"] = mapped_type
                 logger.info(f"Mapped entity type from {original_type} to {mapped_type}")
         
         # Ensure customers have CardType filter
@@ -680,25 +1003,27 @@ class EntityRegistryIntegration:
                     has_card_type = True
                     break
             
-            # Add CardType filter if needed
+            # Add CardType filter if needed (on a new list so the caller's list is untouched)
             if not has_card_type:
-                if "filter_conditions" not in enriched_query:
-                    enriched_query["filter_conditions"] = []
-                
-                enriched_query["filter_conditions"].append({
+                writable_query = _writable()
+                writable_query["filter_conditions"] = list(writable_query.get("filter_conditions", [])) + [{
                     "field": "CardType",
                     "operator": "eq",
                     "value": "C"
-                })
+                }]
                 logger.info(f"Added CardType='C' filter for customer query")
                 
         return enriched_query
     
     async def validate_and_fix_structured_query(self, structured_query: Dict[str, Any], 
-                                               original_query: str) -> Dict[str, Any]:
+                                               original_query: str,
+                                               is_customer_query: Optional[bool] = None) -> Dict[str, Any]:
         """
         CRITICAL: Validate and fix structured query BEFORE URL construction
         This is the main fix for your field mapping issues
+        
+        is_customer_query lets callers that already checked the query for "customer"
+        pass the result instead of having it recomputed here.
         """
         if not structured_query:
             return structured_query
@@ -709,52 +1034,48 @@ class EntityRegistryIntegration:
             
         logger.info(f"🔍 Pre-validating query for {entity_type}")
         
-        # Create a copy to avoid modifying original
-        fixed_query = structured_query.copy()
+        filter_conditions = structured_query.get("filter_conditions") or []
+        if entity_type != "BusinessPartners":
+            needs_customer = False
+        elif is_customer_query is not None:
+            needs_customer = is_customer_query
+        else:
+            needs_customer = "customer" in _casefold(original_query)
+        
+        # Nothing to fix or add: hand back the query untouched
+        if not filter_conditions and not needs_customer:
+            return structured_query
+        
         fixes_applied = []
         
-        # Fix field names in filter conditions
-        filter_conditions = fixed_query.get("filter_conditions", [])
+        # Fix field names and enum values in filter conditions
+        # (conditions that need no fix are reused as-is; only changed ones get a new dict)
         fixed_conditions = []
+        seen_fields = set()
+        resolve_condition = self._get_condition_resolver(entity_type)
         
         for condition in filter_conditions:
             if not isinstance(condition, dict):
                 fixed_conditions.append(condition)
                 continue
-                
-            fixed_condition = condition.copy()
             
-            # Fix field name using SAP B1 mappings
             original_field = condition.get("field", "")
-            original_field_lower = original_field.lower()
-            
-            entity_mappings = self.sap_b1_field_mappings.get(entity_type, {})
-            if original_field_lower in entity_mappings:
-                correct_field = entity_mappings[original_field_lower]
-                fixed_condition["field"] = correct_field
-                fixes_applied.append(f"Field: {original_field} -> {correct_field}")
-                
-            # Fix enum values
-            field_name = fixed_condition.get("field", "")
             original_value = condition.get("value")
+            field_name, value = resolve_condition(original_field, original_value)
             
-            if isinstance(original_value, str):
-                for enum_field, mappings in self.sap_b1_enum_mappings.items():
-                    if enum_field in field_name:
-                        correct_value = mappings.get(original_value.lower(), original_value)
-                        if correct_value != original_value:
-                            fixed_condition["value"] = correct_value
-                            fixes_applied.append(f"Value: {original_value} -> {correct_value}")
-                        break
+            if field_name != original_field:
+                condition = {**condition, "field": field_name}
+                fixes_applied.append(f"Field: {original_field} -> {field_name}")
+            if value != original_value:
+                condition = {**condition, "value": value}
+                fixes_applied.append(f"Value: {original_value} -> {value}")
                         
-            fixed_conditions.append(fixed_condition)
-            
-        fixed_query["filter_conditions"] = fixed_conditions
+            fixed_conditions.append(condition)
+            seen_fields.add(field_name)
         
         # Add missing CardType for BusinessPartners customer queries
-        if entity_type == "BusinessPartners" and "customer" in original_query.lower():
-            has_cardtype = any(c.get("field") == "CardType" for c in fixed_conditions)
-            if not has_cardtype:
+        if needs_customer:
+            if "CardType" not in seen_fields:
                 fixed_conditions.append({
                     "field": "CardType",
                     "operator": "eq",
@@ -762,11 +1083,34 @@ class EntityRegistryIntegration:
                 })
                 fixes_applied.append("Added CardType='C' filter")
                 
-        if fixes_applied:
-            logger.info(f"✅ Applied {len(fixes_applied)} fixes: {fixes_applied}")
-            
+        if not fixes_applied:
+            return structured_query
+        
+        logger.info(f"✅ Applied {len(fixes_applied)} fixes: {fixes_applied}")
+        
+        # Copy only when something changed, to avoid modifying the original
+        fixed_query = structured_query.copy()
+        fixed_query["filter_conditions"] = fixed_conditions
         return fixed_query
     
+    def _get_condition_resolver(self, entity_type: str):
+        """Return the (field, value) -> (field, value) fixer for an entity type, built once per type"""
+        resolver = self._condition_resolvers.get(entity_type)
+        if resolver is None:
+            field_table = self._sap_b1_field_mappings_cf.get(entity_type, {})
+            enum_fields = self._enum_fields
+            enum_flat = self._enum_flat
+            
+            def resolver(field, value):
+                # SAP B1 field name for the entity, then its enum value spelling
+                field = field_table.get(_casefold(field), field)
+                if field in enum_fields and isinstance(value, str):
+                    value = enum_flat.get((field, _casefold(value)), value)
+                return field, value
+            
+            self._condition_resolvers[entity_type] = resolver
+        return resolver
+    
     async def get_all_entity_types(self) -> List[str]:
         """Get all known entity types from the registry"""
         if not self.initialized:
@@ -784,10 +1128,15 @@ class EntityRegistryIntegration:
         Returns:
             A dictionary mapping common field names to actual field names
         """
+        cached_mapping = self._field_mapping_cache.get(entity_type)
+        if cached_mapping is not None:
+            return cached_mapping
+        
         schema = await self.get_entity_schema(entity_type)
         field_mapping = {}
         
-        # Extract properties from schema
+        # Extract properties from schema (names decoded from JSON are interned so the
+        # long-lived mapping shares them with the identifier literals in the alias tables)
         properties = schema.get("properties", [])
         
         # Handle different schema formats
@@ -795,80 +1144,29 @@ class EntityRegistryIntegration:
             if all(isinstance(prop, str) for prop in properties):
                 # Simple list of property names
                 for prop in properties:
-                    field_mapping[prop.lower()] = prop
+                    field_mapping[_casefold(prop)] = sys.intern(prop)
             elif all(isinstance(prop, dict) for prop in properties):
                 # List of property objects
                 for prop in properties:
                     if "name" in prop:
-                        field_mapping[prop["name"].lower()] = prop["name"]
+                        field_mapping[_casefold(prop["name"])] = sys.intern(prop["name"])
         elif isinstance(properties, dict):
             # Dictionary of properties
             for prop_name in properties:
-                field_mapping[prop_name.lower()] = prop_name
+                field_mapping[_casefold(prop_name)] = sys.intern(prop_name)
         
         # Add common aliases for fields based on entity type
-        if entity_type == "BusinessPartners":
-            common_field_mappings = {
-                "customer id": "CardCode",
-                "customer code": "CardCode",
-                "customer name": "CardName",
-                "phone": "Phone1",
-                "email": "EmailAddress",
-                "type": "CardType",
-                "group": "GroupCode",
-                "balance": "CurrentAccountBalance"
-            }
-        elif entity_type == "Items":
-            common_field_mappings = {
-                "item code": "ItemCode",
-                "item number": "ItemCode",
-                "product code": "ItemCode",
-                "product id": "ItemCode",
-                "item name": "ItemName",
-                "product name": "ItemName",
-                "description": "ItemName",
-                "price": "Price",
-                "stock": "QuantityOnStock",
-                "inventory": "QuantityOnStock",
-                "unit": "InventoryUOM",
-                "group": "ItemGroupCode"
-            }
-        elif entity_type == "Orders":
-            common_field_mappings = {
-                "order id": "DocNum",
-                "order number": "DocNum",
-                "order date": "DocDate",
-                "customer": "CardCode",
-                "customer name": "CardName",
-                "total": "DocTotal",
-                "status": "DocumentStatus",
-                "due date": "DocDueDate"
-            }
-        elif entity_type == "Invoices":
-            common_field_mappings = {
-                "invoice id": "DocNum",
-                "invoice number": "DocNum",
-                "invoice date": "DocDate",
-                "due date": "DocDueDate",
-                "customer": "CardCode",
-                "customer name": "CardName",
-                "total": "DocTotal",
-                "paid": "Paid"
-            }
-        else:
-            common_field_mappings = {
-                "id": "Code",
-                "code": "Code",
-                "name": "Name",
-                "date": "Date",
-                "description": "Description"
-            }
+        common_field_mappings = _COMMON_FIELD_MAPPINGS.get(entity_type, _DEFAULT_COMMON_FIELD_MAPPINGS)
         
         # Add only field mappings that exist in the schema
+        existing_fields = set(field_mapping.values())
         for common_name, field_name in common_field_mappings.items():
-            if field_name in field_mapping.values():
-                field_mapping[common_name.lower()] = field_name
+            if field_name in existing_fields:
+                field_mapping[common_name] = field_name
         
+        # Fallback schemas (lookup errors) are not cached so the next call retries
+        if "error" not in schema:
+            self._field_mapping_cache[entity_type] = field_mapping
         return field_mapping
     
     async def map_field_name(self, entity_type: str, field_name: str) -> str:
@@ -889,9 +1187,9 @@ class EntityRegistryIntegration:
         field_mapping = await self.get_entity_field_mapping(entity_type)
         
         # Try to map the field name
-        field_lower = field_name.lower()
-        if field_lower in field_mapping:
-            return field_mapping[field_lower]
+        field_cf = _casefold(field_name)
+        if field_cf in field_mapping:
+            return field_mapping[field_cf]
             
         # Return original if no mapping found
         return field_name
@@ -915,16 +1213,32 @@ class EntityRegistryIntegration:
         # If the entity already exists, no correction needed
         if entity_type in self.known_entity_types:
             return entity_type
+        
+        # Same entity with different casing: return its canonical spelling
+        canonical = self._lc_known_types.get(_casefold(entity_type))
+        if canonical:
+            return canonical
             
         # Check if we can map it using common names
         mapped = self.map_entity_type(entity_type)
         if mapped != entity_type and mapped in self.known_entity_types:
             return mapped
             
-        # Try to find a close match using string similarity
+        # Try to find a close match using string similarity (memoized per registry state)
+        return self._closest_entity_type(entity_type)
+    
+    def _find_closest_entity_type(self, entity_type: str) -> Optional[str]:
+        """Return the known entity type most similar to entity_type, if any is close enough"""
         try:
-            import difflib
-            matches = difflib.get_close_matches(entity_type, self.known_entity_types, n=1, cutoff=0.7)
+            if fuzz_process is not None:
+                # Only approximately the difflib cutoff below: difflib's junk heuristic and
+                # rapidfuzz's Indel ratio score some pairs differently, so a borderline
+                # suggestion can depend on whether rapidfuzz is installed
+                match = fuzz_process.extractOne(entity_type, self._entity_types_list,
+                                                scorer=fuzz.ratio, score_cutoff=70)
+                return match[0] if match else None
+            
+            matches = difflib.get_close_matches(entity_type, self._entity_types_list, n=1, cutoff=0.7)
             if matches:
                 return matches[0]
         except Exception as e:
@@ -932,7 +1246,7 @@ class EntityRegistryIntegration:
             
         return None
     
-    def get_entity_relationships(self, entity_type: str) -> Dict[str, str]:
+    def get_entity_relationships(self, entity_type: str) -> Mapping[str, str]:
         """
         Get relationship information for an entity type.
         
@@ -940,41 +1254,12 @@ class EntityRegistryIntegration:
             entity_type: The entity type to get relationships for
             
         Returns:
-            A dictionary mapping relationship names to related entity types
+            A read-only mapping of relationship names to related entity types
         """
-        # Common relationships in SAP B1
-        common_relationships = {
-            "BusinessPartners": {
-                "orders": "Orders",
-                "invoices": "Invoices",
-                "contacts": "Contacts",
-                "addresses": "Addresses"
-            },
-            "Items": {
-                "warehouses": "WarehouseItemInfo",
-                "prices": "ItemPrices",
-                "inventory": "InventoryGenEntries"
-            },
-            "Orders": {
-                "customer": "BusinessPartners",
-                "items": "DocumentLines",
-                "delivery": "DeliveryNotes"
-            },
-            "Invoices": {
-                "customer": "BusinessPartners",
-                "items": "DocumentLines",
-                "payments": "IncomingPayments"
-            }
-        }
-        
         # Check if this entity type has predefined relationships
-        if entity_type in common_relationships:
-            return common_relationships[entity_type]
-            
-        # For now, return an empty dict for unknown entity types
-        # In a more sophisticated implementation, this could discover
-        # relationships by analyzing metadata
-        return {}
+        # For unknown entity types an empty mapping is returned for now; a more
+        # sophisticated implementation could discover relationships from metadata
+        return _COMMON_RELATIONSHIPS.get(entity_type, _EMPTY_MAPPING)
         
     def is_initialized(self) -> bool:
         """Check if the entity registry is initialized"""
@@ -982,9 +1267,10 @@ class EntityRegistryIntegration:
     
     def get_registry_status(self) -> Dict[str, Any]:
         """Get status information about the registry"""
+        entity_count = len(self.known_entity_types)
         return {
             "initialized": self.initialized,
-            "entity_count": len(self.known_entity_types),
-            "entity_types": list(self.known_entity_types)[:10],  # First 10 for brevity
-            "has_more_entities": len(self.known_entity_types) > 10
+            "entity_count": entity_count,
+            "entity_types": list(islice(self.known_entity_types, 10)),  # First 10 for brevity
+            "has_more_entities": entity_count > 10
         }
\ No newline at end of file
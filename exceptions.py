@@ -1,36 +1,66 @@
 # utils/exceptions.py
 
+import logging
+import re
+import traceback
+
 class SapODataError(Exception):
     """Base class for SAP OData API errors"""
-    pass
+    __slots__ = ()
 
 class AuthenticationError(SapODataError):
     """Error during authentication"""
-    pass
+    __slots__ = ()
 
 class QueryConstructionError(SapODataError):
     """Error constructing OData query"""
-    pass
+    __slots__ = ()
 
 class ConnectionError(SapODataError):
     """Error connecting to SAP B1 service"""
-    pass
+    __slots__ = ()
 
 class TimeoutError(SapODataError):
     """Request timed out"""
-    pass
+    __slots__ = ()
 
 class RequestError(SapODataError):
     """Error in request execution"""
-    pass
+    __slots__ = ()
 
 class EntityRegistryError(SapODataError):
     """Error in entity registry operations"""
-    pass
+    __slots__ = ()
 
 class MetadataError(SapODataError):
     """Error in metadata management"""
-    pass
+    __slots__ = ()
+
+# Mapping of technical error types to user-friendly messages
+_ERROR_MESSAGES = {
+    "request_execution": "Unable to complete your request to the SAP system",
+    "query_understanding": "I had trouble understanding your request",
+    "odata_construction": "There was an issue creating the request",
+    "parameter_handling": "There was an issue with the request parameters",
+    "intent_extraction": "I couldn't determine what you're asking for",
+    "query_orchestration": "I had trouble structuring your request",
+    "error_recovery": "I couldn't recover from a previous error",
+    "authentication": "Authentication error with SAP B1"
+}
+
+# Common error patterns and user-friendly interpretations, checked in order
+_COMMON_ERRORS = {
+    "Invalid filter condition": "The search criteria appears to be incorrect",
+    "not found": "The requested information couldn't be found",
+    "unauthorized": "You don't have permission to access this information",
+    "bad request": "The request format was invalid",
+    "Not Found": "The requested entity doesn't exist",
+    "timeout": "The request timed out. The server might be busy, please try again later"
+}
+_COMMON_ERRORS_CF = [(pattern.casefold(), interpretation) for pattern, interpretation in _COMMON_ERRORS.items()]
+
+# Technical prefix before the first colon ("SAP API Error: ...") stripped from user messages
+_TECH_PREFIX_RE = re.compile(r'^[^:]*(?:API|Error|SAP|OData)[^:]*:')
 
 # Add the new function below the exception classes
 def format_user_friendly_error(error_data: dict) -> str:
@@ -46,35 +76,14 @@ def format_user_friendly_error(error_data: dict) -> str:
     error_type = error_data.get("stage", "unknown")
     error_message = error_data.get("message", "Unknown error")
     error_details = error_data.get("details", {})
-    
-    # Mapping of technical error types to user-friendly messages
-    error_messages = {
-        "request_execution": "Unable to complete your request to the SAP system",
-        "query_understanding": "I had trouble understanding your request",
-        "odata_construction": "There was an issue creating the request",
-        "parameter_handling": "There was an issue with the request parameters",
-        "intent_extraction": "I couldn't determine what you're asking for",
-        "query_orchestration": "I had trouble structuring your request",
-        "error_recovery": "I couldn't recover from a previous error",
-        "authentication": "Authentication error with SAP B1"
-    }
-    
-    # Common error patterns and user-friendly interpretations
-    common_errors = {
-        "Invalid filter condition": "The search criteria appears to be incorrect",
-        "not found": "The requested information couldn't be found",
-        "unauthorized": "You don't have permission to access this information",
-        "bad request": "The request format was invalid",
-        "Not Found": "The requested entity doesn't exist",
-        "timeout": "The request timed out. The server might be busy, please try again later"
-    }
+    error_message_cf = error_message.casefold()
     
     # Start with a basic message based on error type
-    friendly_message = error_messages.get(error_type, "An error occurred")
+    friendly_message = _ERROR_MESSAGES.get(error_type, "An error occurred")
     
     # Look for common error patterns in the message
-    for pattern, interpretation in common_errors.items():
-        if pattern.lower() in error_message.lower():
+    for pattern_cf, interpretation in _COMMON_ERRORS_CF:
+        if pattern_cf in error_message_cf:
             friendly_message += f": {interpretation}"
             break
     else:
@@ -85,18 +94,17 @@ def format_user_friendly_error(error_data: dict) -> str:
             simplified_message = simplified_message[:100] + "..."
         
         # Remove technical prefixes/stack traces
-        if ":" in simplified_message:
-            parts = simplified_message.split(":", 1)
-            if any(prefix in parts[0] for prefix in ["API", "Error", "SAP", "OData"]):
-                simplified_message = parts[1].strip()
+        prefix_match = _TECH_PREFIX_RE.match(simplified_message)
+        if prefix_match:
+            simplified_message = simplified_message[prefix_match.end():].strip()
         
         friendly_message += f": {simplified_message}"
     
     # Add suggestions for recovery if applicable
     if error_type == "request_execution":
-        if "authentication" in error_message.lower():
+        if "authentication" in error_message_cf:
             friendly_message += ". Try checking your SAP credentials."
-        elif "timeout" in error_message.lower():
+        elif "timeout" in error_message_cf:
             friendly_message += ". The server might be busy, please try again with a more specific query."
     elif error_type == "query_understanding":
         friendly_message += ". Try rephrasing your request with more specific details."
@@ -115,12 +123,13 @@ def handle_metadata_error(operation_name, error, logger, critical=False):
     """
     logger.error(f"Error in {operation_name}: {str(error)}")
     
-    # Add debugging context
-    import traceback
-    logger.debug(f"Traceback for {operation_name}: {traceback.format_exc()}")
-    
-    # Log the stack trace
-    logger.debug(f"Stack trace for {operation_name}:\n{traceback.format_exc()}")
+    # Add debugging context (formatted once, and only when debug output is enabled)
+    if logger.isEnabledFor(logging.DEBUG):
+        tb = traceback.format_exc()
+        logger.debug("Traceback for %s: %s", operation_name, tb)
+        
+        # Log the stack trace
+        logger.debug("Stack trace for %s:\n%s", operation_name, tb)
     
     # Re-raise if critical
     if critical:
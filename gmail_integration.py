@@ -1,29 +1,69 @@
 # tools/gmail_integration.py
 
 import os
+import atexit
 import json
 import base64
+import hashlib
+import io
+import mimetypes
 import pickle
+import re
+import sqlite3
+import tempfile
+import time
 import asyncio
-from typing import Dict, Any, List, Optional
-from dataclasses import dataclass
+import threading
+import weakref
+from collections import deque
+from functools import lru_cache
+from typing import Dict, Any, Iterator, List, Literal, Optional, Tuple
+from dataclasses import asdict, dataclass, field, replace
 from datetime import datetime
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
+from email.message import EmailMessage
+from email.utils import parseaddr
 import logging
 
-# LLM imports
-from langchain_openai import ChatOpenAI
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import HumanMessage
+from cachetools import TTLCache
+import httpx
+import openai
+import tiktoken
+from lxml import html as lxml_html
+from pydantic import BaseModel, Field
+from tenacity import (
+    before_sleep_log,
+    retry,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_exponential_jitter,
+)
+
+try:
+    import faiss
+    import numpy as np
+except ImportError:  # Semantic classification cache is disabled without faiss
+    faiss = None
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib json module
+    orjson = None
+
+try:
+    import h2
+    HTTP2_AVAILABLE = True
+except ImportError:  # httpx needs h2 for HTTP/2, keep-alive HTTP/1.1 otherwise
+    HTTP2_AVAILABLE = False
 
 from google.auth.transport.requests import Request
+from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
+from googleapiclient.http import MediaIoBaseUpload
+from googleapiclient.model import JsonModel
 
 from utils.enhanced_errors import SAPAssistantError, format_error_for_response
+from utils.openai_limits import limited_async_http_client, limited_http_client
 from integration.enhanced_sap_client import SAPB1EnhancedClient
 
 logger = logging.getLogger(__name__)
@@ -35,6 +75,171 @@ SCOPES = [
     'https://www.googleapis.com/auth/gmail.modify'
 ]
 
+# Exact-match classification cache: identical emails (newsletters, notifications,
+# templated replies) reuse the earlier LLM result instead of paying for a new call
+CLASSIFICATION_CACHE_SIZE = 10_000
+CLASSIFICATION_CACHE_TTL = 3600  # seconds
+
+# Semantic classification cache: emails whose subject + body embed within this cosine
+# similarity of an earlier one from the same sender domain (same template, different
+# names/dates) reuse its result
+SEMANTIC_CACHE_MODEL = "text-embedding-3-small"
+SEMANTIC_CACHE_DIM = 1536
+SEMANTIC_CACHE_THRESHOLD = 0.92
+SEMANTIC_CACHE_MAX_ENTRIES = 50_000
+SEMANTIC_CACHE_CANDIDATES = 4  # Neighbours checked for one from the same sender domain
+
+# Both caches are persisted so worker restarts start warm: classifications in a SQLite
+# database (WAL mode), the semantic index in a faiss file saved every few insertions.
+# Index vectors carry the database row id of their classification, so instances and
+# processes sharing the files can't pair a vector with another one's result
+CLASSIFICATION_DB_FILE = "gmail_classification_cache.db"
+CLASSIFICATION_DB_TTL = 86400 * 7  # seconds
+SEMANTIC_INDEX_FILE = "gmail_semantic_cache_ids.faiss"
+SEMANTIC_INDEX_SAVE_EVERY = 100
+
+# Classification rules shared by the single-email and batch prompts
+CLASSIFICATION_RULES = """You are an expert email classifier for a business accounting system. Your job is to identify emails where customers are specifically requesting invoices, receipts, or billing documents.
+
+INVOICE REQUEST emails (classify as YES):
+- "I need the invoice for order #12345"
+- "Can you resend my receipt from last week?"
+- "Where is my bill for the recent purchase?"
+- "Please send me the invoice copy"
+- "I didn't receive the billing document for my order"
+- "Missing invoice for transaction ABC123"
+- "Could you email me the payment receipt?"
+- "I need a copy of my invoice for tax purposes"
+
+NOT INVOICE REQUEST emails (classify as NO):
+- Product announcements: "Meet Claude 4", "Welcome to Augment Code"
+- Marketing/newsletters: "Try Mermaid Chart pro today for free!"
+- Technical updates: "Now included in Pro: Claude Code, Integrations"
+- General support: "How to use our platform"
+- Order placement: "I want to buy product X" (placing new order, not requesting invoice)
+- Account issues: "Can't login to my account"
+- Product questions: "What features does Pro include?"
+- System notifications: "Your deployment was successful"
+- Social/casual: Any non-business related content
+
+EDGE CASES:
+- If someone mentions "order" but asks for invoice/receipt → YES
+- If someone mentions "payment" but it's about making a new payment → NO
+- If someone mentions "billing" but it's about billing issues/setup → NO
+- Marketing emails mentioning "invoice" in templates → NO"""
+
+# The single-email answer format is enforced by the LLMClassification schema
+SINGLE_RESPONSE_FORMAT = """Be very conservative - when in doubt, classify as NO."""
+
+BATCH_RESPONSE_FORMAT = """You will receive several numbered emails. Respond with a JSON object of the form
+{"results": [{"id": <email number>, "classification": "YES" or "NO", "confidence": <0.0-1.0>, "reasoning": "<one sentence explanation>"}, ...]}
+with exactly one entry per email.
+
+Be very conservative - when in doubt, classify as NO."""
+
+# Token budget for the email body sent to the classifier, after HTML, quoted replies
+# and signatures are stripped
+BODY_TOKEN_BUDGET = 300
+CLASSIFIER_MODEL = "gpt-4o-mini"
+
+_HTML_TAG_RE = re.compile(r'<(?:html|body|div|p|br|table|span)\b', re.IGNORECASE)
+_REPLY_CUTOFF_RE = re.compile(r'^(?:--$|-+\s*original message|sent from my\b|on\b.*\bwrote:$)', re.IGNORECASE)
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Cheap pre-filter run before the LLM: it only rejects obvious bulk mail; anything that
+# could be an invoice request goes to the LLM (a vendor's "please find attached invoice"
+# reads much like a customer's request to a regex)
+_MARKETING_SUBJECT_RE = re.compile(
+    r'\b(?:unsubscribe|newsletter|digest|webinar|product update)',
+    re.IGNORECASE
+)
+# Request parameters of the classifier calls (the OpenAI SDK is called directly, the
+# static system message is built once). Single emails answer against a strict schema
+_SINGLE_REQUEST_PARAMS = {
+    "model": CLASSIFIER_MODEL,
+    "temperature": 0.0,  # Zero temperature for consistent classification
+    "max_tokens": 200,
+    "response_format": {
+        "type": "json_schema",
+        "json_schema": {
+            "name": "email_classification",
+            "strict": True,
+            "schema": {
+                "type": "object",
+                "properties": {
+                    "classification": {"type": "string", "enum": ["YES", "NO"]},
+                    "confidence": {"type": "number"},
+                    "reasoning": {"type": "string"}
+                },
+                "required": ["classification", "confidence", "reasoning"],
+                "additionalProperties": False
+            }
+        }
+    }
+}
+_BATCH_REQUEST_PARAMS = {
+    "model": CLASSIFIER_MODEL,
+    "temperature": 0.0,
+    "max_tokens": 4096,
+    "response_format": {"type": "json_object"}
+}
+_SUBJECT_REQUEST_PARAMS = {
+    "model": CLASSIFIER_MODEL,
+    "temperature": 0.0,
+    "max_tokens": 1  # YES/NO in a single token
+}
+
+# Emails whose body has fewer characters than this are classified from the subject alone,
+# first with this table of (pattern, is invoice request, reason), then with a one-token prompt.
+# The first matching rule wins, so notifications are ruled out before any positive match
+SUBJECT_ONLY_MAX_BODY_CHARS = 20
+_SUBJECT_ONLY_RULES = (
+    (re.compile(
+        r'\b(?:password|verif(?:y|ication)|security alert|sign[- ]?in|log[- ]?in|'
+        r'shipped|delivered|out for delivery|invitation|accepted|declined)\b',
+        re.IGNORECASE
+    ), False, "No body, account/delivery/calendar notification subject"),
+    # Only subjects that explicitly ask for the document: "Please pay invoice ..." is not one
+    (re.compile(
+        r"\b(?:(?:resend|re-send|send (?:me|us)|copy of|request(?:ing)?(?: for)?|missing|where is|"
+        r"didn'?t (?:receive|get)|never (?:received|got))(?:\s+(?:a|an|the|my|our))?\s+(?:invoice|receipt)s?"
+        r"|(?:invoice|receipt)s?\s+(?:request|copy|missing|not received))\b",
+        re.IGNORECASE
+    ), True, "No body, subject asks for an invoice/receipt"),
+)
+_BULK_SENDER_PREFIXES = ("noreply", "no-reply", "no_reply", "donotreply", "do-not-reply",
+                         "marketing", "newsletter", "notifications", "mailer-daemon")
+
+# Message fetches per Gmail batch HTTP request (Gmail accepts 100 but advises at most 50)
+GMAIL_FETCH_BATCH_SIZE = 50
+
+# Largest email body decoded from a message (longer bodies are cut off)
+BODY_MAX_BYTES = 64 * 1024
+
+# Chunk size of the resumable upload used by send_email
+SEND_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Emails sent to the LLM per batch request in classify_emails
+CLASSIFICATION_BATCH_SIZE = 20
+
+# Maximum LLM requests in flight at once in the async classification pipeline
+CLASSIFIER_MAX_CONCURRENCY = 16
+
+# Long-lived connection pool shared by the classifier and embedding clients, so
+# concurrent classifications reuse open TLS connections instead of handshaking again
+OPENAI_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+OPENAI_HTTP_TIMEOUT = 30
+
+# Classifier requests are retried with exponential backoff and jitter, and only on
+# transient failures; auth and bad-request errors would fail the same way again
+_llm_retry = retry(
+    wait=wait_exponential_jitter(initial=0.5, max=8),
+    stop=stop_after_attempt(3),
+    retry=retry_if_exception_type((openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)),
+    before_sleep=before_sleep_log(logger, logging.WARNING),
+    reraise=True
+)
+
 @dataclass
 class GmailMessage:
     message_id: str
@@ -43,6 +248,7 @@ class GmailMessage:
     body: str
     received_at: datetime
     thread_id: str
+    headers: Dict[str, str] = field(default_factory=dict)  # Lowercased header name -> value
 
 @dataclass
 class EmailClassificationResult:
@@ -51,14 +257,139 @@ class EmailClassificationResult:
     reasoning: str
     classification_method: str
 
+def _result_to_json(result: EmailClassificationResult) -> str:
+    """Serialize a classification for the persistent caches"""
+    return json.dumps(asdict(result))
+
+def _result_from_json(data: str) -> EmailClassificationResult:
+    """Inverse of _result_to_json"""
+    return EmailClassificationResult(**json.loads(data))
+
+def _sender_domain(sender: str) -> str:
+    """Lowercased domain of a From header value ("Name <user@domain>" or a bare address)"""
+    return (parseaddr(sender or "")[1] or sender or "").rpartition('@')[2].lower()
+
+class LLMClassification(BaseModel):
+    """Structured answer of the single-email classifier (OpenAI structured outputs)"""
+    classification: Literal["YES", "NO"] = Field(..., description="YES if the email asks for an invoice, otherwise NO")
+    confidence: float = Field(..., description="Confidence in the classification, between 0.0 and 1.0")
+    reasoning: str = Field(..., description="One sentence explanation")
+
+class _OrjsonModel(JsonModel):
+    """JsonModel that decodes API responses with orjson (full messages carry large base64 bodies)"""
+    
+    def deserialize(self, content):
+        try:
+            body = orjson.loads(content)
+        except orjson.JSONDecodeError:
+            return super().deserialize(content)
+        if self._data_wrapper and isinstance(body, dict) and "data" in body:
+            body = body["data"]
+        return body
+
+class _TokenFileCredentials(Credentials):
+    """
+    OAuth credentials that write themselves back to their token file after every refresh.
+    
+    The cached Gmail service refreshes expired tokens on its own; without this the new
+    token (and a rotated refresh token) would only live in memory.
+    """
+    token_file: Optional[str] = None
+    
+    def refresh(self, request):
+        super().refresh(request)
+        if self.token_file:
+            try:
+                _save_credentials(self, self.token_file)
+            except OSError as e:
+                logger.warning(f"Could not save the refreshed Gmail token: {e}")
+
+def _save_credentials(creds: Credentials, token_file: str):
+    """Write OAuth credentials to the token file (JSON)"""
+    # Swapped in from a uniquely named temp file: the shared service may refresh from
+    # several threads, and readers must never see a partial token
+    with tempfile.NamedTemporaryFile('w', dir=os.path.dirname(token_file) or None,
+                                     prefix=os.path.basename(token_file) + ".", suffix=".tmp",
+                                     delete=False) as token:
+        token.write(creds.to_json())
+    os.replace(token.name, token_file)
+
+def _load_credentials(token_file: str) -> Optional[_TokenFileCredentials]:
+    """Load saved OAuth credentials (JSON), migrating a token pickled by older versions"""
+    if not os.path.exists(token_file):
+        legacy_token_file = os.path.splitext(token_file)[0] + ".pickle"
+        if not os.path.exists(legacy_token_file):
+            return None
+        with open(legacy_token_file, 'rb') as token:
+            _save_credentials(pickle.load(token), token_file)
+        logger.info(f"Migrated Gmail token from {legacy_token_file} to {token_file}")
+    
+    creds = _TokenFileCredentials.from_authorized_user_file(token_file, SCOPES)
+    creds.token_file = token_file
+    return creds
+
+
+@lru_cache(maxsize=1)
+def _get_service(token_file: str, credentials_file: str):
+    """Authenticate and build the Gmail API service once per process"""
+    creds = _load_credentials(token_file)
+    
+    if not creds or not creds.valid:
+        if creds and creds.expired and creds.refresh_token:
+            creds.refresh(Request())  # Saved to token_file by _TokenFileCredentials
+        else:
+            if not os.path.exists(credentials_file):
+                raise FileNotFoundError(f"""
+Gmail credentials file not found: {credentials_file}
+
+To set up Gmail integration:
+1. Go to Google Cloud Console: https://console.cloud.google.com/
+2. Create a project and enable Gmail API
+3. Create OAuth 2.0 credentials
+4. Download credentials.json and save as {credentials_file}
+""")
+            
+            flow = InstalledAppFlow.from_client_secrets_file(
+                credentials_file, SCOPES)
+            _save_credentials(flow.run_local_server(port=0), token_file)
+            # Reloaded so later refreshes inside the cached service are saved as well
+            creds = _load_credentials(token_file)
+    
+    model = _OrjsonModel() if orjson is not None else None
+    return build('gmail', 'v1', credentials=creds, cache_discovery=False, model=model)
+
+# Live tools, whose semantic index is flushed once at interpreter exit without
+# keeping them alive until then
+_live_tools = weakref.WeakSet()
+
+@atexit.register
+def _flush_live_tools():
+    """Make sure recent semantic cache insertions are not lost on shutdown"""
+    for tool in list(_live_tools):
+        tool.flush_semantic_index()
+
 class GmailIntegrationTool:
     """Gmail integration tool with LLM-only email classification"""
     
-    def __init__(self, credentials_file: str = "credentials.json", token_file: str = "gmail_token.pickle", 
-                 openai_api_key: str = None):
+    def __init__(self, credentials_file: str = "credentials.json", token_file: str = "gmail_token.json", 
+                 openai_api_key: str = None, http_client: Optional[httpx.Client] = None,
+                 http_async_client: Optional[httpx.AsyncClient] = None):
         self.credentials_file = credentials_file
         self.token_file = token_file
         self.service = None
+        # The service's httplib2 client is not thread-safe; agents may call in from worker threads
+        self._service_lock = threading.Lock()
+        self._encoding = None  # tiktoken encoding of the classifier model, loaded on first use
+        
+        # Exact-match cache of LLM classifications, shared by concurrent invoke calls
+        self._classification_cache = TTLCache(maxsize=CLASSIFICATION_CACHE_SIZE, ttl=CLASSIFICATION_CACHE_TTL)
+        self._classification_cache_lock = threading.Lock()
+        
+        # On-disk copy of both caches
+        self.cache_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache")
+        self._cache_db = self._open_cache_db()
+        self._semantic_unsaved = 0  # Semantic cache insertions not yet written to the index file
+        self._semantic_saver = None  # Thread writing the index file, one at a time
         
         # Initialize LLM for email classification
         self.openai_api_key = openai_api_key or os.getenv("OPENAI_API_KEY")
@@ -67,14 +398,28 @@ class GmailIntegrationTool:
             raise ValueError("OpenAI API key is required for LLM-based email classification. Set OPENAI_API_KEY environment variable or pass openai_api_key parameter.")
         
         try:
-            self.llm = ChatOpenAI(
-                model="gpt-4o-mini",  # More cost-effective than gpt-4
+            # Callers with their own OpenAI traffic can pass their pools to share them; every
+            # request goes through the process-wide OpenAI concurrency and rate limits
+            self._http_client = http_client or limited_http_client(
+                http2=HTTP2_AVAILABLE, limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT
+            )
+            self._http_async_client = http_async_client or limited_async_http_client(
+                http2=HTTP2_AVAILABLE, limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT
+            )
+            self.llm = openai.OpenAI(
+                api_key=self.openai_api_key,
+                timeout=OPENAI_HTTP_TIMEOUT,
+                max_retries=0,  # Retries are handled by _llm_retry
+                http_client=self._http_client
+            )
+            self.async_llm = openai.AsyncOpenAI(
                 api_key=self.openai_api_key,
-                temperature=0.0,  # Zero temperature for consistent classification
-                max_tokens=200,
-                timeout=30
+                timeout=OPENAI_HTTP_TIMEOUT,
+                max_retries=0,
+                http_client=self._http_async_client
             )
             self._setup_classification_prompt()
+            self._setup_semantic_cache()
             logger.info("LLM email classification initialized successfully")
         except Exception as e:
             logger.error(f"Failed to initialize LLM: {e}")
@@ -84,111 +429,297 @@ class GmailIntegrationTool:
     
     def _setup_classification_prompt(self):
         """Setup enhanced classification prompt for zero-shot learning"""
-        self.classification_prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an expert email classifier for a business accounting system. Your job is to identify emails where customers are specifically requesting invoices, receipts, or billing documents.
-
-INVOICE REQUEST emails (classify as YES):
-- "I need the invoice for order #12345"
-- "Can you resend my receipt from last week?"
-- "Where is my bill for the recent purchase?"
-- "Please send me the invoice copy"
-- "I didn't receive the billing document for my order"
-- "Missing invoice for transaction ABC123"
-- "Could you email me the payment receipt?"
-- "I need a copy of my invoice for tax purposes"
-
-NOT INVOICE REQUEST emails (classify as NO):
-- Product announcements: "Meet Claude 4", "Welcome to Augment Code"
-- Marketing/newsletters: "Try Mermaid Chart pro today for free!"
-- Technical updates: "Now included in Pro: Claude Code, Integrations"
-- General support: "How to use our platform"
-- Order placement: "I want to buy product X" (placing new order, not requesting invoice)
-- Account issues: "Can't login to my account"
-- Product questions: "What features does Pro include?"
-- System notifications: "Your deployment was successful"
-- Social/casual: Any non-business related content
-
-EDGE CASES:
-- If someone mentions "order" but asks for invoice/receipt → YES
-- If someone mentions "payment" but it's about making a new payment → NO
-- If someone mentions "billing" but it's about billing issues/setup → NO
-- Marketing emails mentioning "invoice" in templates → NO
-
-You must respond in this EXACT format:
-CLASSIFICATION: [YES/NO]
-CONFIDENCE: [0.0-1.0]
-REASONING: [one sentence explanation]
-
-Be very conservative - when in doubt, classify as NO."""),
-            ("human", """Please classify this email:
-
-SUBJECT: {subject}
-
-FROM: {sender}
-
-BODY: {body}
-
-Classify this email according to the rules above.""")
-        ])
+        # Static system messages: a byte-identical leading prefix on every call, which
+        # the API can cache; only the user message is built per email
+        self._system_message = {"role": "system", "content": CLASSIFICATION_RULES + "\n\n" + SINGLE_RESPONSE_FORMAT}
+        
+        # Batch variant used by classify_emails: one request, JSON answer for every email
+        self._batch_system_message = {"role": "system", "content": CLASSIFICATION_RULES + "\n\n" + BATCH_RESPONSE_FORMAT}
     
-    def _authenticate(self):
-        """Authenticate with Gmail API"""
-        creds = None
+    def _setup_semantic_cache(self):
+        """Create the embedding model and ANN index backing the semantic classification cache"""
+        self._semantic_index = None
+        self._semantic_results = {}  # (sender domain, classification) per index id (semantic_entries row id)
         
-        if os.path.exists(self.token_file):
-            with open(self.token_file, 'rb') as token:
-                creds = pickle.load(token)
+        if faiss is None:
+            logger.info("faiss not installed, semantic classification cache disabled")
+            return
         
-        if not creds or not creds.valid:
-            if creds and creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-            else:
-                if not os.path.exists(self.credentials_file):
-                    raise FileNotFoundError(f"""
-Gmail credentials file not found: {self.credentials_file}
-
-To set up Gmail integration:
-1. Go to Google Cloud Console: https://console.cloud.google.com/
-2. Create a project and enable Gmail API
-3. Create OAuth 2.0 credentials
-4. Download credentials.json and save as {self.credentials_file}
-""")
-                
-                flow = InstalledAppFlow.from_client_secrets_file(
-                    self.credentials_file, SCOPES)
-                creds = flow.run_local_server(port=0)
-            
-            with open(self.token_file, 'wb') as token:
-                pickle.dump(creds, token)
+        self._semantic_index = self._load_semantic_index()
+        if self._semantic_index is None:
+            # Inner product over L2-normalized vectors is cosine similarity
+            hnsw = faiss.IndexHNSWFlat(SEMANTIC_CACHE_DIM, 16, faiss.METRIC_INNER_PRODUCT)
+            hnsw.hnsw.efConstruction = 200
+            self._semantic_index = faiss.IndexIDMap(hnsw)
+        
+        # Flushed at exit by _flush_live_tools
+        _live_tools.add(self)
+    
+    def _open_cache_db(self) -> Optional[sqlite3.Connection]:
+        """Open the persistent classification cache, or None if it is unavailable"""
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            # Shared by worker threads, every use is guarded by _classification_cache_lock
+            conn = sqlite3.connect(
+                os.path.join(self.cache_dir, CLASSIFICATION_DB_FILE),
+                isolation_level=None,
+                check_same_thread=False
+            )
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS classifications "
+                         "(key BLOB PRIMARY KEY, result TEXT NOT NULL, created REAL NOT NULL)")
+            # AUTOINCREMENT: ids are never reused, so an old index file can't point at a newer row
+            conn.execute("DROP TABLE IF EXISTS semantic_results")  # Position-keyed, before ids were stored
+            conn.execute("CREATE TABLE IF NOT EXISTS semantic_entries "
+                         "(id INTEGER PRIMARY KEY AUTOINCREMENT, sender_domain TEXT NOT NULL, result TEXT NOT NULL)")
+            conn.execute("DELETE FROM classifications WHERE created < ?", (time.time() - CLASSIFICATION_DB_TTL,))
+            return conn
+        except (OSError, sqlite3.Error) as e:
+            logger.warning(f"Persistent classification cache disabled: {e}")
+            return None
+    
+    def _load_semantic_index(self):
+        """Load the saved semantic index and its classifications, or None to start empty"""
+        if self._cache_db is None:
+            return None
+        index_file = os.path.join(self.cache_dir, SEMANTIC_INDEX_FILE)
+        try:
+            if not os.path.exists(index_file):
+                return None
+            index = faiss.read_index(index_file)
+            ids = faiss.vector_to_array(index.id_map).tolist()
+            if not ids:
+                return None
+            # The file may have been saved by another instance: look results up by id.
+            # Rows it doesn't hold, up to its newest one, belong to vectors whose index
+            # was overwritten before being saved, so nothing can find them anymore
+            saved_ids = set(ids)
+            rows = self._cache_db.execute(
+                "SELECT id, sender_domain, result FROM semantic_entries WHERE id <= ?", (max(ids),)
+            ).fetchall()
+            self._cache_db.executemany(
+                "DELETE FROM semantic_entries WHERE id = ?",
+                [(row[0],) for row in rows if row[0] not in saved_ids]
+            )
+            self._semantic_results = {
+                row[0]: (row[1], _result_from_json(row[2])) for row in rows if row[0] in saved_ids
+            }
+            logger.info(f"Loaded {len(self._semantic_results)} semantic cache entries")
+            return index
+        except Exception as e:
+            logger.warning(f"Could not load the semantic cache: {e}")
+        return None
+    
+    def flush_semantic_index(self):
+        """Write the semantic index to disk if it has unsaved insertions"""
+        if self._semantic_index is None or self._cache_db is None:
+            return
+        saver = self._semantic_saver
+        if saver is not None:
+            saver.join()
+        if self._semantic_unsaved:
+            self._save_semantic_index()
+    
+    def _schedule_semantic_save(self):
+        """Save the index in a background thread, unless a save is already running"""
+        with self._classification_cache_lock:
+            if self._semantic_saver is not None and self._semantic_saver.is_alive():
+                return
+            self._semantic_saver = threading.Thread(
+                target=self._save_semantic_index, name="semantic-cache-save", daemon=True
+            )
+            self._semantic_saver.start()
+    
+    def _save_semantic_index(self):
+        """Write the semantic index file; only the in-memory snapshot is taken under the lock"""
+        with self._classification_cache_lock:
+            snapshot = faiss.serialize_index(self._semantic_index)
+            saved = self._semantic_unsaved
+        try:
+            # Write to a uniquely named temp file and swap it in, so readers never see a
+            # partial file and concurrent writers don't clobber each other's temp file
+            f = tempfile.NamedTemporaryFile(dir=self.cache_dir, prefix=SEMANTIC_INDEX_FILE + ".",
+                                            suffix=".tmp", delete=False)
+        except OSError as e:
+            logger.warning(f"Could not save the semantic cache index: {e}")
+            return
+        try:
+            with f:
+                f.write(memoryview(snapshot))
+            os.replace(f.name, os.path.join(self.cache_dir, SEMANTIC_INDEX_FILE))
+        except Exception as e:
+            logger.warning(f"Could not save the semantic cache index: {e}")
+            try:
+                os.remove(f.name)
+            except OSError:
+                pass
+            return
+        with self._classification_cache_lock:
+            self._semantic_unsaved -= saved
+    
+    def _embed_for_cache(self, emails: List[Tuple[GmailMessage, str]]):
+        """
+        Normalized embeddings of (message, body preview) pairs for the semantic cache.
         
-        self.service = build('gmail', 'v1', credentials=creds)
+        All emails go in one embeddings request. Returns one row per email, or None if
+        the cache is disabled or the request failed.
+        """
+        if self._semantic_index is None or not emails:
+            return None
+        texts = [
+            f"{_sender_domain(message.sender)}\n{message.subject or ''}\n{body_preview}"
+            for message, body_preview in emails
+        ]
+        try:
+            response = self.llm.embeddings.create(model=SEMANTIC_CACHE_MODEL, input=texts)
+            vectors = np.asarray(
+                [item.embedding for item in sorted(response.data, key=lambda item: item.index)], dtype='float32'
+            )
+            faiss.normalize_L2(vectors)
+            return vectors
+        except Exception as e:
+            logger.warning(f"Embedding for semantic cache failed: {e}")
+            return None
+    
+    def _semantic_cache_get(self, vector, sender_domain: str) -> Optional[EmailClassificationResult]:
+        """Return the cached classification of the nearest similar-enough email from the same sender domain"""
+        with self._classification_cache_lock:
+            if self._semantic_index.ntotal == 0:
+                return None
+            scores, ids = self._semantic_index.search(vector, SEMANTIC_CACHE_CANDIDATES)
+            for score, entry_id in zip(scores[0], ids[0]):
+                if entry_id < 0 or score < SEMANTIC_CACHE_THRESHOLD:
+                    return None
+                entry = self._semantic_results.get(int(entry_id))
+                if entry is not None and entry[0] == sender_domain:
+                    return entry[1]
+            return None
+    
+    def _semantic_cache_add(self, vector, sender_domain: str, result: EmailClassificationResult):
+        """Remember a classification under its embedding (until the index is full)"""
+        with self._classification_cache_lock:
+            if self._semantic_index.ntotal >= SEMANTIC_CACHE_MAX_ENTRIES:
+                return
+            if self._cache_db is None:
+                entry_id = self._semantic_index.ntotal
+            else:
+                try:
+                    entry_id = self._cache_db.execute(
+                        "INSERT INTO semantic_entries (sender_domain, result) VALUES (?, ?)",
+                        (sender_domain, _result_to_json(result))
+                    ).lastrowid
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not persist semantic cache entry: {e}")
+                    return
+            self._semantic_index.add_with_ids(vector, np.asarray([entry_id], dtype='int64'))
+            self._semantic_results[entry_id] = (sender_domain, result)
+            if self._cache_db is None:
+                return
+            self._semantic_unsaved += 1
+            save_due = self._semantic_unsaved >= SEMANTIC_INDEX_SAVE_EVERY
+        if save_due:
+            self._schedule_semantic_save()
+    
+    def _authenticate(self):
+        """Authenticate with Gmail API (the service is shared by all tools using the same token)"""
+        self.service = _get_service(os.path.abspath(self.token_file), os.path.abspath(self.credentials_file))
+        # Resource stubs are rebuilt on every attribute chain, build them once
+        self._users = self.service.users()
+        self._msgs = self._users.messages()
         logger.info("Gmail authentication successful")
     
-    def get_messages(self, query: str = "is:unread", max_results: int = 50) -> List[GmailMessage]:
-        """Get messages from Gmail based on query"""
+    def _execute(self, request):
+        """Execute a Gmail API (or batch) request, one at a time across threads"""
+        with self._service_lock:
+            return request.execute()
+    
+    def get_messages(self, query: str = "is:unread", max_results: int = 50,
+                     fetch_body: bool = True) -> List[GmailMessage]:
+        """
+        Get messages from Gmail based on query.
+        
+        With fetch_body=False only the From/Subject/Date headers are downloaded
+        (format=metadata) and the returned messages have an empty body.
+        """
+        return list(self.iter_messages(query, max_results, fetch_body))
+    
+    def iter_messages(self, query: str = "is:unread", max_results: int = 50,
+                      fetch_body: bool = True) -> Iterator[GmailMessage]:
+        """
+        Yield messages from Gmail based on query, as each fetch batch arrives.
+        
+        Callers can start processing the first messages before the rest are downloaded,
+        and only one batch of message bodies is held at a time.
+        """
         try:
-            results = self.service.users().messages().list(
+            results = self._execute(self._msgs.list(
                 userId='me', 
                 q=query,
                 maxResults=max_results
-            ).execute()
+            ))
             
             messages = results.get('messages', [])
-            gmail_messages = []
             
-            for msg in messages:
-                message = self.service.users().messages().get(
-                    userId='me', 
-                    id=msg['id'],
-                    format='full'
-                ).execute()
-                
-                gmail_msg = self._parse_message(message)
-                if gmail_msg:
-                    gmail_messages.append(gmail_msg)
+            # Fetch the full messages with batch HTTP requests instead of one round trip each
+            for start in range(0, len(messages), GMAIL_FETCH_BATCH_SIZE):
+                chunk = messages[start:start + GMAIL_FETCH_BATCH_SIZE]
+                yield from self._fetch_and_parse_chunk(chunk, fetch_body)
             
-            return gmail_messages
+        except Exception as e:
+            raise SAPAssistantError(
+                message=f"Error reading Gmail: {str(e)}",
+                code="GMAIL_READ_ERROR",
+                can_retry=True
+            )
+    
+    async def get_messages_async(self, query: str = "is:unread", max_results: int = 50,
+                                 fetch_body: bool = True) -> List[GmailMessage]:
+        """Async variant of get_messages; the blocking Gmail calls run in a worker thread"""
+        gmail_messages = []
+        async for chunk in self._iter_message_chunks_async(query, max_results, fetch_body):
+            gmail_messages.extend(chunk)
+        return gmail_messages
+    
+    async def get_and_classify_messages_async(
+            self, query: str = "is:unread", max_results: int = 50,
+            fetch_body: bool = True) -> List[Tuple[GmailMessage, EmailClassificationResult]]:
+        """
+        Fetch and classify messages as one pipeline.
+        
+        Each fetched chunk is handed to the classifier right away, so the LLM requests of
+        one chunk overlap with the Gmail fetch of the next instead of waiting for all of them.
+        
+        Returns:
+            (message, classification) pairs in the order of the Gmail list response
+        """
+        classify_tasks = []
+        async for chunk in self._iter_message_chunks_async(query, max_results, fetch_body):
+            classify_tasks.append((chunk, asyncio.create_task(self.aclassify_emails(chunk))))
+        
+        pairs = []
+        for chunk, task in classify_tasks:
+            pairs.extend(zip(chunk, await task))
+        return pairs
+    
+    async def _iter_message_chunks_async(self, query: str, max_results: int, fetch_body: bool):
+        """Yield the parsed messages matching query, one fetch batch at a time"""
+        try:
+            results = await asyncio.to_thread(
+                self._execute,
+                self._msgs.list(
+                    userId='me',
+                    q=query,
+                    maxResults=max_results
+                )
+            )
+            messages = results.get('messages', [])
             
+            # The service's HTTP client is not thread-safe, so batches are fetched one after
+            # another; the overlap comes from classifying a chunk while the next one downloads
+            for start in range(0, len(messages), GMAIL_FETCH_BATCH_SIZE):
+                chunk = messages[start:start + GMAIL_FETCH_BATCH_SIZE]
+                yield await asyncio.to_thread(self._fetch_and_parse_chunk, chunk, fetch_body)
+                
         except Exception as e:
             raise SAPAssistantError(
                 message=f"Error reading Gmail: {str(e)}",
@@ -196,28 +727,59 @@ To set up Gmail integration:
                 can_retry=True
             )
     
+    def _fetch_and_parse_chunk(self, chunk: List[dict], fetch_body: bool) -> List[GmailMessage]:
+        """Fetch one chunk of a list response and parse it, keeping the list order"""
+        fetched = self._fetch_message_batch([msg['id'] for msg in chunk], fetch_body)
+        
+        gmail_messages = []
+        for msg in chunk:
+            message = fetched.get(msg['id'])
+            if message is None:
+                continue
+            gmail_msg = self._parse_message(message)
+            if gmail_msg:
+                gmail_messages.append(gmail_msg)
+        return gmail_messages
+    
+    def _fetch_message_batch(self, message_ids: List[str], fetch_body: bool = True) -> Dict[str, dict]:
+        """Fetch several messages in one Gmail batch HTTP request, keyed by message id"""
+        if fetch_body:
+            get_kwargs = {'format': 'full'}
+        else:
+            get_kwargs = {'format': 'metadata', 'metadataHeaders': ['From', 'Subject', 'Date', 'List-Unsubscribe']}
+
+        fetched = {}
+        
+        def on_fetched(request_id, response, exception):
+            if exception is not None:
+                logger.error(f"Error fetching message {request_id}: {exception}")
+            else:
+                fetched[request_id] = response
+        
+        batch = self.service.new_batch_http_request(callback=on_fetched)
+        for message_id in message_ids:
+            batch.add(
+                self._msgs.get(
+                    userId='me',
+                    id=message_id,
+                    **get_kwargs
+                ),
+                request_id=message_id
+            )
+        self._execute(batch)
+        return fetched
+    
     def _parse_message(self, message: dict) -> Optional[GmailMessage]:
         """Parse Gmail message into our format"""
         try:
-            headers = message['payload'].get('headers', [])
-            
-            sender = ""
-            subject = ""
-            
-            for header in headers:
-                name = header.get('name', '').lower()
-                value = header.get('value', '')
-                
-                if name == 'from':
-                    sender = value
-                elif name == 'subject':
-                    subject = value
+            headers = {
+                header.get('name', '').lower(): header.get('value', '')
+                for header in message['payload'].get('headers', [])
+            }
             
-            # Extract email address from sender
-            if '<' in sender and '>' in sender:
-                sender_email = sender.split('<')[1].split('>')[0]
-            else:
-                sender_email = sender
+            # Extract email address from sender ("Name <address>" or a bare address)
+            sender = headers.get('from', '')
+            sender_email = parseaddr(sender)[1] or sender
             
             # Extract body
             body = self._extract_body(message['payload'])
@@ -225,10 +787,11 @@ To set up Gmail integration:
             return GmailMessage(
                 message_id=message['id'],
                 sender=sender_email,
-                subject=subject,
+                subject=headers.get('subject', ''),
                 body=body,
                 received_at=datetime.now(),
-                thread_id=message['threadId']
+                thread_id=message['threadId'],
+                headers=headers
             )
             
         except Exception as e:
@@ -236,51 +799,169 @@ To set up Gmail integration:
             return None
     
     def _extract_body(self, payload: dict) -> str:
-        """Extract text body from Gmail message payload"""
-        body = ""
-        
-        if 'parts' in payload:
-            for part in payload['parts']:
-                if part['mimeType'] == 'text/plain':
-                    data = part['body'].get('data', '')
-                    if data:
-                        body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
-                        break
-        elif payload['mimeType'] == 'text/plain':
-            data = payload['body'].get('data', '')
-            if data:
-                body = base64.urlsafe_b64decode(data).decode('utf-8', errors='ignore')
+        """
+        Extract text body from Gmail message payload.
         
-        return body
+        Walks the MIME tree breadth-first (nested multipart/alternative included) and
+        returns the first text/plain part, else the text of the first text/html part.
+        Metadata-only fetches carry no body and give an empty string.
+        """
+        html_data = None
+        parts = deque([payload])
+        while parts:
+            part = parts.popleft()
+            mime_type = part.get('mimeType', '')
+            data = (part.get('body') or {}).get('data')
+            
+            if data and mime_type == 'text/plain':
+                return self._decode_body_data(data)
+            if data and mime_type == 'text/html' and html_data is None:
+                html_data = data
+            parts.extend(part.get('parts') or ())
+        
+        if html_data is None:
+            return ""
+        
+        html = self._decode_body_data(html_data)
+        try:
+            return lxml_html.fromstring(html).text_content()
+        except Exception:
+            return html  # Not parseable as HTML, keep the raw text
+    
+    def _decode_body_data(self, data: str) -> str:
+        """Decode base64url body data, at most BODY_MAX_BYTES of it"""
+        # Slice the encoded string (on a 4-character boundary) instead of decoding it all
+        max_chars = BODY_MAX_BYTES // 3 * 4
+        return base64.urlsafe_b64decode(data[:max_chars]).decode('utf-8', errors='ignore')
+    
+    def _classification_cache_key(self, subject: str, sender: str, body_preview: str) -> bytes:
+        """Stable digest of the fields the classifier sees (sender reduced to its domain)"""
+        sender_domain = sender.rpartition('@')[2].lower()
+        raw = f"{subject}\x00{sender_domain}\x00{body_preview}".encode('utf-8', errors='ignore')
+        return hashlib.blake2b(raw, digest_size=16).digest()
+    
+    def _body_preview(self, message: GmailMessage) -> str:
+        """Body text sent to the classifier (limited for cost and context efficiency)"""
+        return self._compress_body(message.body) if message.body else ""
+    
+    def _compress_body(self, body: str) -> str:
+        """Reduce an email body to its own text, truncated to BODY_TOKEN_BUDGET tokens"""
+        # Cap the input first; only the first few hundred tokens survive anyway
+        text = body[:BODY_TOKEN_BUDGET * 16]
+        
+        if _HTML_TAG_RE.search(text):
+            try:
+                text = lxml_html.fromstring(text).text_content()
+            except Exception:
+                pass  # Not parseable as HTML, classify the raw text
+        
+        # Drop quoted replies; stop at the signature or the quoted-reply header
+        kept_lines = []
+        for line in text.splitlines():
+            line = line.strip()
+            if line.startswith('>'):
+                continue
+            if _REPLY_CUTOFF_RE.match(line):
+                break
+            kept_lines.append(line)
+        text = _WHITESPACE_RE.sub(' ', ' '.join(kept_lines)).strip()
+        
+        encoding = self._get_encoding()
+        if encoding is None:
+            return text[:BODY_TOKEN_BUDGET * 4]  # ~4 characters per token
+        tokens = encoding.encode(text, disallowed_special=())
+        if len(tokens) <= BODY_TOKEN_BUDGET:
+            return text
+        return encoding.decode(tokens[:BODY_TOKEN_BUDGET])
+    
+    def _get_encoding(self):
+        """Tokenizer of the classifier model, or None if it cannot be loaded"""
+        if self._encoding is None:
+            try:
+                self._encoding = tiktoken.encoding_for_model(CLASSIFIER_MODEL)
+            except Exception as e:
+                logger.warning(f"Could not load tokenizer for {CLASSIFIER_MODEL}: {e}")
+                self._encoding = False
+        return self._encoding or None
+    
+    def _exact_cached_classification(self, message: GmailMessage, body_preview: str):
+        """
+        Look an email up in the exact-match cache.
+        
+        Returns:
+            (cached result or None, exact cache key) - the key is reused to store the
+            result of a fresh classification
+        """
+        cache_key = self._classification_cache_key(message.subject or "", message.sender or "", body_preview)
+        with self._classification_cache_lock:
+            cached = self._classification_cache.get(cache_key)
+            if cached is None and self._cache_db is not None:
+                cached = self._load_persisted_classification(cache_key)
+        if cached is not None:
+            return replace(cached, classification_method="llm_cache"), cache_key
+        return None, cache_key
+    
+    def _similar_cached_classification(self, message: GmailMessage, vector) -> Optional[EmailClassificationResult]:
+        """Look a near-duplicate (same template, different details) up in the semantic cache"""
+        if vector is None:
+            return None
+        similar = self._semantic_cache_get(vector, _sender_domain(message.sender))
+        if similar is None:
+            return None
+        return replace(similar, classification_method="llm_semantic_cache")
+    
+    def _load_persisted_classification(self, cache_key: bytes) -> Optional[EmailClassificationResult]:
+        """Look a key up in the on-disk cache (caller holds _classification_cache_lock)"""
+        try:
+            row = self._cache_db.execute(
+                "SELECT result FROM classifications WHERE key = ? AND created >= ?",
+                (cache_key, time.time() - CLASSIFICATION_DB_TTL)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Persistent classification cache lookup failed: {e}")
+            return None
+        if row is None:
+            return None
+        result = _result_from_json(row[0])
+        self._classification_cache[cache_key] = result
+        return result
+    
+    def _remember_classification(self, message: GmailMessage, cache_key: bytes, vector,
+                                 result: EmailClassificationResult):
+        """Store a successful LLM classification in both caches"""
+        if result.classification_method not in ("llm", "llm_batch"):
+            return
+        with self._classification_cache_lock:
+            self._classification_cache[cache_key] = result
+            if self._cache_db is not None:
+                try:
+                    self._cache_db.execute(
+                        "INSERT OR REPLACE INTO classifications (key, result, created) VALUES (?, ?, ?)",
+                        (cache_key, _result_to_json(result), time.time())
+                    )
+                except sqlite3.Error as e:
+                    logger.warning(f"Could not persist classification: {e}")
+        if vector is not None:
+            self._semantic_cache_add(vector, _sender_domain(message.sender), result)
     
     def _classify_with_llm(self, message: GmailMessage) -> EmailClassificationResult:
         """Classify email using LLM"""
         try:
-            # Limit body length for cost and context efficiency
-            body_preview = message.body[:2000] if message.body else ""
+            body_preview = self._body_preview(message)
+            if len(body_preview) < SUBJECT_ONLY_MAX_BODY_CHARS:
+                return self._classify_subject_only(message)
             
-            # Format the prompt
-            prompt = self.classification_prompt.format(
-                subject=message.subject or "No Subject",
-                sender=message.sender,
-                body=body_preview or "No body content"
-            )
+            cached, cache_key = self._exact_cached_classification(message, body_preview)
+            if cached is not None:
+                return cached
+            vector = self._embed_for_cache([(message, body_preview)])  # One row, or None
+            cached = self._similar_cached_classification(message, vector)
+            if cached is not None:
+                return cached
             
-            # Get LLM response with retry logic
-            max_retries = 3
-            for attempt in range(max_retries):
-                try:
-                    response = self.llm.invoke([HumanMessage(content=prompt)])
-                    response_text = response.content.strip()
-                    
-                    # Parse the response
-                    return self._parse_llm_response(response_text)
-                    
-                except Exception as e:
-                    if attempt == max_retries - 1:
-                        raise e
-                    logger.warning(f"LLM request failed, retry {attempt + 1}/{max_retries}: {e}")
-                    continue
+            result = self._invoke_classifier(message, body_preview)
+            self._remember_classification(message, cache_key, vector, result)
+            return result
             
         except Exception as e:
             logger.error(f"LLM classification failed: {e}")
@@ -292,58 +973,303 @@ To set up Gmail integration:
                 classification_method="llm_error"
             )
     
-    def _parse_llm_response(self, response_text: str) -> EmailClassificationResult:
-        """Parse the structured LLM response"""
-        try:
-            lines = response_text.strip().split('\n')
-            
-            # Extract classification
-            classification_line = next((line for line in lines if line.startswith('CLASSIFICATION:')), '')
-            is_invoice = 'YES' in classification_line.upper()
-            
-            # Extract confidence
-            confidence_line = next((line for line in lines if line.startswith('CONFIDENCE:')), '')
-            confidence_str = confidence_line.split(':', 1)[1].strip() if ':' in confidence_line else '0.5'
-            try:
-                confidence = float(confidence_str)
-                confidence = max(0.0, min(1.0, confidence))  # Clamp between 0 and 1
-            except ValueError:
-                confidence = 0.5
-            
-            # Extract reasoning
-            reasoning_line = next((line for line in lines if line.startswith('REASONING:')), '')
-            reasoning = reasoning_line.split(':', 1)[1].strip() if ':' in reasoning_line else "No reasoning provided"
-            
-            return EmailClassificationResult(
-                is_invoice_request=is_invoice,
-                confidence=confidence,
-                reasoning=reasoning,
-                classification_method="llm"
-            )
+    def _classify_subject_only(self, message: GmailMessage) -> EmailClassificationResult:
+        """Classify an email without a usable body from its subject and sender domain"""
+        # A short prompt without the classification rules: there is little to apply them to
+        sender_domain = (message.sender or "").rpartition('@')[2]
+        prompt_messages = [{"role": "user", "content": (
+            f"Subject: {message.subject or 'No Subject'}\nFrom: {sender_domain}\n"
+            "Is this an invoice/receipt request? Answer YES or NO."
+        )}]
+        answer = self._complete(prompt_messages, _SUBJECT_REQUEST_PARAMS)
+        
+        return EmailClassificationResult(
+            is_invoice_request=answer.strip().upper().startswith("YES"),
+            confidence=0.6,
+            reasoning="Classified from the subject and sender domain only (no body)",
+            classification_method="llm_subject_only"
+        )
+    
+    def _classification_messages(self, message: GmailMessage, body_preview: str):
+        """Single-email classification prompt as chat messages"""
+        return [self._system_message, {"role": "user", "content": (
+            f"Please classify this email:\n\n"
+            f"SUBJECT: {message.subject or 'No Subject'}\n\n"
+            f"FROM: {message.sender}\n\n"
+            f"BODY: {body_preview or 'No body content'}\n\n"
+            f"Classify this email according to the rules above."
+        )}]
+    
+    def _invoke_classifier(self, message: GmailMessage, body_preview: str) -> EmailClassificationResult:
+        """Run the single-email classification prompt against the LLM"""
+        answer = self._complete(self._classification_messages(message, body_preview), _SINGLE_REQUEST_PARAMS)
+        return self._to_classification_result(LLMClassification.model_validate_json(answer))
+    
+    async def _ainvoke_classifier(self, message: GmailMessage, body_preview: str) -> EmailClassificationResult:
+        """Async variant of _invoke_classifier"""
+        answer = await self._acomplete(self._classification_messages(message, body_preview), _SINGLE_REQUEST_PARAMS)
+        return self._to_classification_result(LLMClassification.model_validate_json(answer))
+    
+    @_llm_retry
+    def _complete(self, prompt_messages: List[dict], params: Dict[str, Any]) -> str:
+        """Run a chat completion and return its text, retrying transient API failures"""
+        response = self.llm.chat.completions.create(messages=prompt_messages, **params)
+        return response.choices[0].message.content or ""
+    
+    @_llm_retry
+    async def _acomplete(self, prompt_messages: List[dict], params: Dict[str, Any]) -> str:
+        """Async variant of _complete"""
+        response = await self.async_llm.chat.completions.create(messages=prompt_messages, **params)
+        return response.choices[0].message.content or ""
+    
+    def _classify_batch_with_llm(self, messages: List[GmailMessage],
+                                 body_previews: List[str]) -> List[Optional[EmailClassificationResult]]:
+        """
+        Classify several emails with a single LLM request.
+        
+        Args:
+            messages: The emails to classify
+            body_previews: The compressed body of each email
             
+        Returns:
+            One result per message, in order; None where the batch answer was missing or invalid
+        """
+        try:
+            answer = self._complete(self._batch_classification_messages(messages, body_previews), _BATCH_REQUEST_PARAMS)
+            items = json.loads(answer).get("results", [])
         except Exception as e:
-            logger.error(f"Failed to parse LLM response: {e}\nResponse was: {response_text}")
-            # Default to conservative classification
+            logger.warning(f"Batch LLM classification failed, falling back to single requests: {e}")
+            return [None] * len(messages)
+        
+        return self._parse_batch_results(items, len(messages))
+    
+    async def _aclassify_batch_with_llm(self, messages: List[GmailMessage],
+                                        body_previews: List[str]) -> List[Optional[EmailClassificationResult]]:
+        """Async variant of _classify_batch_with_llm"""
+        try:
+            answer = await self._acomplete(self._batch_classification_messages(messages, body_previews), _BATCH_REQUEST_PARAMS)
+            items = json.loads(answer).get("results", [])
+        except Exception as e:
+            logger.warning(f"Batch LLM classification failed, falling back to single requests: {e}")
+            return [None] * len(messages)
+        
+        return self._parse_batch_results(items, len(messages))
+    
+    def _batch_classification_messages(self, messages: List[GmailMessage], body_previews: List[str]):
+        """Batch classification prompt as chat messages, emails numbered from 1"""
+        email_blocks = [
+            f"EMAIL {number}:\nSUBJECT: {message.subject or 'No Subject'}\n"
+            f"FROM: {message.sender}\nBODY: {body_preview or 'No body content'}"
+            for number, (message, body_preview) in enumerate(zip(messages, body_previews), 1)
+        ]
+        return [self._batch_system_message, {"role": "user", "content": (
+            f"Please classify these {len(messages)} emails:\n\n" + "\n\n".join(email_blocks)
+        )}]
+    
+    def _parse_batch_results(self, items: list, count: int) -> List[Optional[EmailClassificationResult]]:
+        """Map the "results" of a batch answer back to email positions 1..count"""
+        results_by_id = {}
+        for item in items:
+            try:
+                results_by_id[int(item["id"])] = EmailClassificationResult(
+                    is_invoice_request=str(item.get("classification", "")).strip().upper() == "YES",
+                    confidence=max(0.0, min(1.0, float(item.get("confidence", 0.5)))),
+                    reasoning=str(item.get("reasoning") or "No reasoning provided"),
+                    classification_method="llm_batch"
+                )
+            except (KeyError, TypeError, ValueError, AttributeError):
+                continue
+        
+        return [results_by_id.get(number) for number in range(1, count + 1)]
+    
+    def _to_classification_result(self, answer: LLMClassification) -> EmailClassificationResult:
+        """Map the structured LLM answer to an EmailClassificationResult"""
+        return EmailClassificationResult(
+            is_invoice_request=answer.classification == "YES",
+            confidence=max(0.0, min(1.0, answer.confidence)),  # Clamp between 0 and 1
+            reasoning=answer.reasoning or "No reasoning provided",
+            classification_method="llm"
+        )
+    
+    def _cheap_prefilter(self, message: GmailMessage) -> Optional[EmailClassificationResult]:
+        """Decide obvious cases without the LLM; None when the email needs the LLM"""
+        subject = message.subject or ""
+        sender_local = (message.sender or "").partition('@')[0].lower()
+        
+        if "list-unsubscribe" in message.headers:
+            reason = "Bulk email (List-Unsubscribe header present)"
+        elif sender_local.startswith(_BULK_SENDER_PREFIXES):
+            reason = f"Automated sender address ({message.sender})"
+        elif _MARKETING_SUBJECT_RE.search(subject):
+            reason = "Marketing/newsletter subject"
+        else:
+            reason = None
+        if reason:
             return EmailClassificationResult(
                 is_invoice_request=False,
-                confidence=0.0,
-                reasoning="Failed to parse LLM response",
-                classification_method="llm_parse_error"
+                confidence=0.9,
+                reasoning=reason,
+                classification_method="heuristic"
             )
+        
+        # Without a body only the subject is left to go on
+        if len((message.body or "").strip()) < SUBJECT_ONLY_MAX_BODY_CHARS:
+            for pattern, is_invoice, reason in _SUBJECT_ONLY_RULES:
+                if pattern.search(subject):
+                    return EmailClassificationResult(
+                        is_invoice_request=is_invoice,
+                        confidence=0.8,
+                        reasoning=reason,
+                        classification_method="heuristic"
+                    )
+        
+        return None
     
     def classify_email(self, message: GmailMessage) -> EmailClassificationResult:
-        """Main classification method - LLM only"""
-        logger.debug(f"Classifying email from {message.sender} using LLM")
-        result = self._classify_with_llm(message)
+        """Main classification method - heuristics for obvious cases, LLM for the rest"""
+        result = self._cheap_prefilter(message)
+        if result is None:
+            logger.debug(f"Classifying email from {message.sender} using LLM")
+            result = self._classify_with_llm(message)
+        self._log_classification(message, result)
+        return result
+    
+    def classify_emails(self, messages: List[GmailMessage],
+                        batch_size: int = CLASSIFICATION_BATCH_SIZE) -> List[EmailClassificationResult]:
+        """
+        Classify many emails, sending cache misses to the LLM batch_size emails per request.
+        
+        Args:
+            messages: The emails to classify
+            batch_size: Maximum number of emails per LLM request
+            
+        Returns:
+            One classification per message, in the same order
+        """
+        results, pending = self._lookup_classifications(messages)
+        
+        for start in range(0, len(pending), batch_size):
+            chunk = pending[start:start + batch_size]
+            batch_results = self._classify_batch_with_llm(
+                [entry[1] for entry in chunk],
+                [entry[2] for entry in chunk]
+            )
+            
+            for (position, message, body_preview, cache_key, vector), result in zip(chunk, batch_results):
+                if result is None:
+                    # Missing from the batch answer: classify this one on its own
+                    try:
+                        result = self._invoke_classifier(message, body_preview)
+                    except Exception as e:
+                        result = self._classification_error(e)
+                self._remember_classification(message, cache_key, vector, result)
+                results[position] = result
+        
+        for message, result in zip(messages, results):
+            self._log_classification(message, result)
+        return results
+    
+    async def aclassify_emails(self, messages: List[GmailMessage],
+                               batch_size: int = CLASSIFICATION_BATCH_SIZE) -> List[EmailClassificationResult]:
+        """
+        Async variant of classify_emails: the LLM batch requests run concurrently,
+        at most CLASSIFIER_MAX_CONCURRENCY at a time.
+        """
+        # Cache lookups may call the embeddings API, keep them off the event loop
+        results, pending = await asyncio.to_thread(self._lookup_classifications, messages)
+        semaphore = asyncio.Semaphore(CLASSIFIER_MAX_CONCURRENCY)
+        
+        async def classify_chunk(chunk):
+            async with semaphore:
+                batch_results = await self._aclassify_batch_with_llm(
+                    [entry[1] for entry in chunk],
+                    [entry[2] for entry in chunk]
+                )
+            return list(zip(chunk, batch_results))
+        
+        async def classify_single(entry):
+            async with semaphore:
+                try:
+                    return await self._ainvoke_classifier(entry[1], entry[2])
+                except Exception as e:
+                    return self._classification_error(e)
+        
+        chunk_results = await asyncio.gather(*(
+            classify_chunk(pending[start:start + batch_size])
+            for start in range(0, len(pending), batch_size)
+        ))
+        classified = [pair for pairs in chunk_results for pair in pairs]
+        
+        # Emails missing from their batch answer are classified on their own
+        missing = [entry for entry, result in classified if result is None]
+        single_results = iter(await asyncio.gather(*(classify_single(entry) for entry in missing)))
+        
+        for (position, message, body_preview, cache_key, vector), result in classified:
+            if result is None:
+                result = next(single_results)
+            self._remember_classification(message, cache_key, vector, result)
+            results[position] = result
+        
+        for message, result in zip(messages, results):
+            self._log_classification(message, result)
+        return results
+    
+    def _lookup_classifications(self, messages: List[GmailMessage]):
+        """
+        Resolve what can be answered without the LLM (heuristics and caches).
+        
+        Returns:
+            (results with None for cache misses,
+             [(position, message, body preview, cache key, embedding)] for the cache misses)
+        """
+        results: List[Optional[EmailClassificationResult]] = [None] * len(messages)
+        misses = []
+        
+        # Heuristics and the exact-match cache first; emails they decide are never embedded
+        for position, message in enumerate(messages):
+            prefiltered = self._cheap_prefilter(message)
+            if prefiltered is not None:
+                results[position] = prefiltered
+                continue
+            
+            body_preview = self._body_preview(message)
+            cached, cache_key = self._exact_cached_classification(message, body_preview)
+            if cached is not None:
+                results[position] = cached
+            else:
+                misses.append((position, message, body_preview, cache_key))
+        
+        # Then the semantic cache, embedding all remaining emails in one request
+        vectors = self._embed_for_cache([(message, body_preview) for _, message, body_preview, _ in misses])
+        pending = []
+        for i, (position, message, body_preview, cache_key) in enumerate(misses):
+            vector = vectors[i:i + 1] if vectors is not None else None
+            cached = self._similar_cached_classification(message, vector)
+            if cached is not None:
+                results[position] = cached
+            else:
+                pending.append((position, message, body_preview, cache_key, vector))
         
+        return results, pending
+    
+    def _classification_error(self, error: Exception) -> EmailClassificationResult:
+        """Conservative result for an email the LLM could not classify"""
+        logger.error(f"LLM classification failed: {error}")
+        return EmailClassificationResult(
+            is_invoice_request=False,
+            confidence=0.0,
+            reasoning=f"LLM classification failed: {str(error)}",
+            classification_method="llm_error"
+        )
+    
+    def _log_classification(self, message: GmailMessage, result: EmailClassificationResult):
+        """Log the outcome of an email classification"""
         logger.info(f"Email classification - From: {message.sender}, "
                    f"Subject: {message.subject[:50]}..., "
                    f"Result: {result.is_invoice_request}, "
                    f"Confidence: {result.confidence:.2f}, "
                    f"Method: {result.classification_method}, "
                    f"Reasoning: {result.reasoning}")
-        
-        return result
     
     def is_invoice_request(self, message: GmailMessage) -> bool:
         """Enhanced invoice request detection using LLM only"""
@@ -361,7 +1287,7 @@ To set up Gmail integration:
         debug_info = {
             "llm_available": self.llm is not None,
             "api_key_set": self.openai_api_key is not None,
-            "prompt_ready": self.classification_prompt is not None,
+            "prompt_ready": self._system_message is not None,
             "message_preview": {
                 "sender": message.sender,
                 "subject": message.subject,
@@ -372,10 +1298,14 @@ To set up Gmail integration:
         
         # Test LLM availability
         try:
-            test_response = self.llm.invoke([HumanMessage(content="Test message")])
+            test_response = self.llm.chat.completions.create(
+                model=CLASSIFIER_MODEL,
+                messages=[{"role": "user", "content": "Test message"}],
+                max_tokens=50
+            )
             debug_info["llm_test"] = {
                 "working": True,
-                "response_preview": test_response.content[:100]
+                "response_preview": (test_response.choices[0].message.content or "")[:100]
             }
         except Exception as e:
             debug_info["llm_test"] = {
@@ -399,34 +1329,49 @@ To set up Gmail integration:
         
         return debug_info
     
-    def send_email(self, to_email: str, subject: str, body: str, attachment_path: str = None) -> bool:
-        """Send email with optional attachment"""
+    def send_email(self, to_email: str, subject: str, body: str, attachment_path: str = None,
+                   attachment_bytes: Optional[bytes] = None, attachment_name: Optional[str] = None) -> bool:
+        """Send email with an optional attachment, from a file or from in-memory bytes"""
         try:
-            message = MIMEMultipart()
-            message['to'] = to_email
-            message['subject'] = subject
-            
-            message.attach(MIMEText(body, 'plain'))
+            message = EmailMessage()
+            message['To'] = to_email
+            message['Subject'] = subject
+            message.set_content(body)
             
-            if attachment_path and os.path.exists(attachment_path):
-                with open(attachment_path, "rb") as attachment:
-                    part = MIMEBase('application', 'octet-stream')
-                    part.set_payload(attachment.read())
-                
-                encoders.encode_base64(part)
-                part.add_header(
-                    'Content-Disposition',
-                    f'attachment; filename= {os.path.basename(attachment_path)}'
+            if attachment_bytes is not None:
+                attachment_name = attachment_name or "attachment.pdf"
+                mime_type, _ = mimetypes.guess_type(attachment_name)
+                maintype, _, subtype = (mime_type or 'application/pdf').partition('/')
+                message.add_attachment(
+                    attachment_bytes,
+                    maintype=maintype,
+                    subtype=subtype,
+                    filename=attachment_name
                 )
-                message.attach(part)
+            elif attachment_path and os.path.exists(attachment_path):
+                mime_type, _ = mimetypes.guess_type(attachment_path)
+                maintype, _, subtype = (mime_type or 'application/octet-stream').partition('/')
+                with open(attachment_path, "rb") as attachment:
+                    message.add_attachment(
+                        attachment.read(),
+                        maintype=maintype,
+                        subtype=subtype,
+                        filename=os.path.basename(attachment_path)
+                    )
             
-            raw_message = base64.urlsafe_b64encode(message.as_bytes()).decode()
-            send_message = {'raw': raw_message}
+            # Upload the message as message/rfc822 media instead of a base64url 'raw' field:
+            # no second encoding pass over the whole message, and it is sent in chunks
+            media = MediaIoBaseUpload(
+                io.BytesIO(message.as_bytes()),
+                mimetype='message/rfc822',
+                chunksize=SEND_UPLOAD_CHUNK_SIZE,
+                resumable=True
+            )
             
-            self.service.users().messages().send(
+            self._execute(self._msgs.send(
                 userId='me', 
-                body=send_message
-            ).execute()
+                media_body=media
+            ))
             
             return True
             
@@ -437,27 +1382,106 @@ To set up Gmail integration:
                 can_retry=True
             )
     
+    def register_watch(self, topic_name: str, label_ids: Optional[List[str]] = None) -> Dict[str, Any]:
+        """
+        Have Gmail publish mailbox changes to a Cloud Pub/Sub topic (users.watch).
+        
+        A watch expires after 7 days and has to be renewed by calling this again.
+        
+        Returns:
+            The watch response: the current historyId and the expiration time
+        """
+        try:
+            return self._execute(self._users.watch(
+                userId='me',
+                body={'topicName': topic_name, 'labelIds': label_ids or ['INBOX']}
+            ))
+        except Exception as e:
+            raise SAPAssistantError(
+                message=f"Error registering Gmail watch: {str(e)}",
+                code="GMAIL_WATCH_ERROR",
+                can_retry=True
+            )
+    
+    def get_messages_since(self, start_history_id: str,
+                           fetch_body: bool = True) -> Tuple[List[GmailMessage], str]:
+        """
+        Get the unread inbox messages added after a mailbox history id (users.history.list).
+        
+        Returns:
+            (messages, latest history id) - pass the history id to the next call
+        """
+        try:
+            new_messages = []
+            seen = set()
+            history_id = start_history_id
+            page_token = None
+            
+            while True:
+                response = self._execute(self._users.history().list(
+                    userId='me',
+                    startHistoryId=start_history_id,
+                    historyTypes=['messageAdded'],
+                    labelId='INBOX',
+                    pageToken=page_token
+                ))
+                for record in response.get('history', []):
+                    for added in record.get('messagesAdded', []):
+                        message = added.get('message', {})
+                        if message.get('id') in seen or 'UNREAD' not in message.get('labelIds', []):
+                            continue
+                        seen.add(message['id'])
+                        new_messages.append({'id': message['id']})
+                history_id = response.get('historyId', history_id)
+                page_token = response.get('nextPageToken')
+                if not page_token:
+                    break
+            
+            gmail_messages = []
+            for start in range(0, len(new_messages), GMAIL_FETCH_BATCH_SIZE):
+                chunk = new_messages[start:start + GMAIL_FETCH_BATCH_SIZE]
+                gmail_messages.extend(self._fetch_and_parse_chunk(chunk, fetch_body))
+            return gmail_messages, history_id
+            
+        except Exception as e:
+            raise SAPAssistantError(
+                message=f"Error reading Gmail history: {str(e)}",
+                code="GMAIL_READ_ERROR",
+                can_retry=True
+            )
+    
     def mark_as_read(self, message_id: str):
         """Mark message as read"""
         try:
-            self.service.users().messages().modify(
+            self._execute(self._msgs.modify(
                 userId='me',
                 id=message_id,
                 body={'removeLabelIds': ['UNREAD']}
-            ).execute()
+            ))
         except Exception as e:
             logger.error(f"Error marking message as read: {e}")
 
-    def invoke(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """Gmail tool invoke method for workflow integration"""
+    async def async_invoke(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Gmail tool invoke method for workflow integration.
+        
+        With gmail_classify set, get_messages also classifies the messages, overlapping
+        the LLM requests with the Gmail fetches.
+        """
         action = state.get("gmail_action", "get_messages")
         
         try:
             if action == "get_messages":
                 query = state.get("gmail_query", "is:unread")
-                messages = self.get_messages(query)
-                state["gmail_messages"] = [
-                    {
+                fetch_body = state.get("gmail_fetch_body", True)
+                if state.get("gmail_classify"):
+                    pairs = await self.get_and_classify_messages_async(query, fetch_body=fetch_body)
+                else:
+                    pairs = [(msg, None) for msg in await self.get_messages_async(query, fetch_body=fetch_body)]
+                
+                state["gmail_messages"] = []
+                for msg, classification in pairs:
+                    entry = {
                         "message_id": msg.message_id,
                         "sender": msg.sender,
                         "subject": msg.subject,
@@ -465,11 +1489,14 @@ To set up Gmail integration:
                         "received_at": msg.received_at.isoformat(),
                         "thread_id": msg.thread_id
                     }
-                    for msg in messages
-                ]
+                    if classification is not None:
+                        entry["is_invoice_request"] = classification.is_invoice_request
+                        entry["classification_confidence"] = classification.confidence
+                    state["gmail_messages"].append(entry)
                 
             elif action == "send_email":
-                success = self.send_email(
+                success = await asyncio.to_thread(
+                    self.send_email,
                     to_email=state.get("to_email"),
                     subject=state.get("email_subject"),
                     body=state.get("email_body"),
@@ -478,7 +1505,7 @@ To set up Gmail integration:
                 state["email_sent"] = success
                 
             elif action == "mark_read":
-                self.mark_as_read(state.get("message_id"))
+                await asyncio.to_thread(self.mark_as_read, state.get("message_id"))
                 state["marked_read"] = True
                 
             return state
@@ -486,4 +1513,8 @@ To set up Gmail integration:
         except Exception as e:
             error_dict = format_error_for_response(e)
             state["error"] = error_dict
-            return state
\ No newline at end of file
+            return state
+    
+    def invoke(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Gmail tool invoke method for workflow integration"""
+        return asyncio.run(self.async_invoke(state))
\ No newline at end of file
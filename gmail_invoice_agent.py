@@ -1,52 +1,217 @@
 # agents/gmail_invoice_agent.py
 
 import asyncio
+import base64
+import contextvars
+import hmac
 import json
 import logging
-from typing import Dict, Any, List, Optional
+import os
+import re
+import threading
+from typing import Dict, Any, List, Optional, Set
 from datetime import datetime
+from aiohttp import web
+from pydantic import create_model
+from cachetools import TTLCache
+from google.auth.transport import requests as google_requests
+from google.oauth2 import id_token
 from langchain_openai import ChatOpenAI
 from langchain.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain.agents import create_openai_functions_agent, AgentExecutor
-from langchain.tools import tool
+from langchain.tools import StructuredTool, tool
+from langchain.schema import SystemMessage
 
-from tools.gmail_integration import GmailIntegrationTool, GmailMessage
+from tools.gmail_integration import (
+    HTTP2_AVAILABLE,
+    OPENAI_HTTP_LIMITS,
+    OPENAI_HTTP_TIMEOUT,
+    GmailIntegrationTool,
+    GmailMessage,
+)
 from tools.sap_business_tools import SAPBusinessTools
 from tools.support_tools import SupportToolsIntegration
 from integration.enhanced_sap_client import SAPB1EnhancedClient
 from utils.enhanced_errors import SAPAssistantError, format_error_for_response
+from utils.openai_limits import limited_async_http_client, limited_http_client
+
+try:
+    import orjson
+except ImportError:  # Fall back to the stdlib json module
+    orjson = None
+
+try:
+    import uvloop
+except ImportError:  # Not available on Windows: keep the default asyncio loop
+    uvloop = None
 
 logger = logging.getLogger(__name__)
 
+# Loops created by the agent itself (run_monitor, process_single_message) use uvloop when
+# installed; the global loop policy of importing processes is left alone
+_new_event_loop = uvloop.new_event_loop if uvloop is not None else asyncio.new_event_loop
+
+# Results of the read-only SAP tools, reused when the agent repeats a lookup
+# within one run or across messages of the same poll
+SAP_TOOL_CACHE_SIZE = 2048
+SAP_TOOL_CACHE_TTL = 300  # seconds
+
+# Synchronous SAP lookups exposed to the agent: tool name (also the SAPBusinessTools
+# method) -> (argument name, description, cache kind or None, cache key normalizer)
+_SAP_TOOL_SPECS = {
+    "get_business_partner_from_mail": (
+        "email_address", "Get business partner details from email address using SAP B1.",
+        "bp", lambda email: email.strip().lower()
+    ),
+    "get_latest_order_for_business_partner": (
+        "partner_email", "Get the latest order for a business partner by email using SAP B1.", None, None
+    ),
+    "get_invoices_related_to_order": (
+        "order_id", "Get all invoices related to a specific order using SAP B1.", "invoices", None
+    ),
+    "get_invoice_by_id": (
+        "invoice_id", "Get specific invoice by invoice ID using SAP B1.", "invoice", None
+    ),
+    "extract_order_number_from_email": (
+        "email_text", "Extract order number from customer email text.", None, None
+    ),
+    "lookup_order_by_id": (
+        "order_id", "Look up order details by order ID using SAP B1.", "order", None
+    ),
+}
+
+# The agent runs on a small, fast model; a run that fails or gives up is retried once
+# on the fallback model (set both to the same model to disable escalation)
+AGENT_MODEL = os.getenv("AGENT_MODEL", "gpt-4o-mini")
+AGENT_FALLBACK_MODEL = os.getenv("AGENT_FALLBACK_MODEL", "gpt-4")
+# Output AgentExecutor returns when it hits its iteration or time limit
+_AGENT_STOPPED_PREFIX = "Agent stopped due to"
+# Names of the customer-visible tools (emails, tickets) called during the current agent run;
+# a run that already called one is not repeated on the fallback model
+_run_side_effects: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar(
+    "_run_side_effects", default=None
+)
+
+def _note_side_effect(tool_name: str):
+    side_effects = _run_side_effects.get()
+    if side_effects is not None:
+        side_effects.append(tool_name)
+
+# Reports generated by the agent, kept in memory until send_invoice_via_gmail attaches them
+REPORT_CACHE_SIZE = 64
+REPORT_CACHE_TTL = 900  # seconds
+
+# An invoice request has to mention one of these somewhere in its subject or opening
+# text; emails without any of them are skipped without calling the LLM classifier
+_INVOICE_KEYWORD_RE = re.compile(
+    r'\b(?:invoices?|factures?|billing|bills?|receipts?|order\s*(?:#|no\.?|number)?\s*\d+)\b',
+    re.IGNORECASE
+)
+
+# Gmail push notifications: the watch lasts 7 days, renew it daily as Google recommends
+GMAIL_WATCH_RENEW_INTERVAL = 86400  # seconds
+
+# Customer email templates, filled with str.format_map at send time
+INVOICE_SUBJECT_TMPL = "Your Invoice for Order #{order_id}"
+INVOICE_BODY_TMPL = """Dear {customer_name},
+
+Thank you for your order! Please find attached your invoice for order #{order_id}.
+
+Order Details:
+- Order ID: {order_id}
+- Date: {order_date}
+- Amount: {currency} {amount}
+- Status: {order_status}
+
+If you have any questions, please don't hesitate to contact us.
+
+Best regards,
+Customer Service Team
+"""
+
+SAV_SUBJECT_TMPL = "Support Ticket Created - {ticket_id}"
+SAV_BODY_TMPL = """Dear Valued Customer,
+
+Thank you for contacting us regarding your invoice request.
+
+We apologize for the inconvenience you experienced. We have created a support ticket to resolve your issue promptly.
+
+Ticket Details:
+- Ticket ID: {ticket_id}
+- Priority: {priority}
+- Estimated Response Time: {estimated_response_time}
+
+Our customer service team will review your request and contact you at {customer_email} within the estimated timeframe.
+
+If you have any urgent questions, please reference ticket ID {ticket_id} in your communication.
+
+Thank you for your patience and understanding.
+
+Best regards,
+Customer Service Team"""
+
+def _dumps(obj) -> str:
+    """Serialize a tool result, using orjson when available"""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+    return json.dumps(obj)
+
+def _loads(data):
+    """Parse tool input JSON, using orjson when available"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
 class GmailInvoiceProcessingAgent:
     """Gmail-integrated AI Agent for processing invoice requests using SAP B1 data"""
     
-    def __init__(self, sap_client: SAPB1EnhancedClient = None, entity_registry=None, openai_api_key: str = None):
+    def __init__(self, sap_client: SAPB1EnhancedClient = None, entity_registry=None, openai_api_key: str = None,
+                 max_concurrency: int = 4, verbose: bool = False):
         self.sap_client = sap_client or SAPB1EnhancedClient()
         self.entity_registry = entity_registry
+        self.max_concurrency = max_concurrency  # Messages processed at once by the monitor loop
+        self._push_history_id = None  # Mailbox history id up to which push notifications were handled
+        self._loop = None  # Agent-owned event loop for the sync entry points, created on first use
+        self._background: Set[asyncio.Task] = set()  # Fire-and-forget side effects, drained by the sync entry points
         
         # Validate API key requirement for LLM-only approach
         if not openai_api_key:
             raise ValueError("OpenAI API key is required for LLM-based email classification")
         
+        # One OpenAI connection pool for the agent LLM and the Gmail classifier
+        # (each request within the process-wide OpenAI concurrency and rate limits)
+        self._openai_http_client = limited_http_client(
+            http2=HTTP2_AVAILABLE, limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT
+        )
+        self._openai_http_async_client = limited_async_http_client(
+            http2=HTTP2_AVAILABLE, limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT
+        )
+        
         # Initialize tools with API key for LLM classification
-        self.gmail_tool = GmailIntegrationTool(openai_api_key=openai_api_key)
+        self.gmail_tool = GmailIntegrationTool(
+            openai_api_key=openai_api_key,
+            http_client=self._openai_http_client,
+            http_async_client=self._openai_http_async_client
+        )
         self.sap_tools = SAPBusinessTools(self.sap_client, entity_registry)
         self.support_tools = SupportToolsIntegration()
         
+        # Serialized tool results keyed by (lookup kind, argument); sync tools run in worker threads
+        self._sap_cache = TTLCache(maxsize=SAP_TOOL_CACHE_SIZE, ttl=SAP_TOOL_CACHE_TTL)
+        self._sap_cache_lock = threading.Lock()
+        # PDF bytes keyed by the report_path handed back to the agent; only touched on the event loop
+        self._reports = TTLCache(maxsize=REPORT_CACHE_SIZE, ttl=REPORT_CACHE_TTL)
+        
         # Initialize LangChain components
-        self.llm = ChatOpenAI(
-            model="gpt-4",
-            api_key=openai_api_key,
-            temperature=0.1
-        )
+        self.llm = self._create_llm(AGENT_MODEL, openai_api_key)
         
         # Create LangChain tools from our methods
         self.tools = self._create_langchain_tools()
         
-        # Create agent prompt
+        # Create agent prompt; the system prompt is a ready-made message, so only the
+        # input is formatted per email
         self.prompt = ChatPromptTemplate.from_messages([
-            ("system", """You are an AI customer service agent that processes invoice requests from Gmail using the company's SAP B1 system.
+            SystemMessage(content="""You are an AI customer service agent that processes invoice requests from Gmail using the company's SAP B1 system.
 
 AVAILABLE TOOLS:
 - get_business_partner_from_mail: Get business partner info from email address (uses real SAP B1 data)
@@ -75,123 +240,238 @@ Always be helpful and professional. If you cannot complete the request automatic
         
         # Create agent
         self.agent = create_openai_functions_agent(self.llm, self.tools, self.prompt)
-        self.agent_executor = AgentExecutor(agent=self.agent, tools=self.tools, verbose=True)
+        # The tool function schemas are converted once here, when the agent binds them;
+        # verbose tracing prints every step and is off unless asked for
+        self.agent_executor = AgentExecutor(agent=self.agent, tools=self.tools, verbose=verbose)
+        
+        # Same tools and prompt on the stronger model, for runs the default model can't finish
+        self.fallback_executor = None
+        if AGENT_FALLBACK_MODEL != AGENT_MODEL:
+            fallback_agent = create_openai_functions_agent(
+                self._create_llm(AGENT_FALLBACK_MODEL, openai_api_key), self.tools, self.prompt
+            )
+            self.fallback_executor = AgentExecutor(agent=fallback_agent, tools=self.tools, verbose=verbose)
         
         logger.info("Gmail Invoice Agent initialized with LLM-only classification")
     
-    def _create_langchain_tools(self):
-        """Create LangChain tools from our SAP and support methods"""
-        
-        @tool
-        def get_business_partner_from_mail(email_address: str) -> str:
-            """Get business partner details from email address using SAP B1."""
-            result = self.sap_tools.get_business_partner_from_mail(email_address)
-            return json.dumps(result)
+    def _create_llm(self, model: str, openai_api_key: str) -> ChatOpenAI:
+        """Chat model for the agent, on the shared OpenAI connection pool"""
+        return ChatOpenAI(
+            model=model,
+            api_key=openai_api_key,
+            temperature=0.1,
+            # Keep-alive pool reused by every agent run on the same event loop
+            http_client=self._openai_http_client,
+            http_async_client=self._openai_http_async_client
+        )
+    
+    async def _run_agent(self, user_input: str) -> Dict[str, Any]:
+        """
+        Run the agent, escalating once to the fallback model when the default model fails or
+        gives up before any email was sent or ticket created (a rerun would repeat those)
+        """
+        # The tools run in this task (or tasks copied from its context), so they see this list
+        side_effects = []
+        _run_side_effects.set(side_effects)
+        try:
+            response = await self.agent_executor.ainvoke({"input": user_input})
+            if self.fallback_executor is None or not response.get("output", "").startswith(_AGENT_STOPPED_PREFIX):
+                return response
+            if side_effects:
+                logger.warning("Agent on %s gave up after calling %s, not retrying", AGENT_MODEL, side_effects)
+                return response
+            logger.warning("Agent on %s gave up, retrying with %s", AGENT_MODEL, AGENT_FALLBACK_MODEL)
+        except Exception as e:
+            if self.fallback_executor is None or side_effects:
+                raise
+            logger.warning("Agent on %s failed (%s), retrying with %s", AGENT_MODEL, e, AGENT_FALLBACK_MODEL)
         
-        @tool
-        def get_latest_order_for_business_partner(partner_email: str) -> str:
-            """Get the latest order for a business partner by email using SAP B1."""
-            result = self.sap_tools.get_latest_order_for_business_partner(partner_email)
-            return json.dumps(result)
+        return await self.fallback_executor.ainvoke({"input": user_input})
+    
+    async def _send_email(self, **kwargs) -> bool:
+        """Send an email through the Gmail tool in a worker thread, keeping the event loop free"""
+        return await asyncio.to_thread(self.gmail_tool.send_email, **kwargs)
+    
+    def _cached_tool_call(self, key: tuple, fetch) -> str:
+        """JSON result of a read-only SAP tool, from the cache while it is fresh"""
+        with self._sap_cache_lock:
+            cached = self._sap_cache.get(key)
+        if cached is not None:
+            return cached
         
-        @tool
-        def get_invoices_related_to_order(order_id: str) -> str:
-            """Get all invoices related to a specific order using SAP B1."""
-            result = self.sap_tools.get_invoices_related_to_order(order_id)
-            return json.dumps(result)
+        result = fetch()
+        serialized = _dumps(result)
+        # Failed lookups are retried on the next call
+        if not (isinstance(result, dict) and result.get("status") == "error"):
+            with self._sap_cache_lock:
+                self._sap_cache[key] = serialized
+        return serialized
+    
+    def invalidate_sap_cache(self, kind: Optional[str] = None):
+        """Drop cached SAP tool results of one lookup kind ("bp", "order", "invoices", "invoice"), or all"""
+        with self._sap_cache_lock:
+            if kind is None:
+                self._sap_cache.clear()
+                return
+            for key in [key for key in self._sap_cache if key[0] == kind]:
+                self._sap_cache.pop(key, None)
+    
+    def _make_sap_tool(self, name: str, arg_name: str, description: str,
+                       cache_kind: Optional[str], normalize) -> StructuredTool:
+        """Agent tool calling the SAPBusinessTools method of the same name with a single string argument"""
+        fn = getattr(self.sap_tools, name)
         
-        @tool
-        def get_invoice_by_id(invoice_id: str) -> str:
-            """Get specific invoice by invoice ID using SAP B1."""
-            result = self.sap_tools.get_invoice_by_id(invoice_id)
-            return json.dumps(result)
+        if cache_kind is None:
+            def run(**kwargs) -> str:
+                result = fn(kwargs[arg_name])
+                return result if isinstance(result, str) else _dumps(result)
+        else:
+            cached_call = self._cached_tool_call
+            
+            def run(**kwargs) -> str:
+                value = kwargs[arg_name]
+                key = normalize(value) if normalize else value
+                return cached_call((cache_kind, key), lambda: fn(value))
         
-        @tool
-        def extract_order_number_from_email(email_text: str) -> str:
-            """Extract order number from customer email text."""
-            return self.sap_tools.extract_order_number_from_email(email_text)
+        return StructuredTool.from_function(
+            func=run,
+            name=name,
+            description=description,
+            args_schema=create_model(f"{name}_args", **{arg_name: (str, ...)})
+        )
+    
+    def _create_langchain_tools(self):
+        """Create LangChain tools from our SAP and support methods"""
         
-        @tool
-        def lookup_order_by_id(order_id: str) -> str:
-            """Look up order details by order ID using SAP B1."""
-            result = self.sap_tools.lookup_order_by_id(order_id)
-            return json.dumps(result)
+        # The synchronous SAP lookups are bound straight to SAPBusinessTools from one table
+        sap_tools = [
+            self._make_sap_tool(name, arg_name, description, cache_kind, normalize)
+            for name, (arg_name, description, cache_kind, normalize) in _SAP_TOOL_SPECS.items()
+        ]
         
         @tool
         async def generate_crystal_report(report_type: str, record_id: str, record_data: str = "{}") -> str:
             """Generate Crystal Report for invoice or order."""
             try:
-                data = json.loads(record_data) if record_data != "{}" else {}
-                result = await self.support_tools.crystal_reports.get_crystal_report(report_type, record_id, data)
-                return json.dumps(result)
+                data = _loads(record_data) if record_data != "{}" else {}
+                result = await self.support_tools.crystal_reports.get_crystal_report(
+                    report_type, record_id, data, in_memory=True
+                )
+                # The PDF stays here for send_invoice_via_gmail; the agent only sees its name
+                report_bytes = result.pop("bytes", None)
+                if report_bytes is not None:
+                    self._reports[result["report_filename"]] = report_bytes
+                    result["report_path"] = result["report_filename"]
+                return _dumps(result)
             except Exception as e:
-                return json.dumps({"status": "error", "message": str(e)})
+                return _dumps({"status": "error", "message": str(e)})
         
         @tool
-        def send_invoice_via_gmail(order_id: str, customer_email: str, report_path: str = "") -> str:
+        async def send_invoice_via_gmail(order_id: str, customer_email: str, report_path: str = "") -> str:
             """Send invoice for order to customer via Gmail."""
+            _note_side_effect("send_invoice_via_gmail")
+            bp_task = None
+            report_task = None
             try:
+                # The order lookup and the business partner check are independent SAP calls:
+                # start both, and drop the partner check if the order's email already matches
+                order_task = asyncio.create_task(asyncio.to_thread(self.sap_tools.lookup_order_by_id, order_id))
+                bp_task = asyncio.create_task(
+                    asyncio.to_thread(self.sap_tools.get_business_partner_from_mail, customer_email)
+                )
+                
                 # Get order details
-                order_result = self.sap_tools.lookup_order_by_id(order_id)
+                order_result = await order_task
                 
                 if order_result["status"] != "found":
-                    return json.dumps({"status": "error", "message": f"Order {order_id} not found"})
+                    return _dumps({"status": "error", "message": f"Order {order_id} not found"})
                 
                 order = order_result
                 
+                # Without a report from the agent, generate one while the email is prepared
+                if not report_path:
+                    report_task = asyncio.create_task(
+                        self.support_tools.crystal_reports.get_crystal_report("invoice", order_id, order, in_memory=True)
+                    )
+                
                 # Verify email matches
                 if order.get("customer_email", "").lower() != customer_email.lower():
                     # Get business partner details to check email
-                    bp_result = self.sap_tools.get_business_partner_from_mail(customer_email)
+                    bp_result = await bp_task
                     if bp_result["status"] not in ["found", "found_partial"]:
-                        return json.dumps({
+                        return _dumps({
                             "status": "error",
                             "message": "Security Error: Cannot send invoice - email address verification failed"
                         })
                 
                 # Prepare email content
-                subject = f"Your Invoice for Order #{order_id}"
-                body = f"""Dear {order.get('customer_name', 'Customer')},
-
-Thank you for your order! Please find attached your invoice for order #{order_id}.
-
-Order Details:
-- Order ID: {order_id}
-- Date: {order.get('order_date', 'N/A')}
-- Amount: {order.get('currency', '')} {order.get('amount', 0)}
-- Status: {order.get('order_status', 'N/A')}
-
-If you have any questions, please don't hesitate to contact us.
-
-Best regards,
-Customer Service Team
-"""
+                subject = INVOICE_SUBJECT_TMPL.format_map({"order_id": order_id})
+                body = INVOICE_BODY_TMPL.format_map({
+                    "customer_name": order.get("customer_name", "Customer"),
+                    "order_id": order_id,
+                    "order_date": order.get("order_date", "N/A"),
+                    "currency": order.get("currency", ""),
+                    "amount": order.get("amount", 0),
+                    "order_status": order.get("order_status", "N/A")
+                })
+                
+                # Attach the report from memory when it was generated in this process
+                attachment = None
+                if report_task is not None:
+                    report_result = await report_task
+                    if report_result.get("status") == "success":
+                        attachment = (report_result["bytes"], report_result["report_filename"])
+                elif report_path:
+                    # Kept until the TTL evicts it, so a retried send still finds the report
+                    report_bytes = self._reports.get(report_path)
+                    if report_bytes is not None:
+                        attachment = (report_bytes, report_path)
+                    elif not os.path.isfile(report_path):
+                        return _dumps({
+                            "status": "error",
+                            "message": f"Report {report_path} not found (expired or never generated); generate it again"
+                        })
                 
                 # Send email
-                success = self.gmail_tool.send_email(
-                    to_email=customer_email,
-                    subject=subject,
-                    body=body,
-                    attachment_path=report_path if report_path else None
-                )
+                if attachment is not None:
+                    success = await self._send_email(
+                        to_email=customer_email,
+                        subject=subject,
+                        body=body,
+                        attachment_bytes=attachment[0],
+                        attachment_name=attachment[1]
+                    )
+                else:
+                    success = await self._send_email(
+                        to_email=customer_email,
+                        subject=subject,
+                        body=body,
+                        attachment_path=report_path if report_path else None
+                    )
                 
                 if success:
-                    return json.dumps({
+                    return _dumps({
                         "status": "success",
                         "message": f"Invoice for order {order_id} sent successfully to {customer_email}"
                     })
                 else:
-                    return json.dumps({
+                    return _dumps({
                         "status": "error",
                         "message": f"Failed to send invoice email for order {order_id}"
                     })
                     
             except Exception as e:
-                return json.dumps({"status": "error", "message": str(e)})
+                return _dumps({"status": "error", "message": str(e)})
+            finally:
+                # Speculative work that turned out not to be needed
+                for task in (bp_task, report_task):
+                    if task is not None and not task.done():
+                        task.cancel()
         
         @tool
         async def create_sav_ticket(issue_title: str, issue_description: str, customer_email: str, priority: str = "normal") -> str:
             """Create SAV (Service After Sale) ticket when automated processing fails."""
+            _note_side_effect("create_sav_ticket")
             try:
                 # Create the support ticket
                 result = await self.support_tools.create_support_ticket(
@@ -207,30 +487,17 @@ Customer Service Team
                     estimated_response_time = result.get("estimated_response_time", "24 hours")
                     
                     # Compose professional email to customer
-                    email_subject = f"Support Ticket Created - {ticket_id}"
-                    email_body = f"""Dear Valued Customer,
-
-        Thank you for contacting us regarding your invoice request.
-
-        We apologize for the inconvenience you experienced. We have created a support ticket to resolve your issue promptly.
-
-        Ticket Details:
-        - Ticket ID: {ticket_id}
-        - Priority: {priority.title()}
-        - Estimated Response Time: {estimated_response_time}
-
-        Our customer service team will review your request and contact you at {customer_email} within the estimated timeframe.
-
-        If you have any urgent questions, please reference ticket ID {ticket_id} in your communication.
-
-        Thank you for your patience and understanding.
-
-        Best regards,
-        Customer Service Team"""
-
+                    email_subject = SAV_SUBJECT_TMPL.format_map({"ticket_id": ticket_id})
+                    email_body = SAV_BODY_TMPL.format_map({
+                        "ticket_id": ticket_id,
+                        "priority": priority.title(),
+                        "estimated_response_time": estimated_response_time,
+                        "customer_email": customer_email
+                    })
+                    
                     # Send email notification using Gmail tool
                     try:
-                        email_sent = self.gmail_tool.send_email(
+                        email_sent = await self._send_email(
                             to_email=customer_email,
                             subject=email_subject,
                             body=email_body
@@ -250,7 +517,7 @@ Customer Service Team
                         result["email_error"] = str(email_error)
                         result["message"] = f"SAV ticket {ticket_id} created successfully, but email notification failed: {str(email_error)}"
                         
-                return json.dumps(result)
+                return _dumps(result)
                 
             except Exception as e:
                 # Return error if ticket creation fails
@@ -259,28 +526,26 @@ Customer Service Team
                     "message": f"Failed to create SAV ticket: {str(e)}",
                     "email_sent": False
                 }
-                return json.dumps(error_result)
-
-        return [
-            get_business_partner_from_mail,
-            get_latest_order_for_business_partner,
-            get_invoices_related_to_order,
-            get_invoice_by_id,
-            extract_order_number_from_email,
-            lookup_order_by_id,
+                return _dumps(error_result)
+
+        return sap_tools + [
             generate_crystal_report,
             send_invoice_via_gmail,
             create_sav_ticket
         ]
     
-    async def process_gmail_message(self, message: GmailMessage) -> Dict[str, Any]:
-        """Process a Gmail message for invoice requests"""
+    async def process_gmail_message(self, message: GmailMessage, is_invoice: Optional[bool] = None) -> Dict[str, Any]:
+        """Process a Gmail message for invoice requests (is_invoice skips classification when already known)"""
         try:
-            logger.info(f"Processing message from: {message.sender}")
-            logger.info(f"Subject: {message.subject}")
+            logger.info("Processing message from: %s | Subject: %s", message.sender, message.subject)
             
             # Check if this looks like an invoice request using LLM
-            if not self.gmail_tool.is_invoice_request(message):
+            if is_invoice is None:
+                if not _INVOICE_KEYWORD_RE.search(f"{message.subject}\n{message.body[:2048]}"):
+                    logger.info("No invoice keywords, skipping")
+                    return {"status": "skipped", "reason": "regex_prefilter"}
+                is_invoice = self.gmail_tool.is_invoice_request(message)
+            if not is_invoice:
                 logger.info("Not an invoice request, skipping")
                 return {"status": "skipped", "reason": "Not an invoice request"}
 
@@ -301,12 +566,10 @@ Please help this customer get their invoice using our SAP B1 system. Follow the
             logger.info("Processing request with LangChain agent...")
             
             # Execute the agent
-            response = await self.agent_executor.ainvoke({
-                "input": user_input
-            })
+            response = await self._run_agent(user_input)
             
             # Mark email as read
-            self.gmail_tool.mark_as_read(message.message_id)
+            await asyncio.to_thread(self.gmail_tool.mark_as_read, message.message_id)
             
             logger.info("Message processed successfully")
             
@@ -318,37 +581,97 @@ Please help this customer get their invoice using our SAP B1 system. Follow the
             }
             
         except Exception as e:
-            logger.error(f"Error processing message: {e}")
+            logger.error("Error processing message: %s", e)
             
-            # Create SAV ticket for error
-            try:
-                await self.support_tools.create_support_ticket(
-                    title=f"AI Processing Error - Gmail Message from {message.sender}",
-                    description=f"Error: {str(e)}\n\nOriginal Message:\nFrom: {message.sender}\nSubject: {message.subject}\nBody: {message.body}",
-                    customer_email=message.sender,
-                    priority="high"
-                )
-            except:
-                pass  # Don't fail if ticket creation also fails
+            # Create SAV ticket for error in the background so a slow ticket system
+            # doesn't hold up the pipeline
+            task = asyncio.create_task(self._safe_create_ticket(
+                title=f"AI Processing Error - Gmail Message from {message.sender}",
+                description=f"Error: {str(e)}\n\nOriginal Message:\nFrom: {message.sender}\nSubject: {message.subject}\nBody: {message.body}",
+                customer_email=message.sender,
+                priority="high"
+            ))
+            self._background.add(task)
+            task.add_done_callback(self._background.discard)
             
             return {"status": "error", "error": str(e)}
     
-    async def monitor_gmail_continuously(self, check_interval: int = 60):
-        """Continuously monitor Gmail for new invoice requests"""
+    async def _safe_create_ticket(self, **ticket):
+        """Create a support ticket, logging instead of raising if that fails too"""
+        try:
+            await self.support_tools.create_support_ticket(**ticket)
+        except Exception as e:
+            logger.warning("Could not create support ticket: %s", e)
+    
+    async def _guarded_process(self, message: GmailMessage, is_invoice: bool,
+                               semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+        """Process a message once a concurrency slot is free"""
+        async with semaphore:
+            return await self.process_gmail_message(message, is_invoice)
+    
+    async def _process_classified(self, classified, semaphore: asyncio.Semaphore):
+        """Process (message, classification) pairs concurrently, at most max_concurrency at a time"""
+        # The batch classification already decided; only invoice requests go to the agent
+        invoice_messages = [message for message, classification in classified if classification.is_invoice_request]
+        if len(invoice_messages) < len(classified):
+            logger.info("Skipping %d non-invoice messages", len(classified) - len(invoice_messages))
+        
+        results = await asyncio.gather(
+            *(self._guarded_process(message, True, semaphore) for message in invoice_messages),
+            return_exceptions=True
+        )
+        for message, result in zip(invoice_messages, results):
+            if isinstance(result, Exception):
+                logger.error("Processing failed for message %s: %s", message.message_id, result)
+            else:
+                logger.info("Processing result: %s", result['status'])
+    
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        The agent's own (uvloop when available) event loop, shared by every sync entry point.
+
+        The async OpenAI connection pool is bound to the loop that opened its connections,
+        so all of the agent's async work has to run on this one loop.
+        """
+        if self._loop is None or self._loop.is_closed():
+            self._loop = _new_event_loop()
+        return self._loop
+    
+    def run_monitor(self, check_interval: int = 60, push_topic: Optional[str] = None, push_port: int = 8080):
+        """Blocking entry point for monitor_gmail_continuously, on the agent's event loop"""
+        loop = self._get_loop()
+        try:
+            return loop.run_until_complete(self.monitor_gmail_continuously(check_interval, push_topic, push_port))
+        finally:
+            # Let error tickets still in flight finish; the loop itself stays open for the agent
+            loop.run_until_complete(self._drain_background())
+    
+    async def monitor_gmail_continuously(self, check_interval: int = 60, push_topic: Optional[str] = None,
+                                         push_port: int = 8080):
+        """
+        Continuously monitor Gmail for new invoice requests.
+        
+        With a Pub/Sub topic (push_topic or GMAIL_PUSH_TOPIC) messages are handled as Gmail
+        pushes them; without one the inbox is polled every check_interval seconds.
+        """
+        push_topic = push_topic or os.getenv("GMAIL_PUSH_TOPIC")
+        if push_topic:
+            await self.serve_push_notifications(push_topic, port=push_port)
+            return
+        
         logger.info(f"Starting Gmail monitoring (checking every {check_interval} seconds)")
         
+        # Created here so it belongs to the loop running the monitor
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        
         while True:
             try:
-                # Simple query for unread messages - let LLM do the classification
-                messages = self.gmail_tool.get_messages(query="is:unread")
-                
-                # Process each message
-                for message in messages:
-                    result = await self.process_gmail_message(message)
-                    logger.info(f"Processing result: {result['status']}")
-                    await asyncio.sleep(1)  # Small delay between messages
+                # Simple query for unread messages - let LLM do the classification;
+                # the batched LLM requests overlap with the Gmail fetches
+                classified = await self.gmail_tool.get_and_classify_messages_async(query="is:unread")
+                await self._process_classified(classified, semaphore)
                 
-                if not messages:
+                if not classified:
                     logger.info("No new messages found")
                 
                 logger.info(f"Waiting {check_interval} seconds before next check...")
@@ -361,6 +684,119 @@ Please help this customer get their invoice using our SAP B1 system. Follow the
                 logger.error(f"Error in monitoring loop: {e}")
                 await asyncio.sleep(30)  # Wait before retrying
     
+    async def handle_push(self, history_id: str, semaphore: asyncio.Semaphore):
+        """Process the messages added since the last handled Gmail push notification"""
+        start_history_id = self._push_history_id
+        if start_history_id is None:
+            # Nothing to diff against yet: catch up on everything unread
+            classified = await self.gmail_tool.get_and_classify_messages_async(query="is:unread")
+            self._push_history_id = history_id
+        else:
+            try:
+                messages, self._push_history_id = await asyncio.to_thread(
+                    self.gmail_tool.get_messages_since, start_history_id
+                )
+            except SAPAssistantError as e:
+                # The history id may have expired; fall back to a full unread scan
+                logger.warning(f"Gmail history lookup failed, rescanning unread messages: {e}")
+                classified = await self.gmail_tool.get_and_classify_messages_async(query="is:unread")
+                self._push_history_id = history_id
+            else:
+                classified = list(zip(messages, await self.gmail_tool.aclassify_emails(messages)))
+        
+        await self._process_classified(classified, semaphore)
+    
+    async def serve_push_notifications(self, topic_name: str, host: str = "127.0.0.1", port: int = 8080,
+                                       path: str = "/gmail/push", push_token: Optional[str] = None,
+                                       push_audience: Optional[str] = None):
+        """
+        Register a Gmail watch on topic_name and handle its Pub/Sub push deliveries.
+        
+        The Pub/Sub push subscription of the topic must point at http://<host>:<port><path>.
+        Deliveries are only accepted when authenticated, by a shared secret passed as the
+        ?token= query parameter of the push endpoint (push_token or GMAIL_PUSH_TOKEN) and/or
+        by the subscription's OIDC bearer token issued for push_audience (or GMAIL_PUSH_AUDIENCE).
+        Runs until cancelled, renewing the watch daily.
+        """
+        push_token = push_token or os.getenv("GMAIL_PUSH_TOKEN")
+        push_audience = push_audience or os.getenv("GMAIL_PUSH_AUDIENCE")
+        if not push_token and not push_audience:
+            raise ValueError(
+                "Gmail push notifications need GMAIL_PUSH_TOKEN (shared secret) or "
+                "GMAIL_PUSH_AUDIENCE (OIDC audience of the push subscription)"
+            )
+        
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        push_lock = asyncio.Lock()  # Notifications are diffed one after another
+        pending = set()
+        
+        async def run_push(history_id: str):
+            async with push_lock:
+                try:
+                    await self.handle_push(history_id, semaphore)
+                except Exception as e:
+                    logger.error(f"Error handling Gmail push notification: {e}")
+        
+        async def on_push(request: web.Request) -> web.Response:
+            if not await self._is_authorized_push(request, push_token, push_audience):
+                logger.warning("Rejected unauthenticated Gmail push notification from %s", request.remote)
+                return web.Response(status=401)
+            try:
+                envelope = await request.json()
+                notification = json.loads(base64.b64decode(envelope["message"]["data"]))
+                history_id = str(notification["historyId"])
+            except (ValueError, KeyError, TypeError) as e:
+                logger.warning(f"Ignoring malformed Gmail push notification: {e}")
+                return web.Response(status=400)
+            
+            # Acknowledge right away so Pub/Sub does not redeliver while the agent runs
+            task = asyncio.create_task(run_push(history_id))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            return web.Response(status=204)
+        
+        app = web.Application()
+        app.router.add_post(path, on_push)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Listening for Gmail push notifications on {host}:{port}{path}")
+        
+        try:
+            while True:
+                watch = await asyncio.to_thread(self.gmail_tool.register_watch, topic_name)
+                if self._push_history_id is None:
+                    # Catch up on mail that arrived before the watch, then diff from its history id
+                    await run_push(str(watch.get("historyId")))
+                logger.info(f"Gmail watch registered on {topic_name} (expires {watch.get('expiration')})")
+                await asyncio.sleep(GMAIL_WATCH_RENEW_INTERVAL)
+        finally:
+            await runner.cleanup()
+    
+    @staticmethod
+    async def _is_authorized_push(request: web.Request, push_token: Optional[str],
+                                  push_audience: Optional[str]) -> bool:
+        """Whether a push delivery carries the shared secret or a valid Pub/Sub OIDC token"""
+        if push_token and hmac.compare_digest(request.query.get("token", "").encode(), push_token.encode()):
+            return True
+        
+        scheme, _, bearer = request.headers.get("Authorization", "").partition(" ")
+        if not push_audience or scheme.lower() != "bearer" or not bearer:
+            return False
+        try:
+            # Checks the signature against Google's certificates, the expiry and the audience
+            claims = await asyncio.to_thread(
+                id_token.verify_oauth2_token, bearer, google_requests.Request(), push_audience
+            )
+        except Exception as e:
+            logger.warning("Invalid Gmail push OIDC token: %s", e)
+            return False
+        
+        service_account = os.getenv("GMAIL_PUSH_SERVICE_ACCOUNT")
+        if service_account:
+            return claims.get("email") == service_account and bool(claims.get("email_verified"))
+        return True
+    
     def process_single_message(self, message_data: Dict[str, Any]) -> Dict[str, Any]:
         """Process a single message (for CLI integration)"""
         message = GmailMessage(
@@ -372,14 +808,33 @@ Please help this customer get their invoice using our SAP B1 system. Follow the
             thread_id=message_data.get("thread_id", "")
         )
         
-        # Run async method in sync context
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        try:
-            result = loop.run_until_complete(self.process_gmail_message(message))
-            return result
-        finally:
-            loop.close()
+        # Run async method in sync context, on the loop kept for the agent's lifetime
+        return self._get_loop().run_until_complete(self._process_and_drain(message))
+    
+    async def _process_and_drain(self, message: GmailMessage) -> Dict[str, Any]:
+        """Process a message and wait for any support ticket it spawned, as nothing runs the loop afterwards"""
+        result = await self.process_gmail_message(message)
+        await self._drain_background()
+        return result
+    
+    async def _drain_background(self):
+        """Wait for pending fire-and-forget tasks (error support tickets)"""
+        while self._background:
+            await asyncio.gather(*list(self._background), return_exceptions=True)
+    
+    async def aclose(self):
+        """Wait for pending support tickets, then close the OpenAI connection pools shared by the agent and its Gmail tool"""
+        await self._drain_background()
+        self._openai_http_client.close()
+        await self._openai_http_async_client.aclose()
+    
+    def close(self):
+        """Close the connection pools and the agent's event loop"""
+        loop = self._get_loop()
+        loop.run_until_complete(self.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+        loop.close()
+        self._loop = None
 
     def invoke(self, state: Dict[str, Any]) -> Dict[str, Any]:
         """Invoke method for workflow integration"""
@@ -393,7 +848,7 @@ Please help this customer get their invoice using our SAP B1 system. Follow the
                 
             elif action == "get_messages":
                 query = state.get("gmail_query", "is:unread")
-                messages = self.gmail_tool.get_messages(query)
+                messages = self.gmail_tool.iter_messages(query)
                 state["gmail_messages"] = [
                     {
                         "message_id": msg.message_id,
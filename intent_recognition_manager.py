@@ -3,14 +3,24 @@
 import logging
 import time
 import asyncio
+import copy
+import threading
+import weakref
+from collections import Counter
 from typing import Dict, Any, Optional
 from datetime import datetime
 
+from cachetools import TTLCache
+
 from .distilbert_intent_recognizer import DistilBERTIntentRecognizer
 from .zero_shot_recognizer import ZeroShotIntentRecognizer
 
 logger = logging.getLogger("IntentRecognitionManager")
 
+# Repeated queries (UI buttons, test harnesses) skip both recognizers
+INTENT_CACHE_SIZE = 4096
+INTENT_CACHE_TTL = 600  # seconds
+
 class IntentRecognitionManager:
     """
     Simplified Intent Recognition: DistilBERT for speed, LLM for reliability.
@@ -18,8 +28,10 @@ class IntentRecognitionManager:
     """
     
     def __init__(self, entity_registry=None, sap_client=None, llm=None, 
-                 distilbert_model_path="sap_intent_model_trained"):
+                 distilbert_model_path="sap_intent_model_trained", speculative: bool = True):
         self.entity_registry = entity_registry
+        # Start the LLM call alongside DistilBERT; disable to save OpenAI calls at the cost of latency
+        self.speculative = speculative
         
         # Initialize DistilBERT (optional - works without it)
         try:
@@ -34,73 +46,150 @@ class IntentRecognitionManager:
         # Initialize LLM fallback (required)
         self.llm_recognizer = ZeroShotIntentRecognizer(entity_registry)
         
-        # Simple stats tracking
-        self.stats = {
-            "total_queries": 0,
-            "distilbert_used": 0,
-            "llm_used": 0,
-            "start_time": datetime.now()
-        }
+        # Results keyed on the normalized query, shared by every thread using the manager
+        self._intent_cache = TTLCache(maxsize=INTENT_CACHE_SIZE, ttl=INTENT_CACHE_TTL)
+        self._intent_cache_lock = threading.Lock()
+        # Recognitions in flight, per event loop (asyncio tasks can't be awaited from
+        # another loop), so concurrent duplicates on a loop wait for the first one
+        self._inflight = weakref.WeakKeyDictionary()
+        
+        # Simple stats tracking; the manager can be driven from several threads (each with
+        # its own event loop), so counters only change through _count under the lock
+        self.stats = Counter()
+        self._stats_lock = threading.Lock()
+        self.start_time = datetime.now()
     
     async def recognize_intent(self, query: str, **kwargs) -> Dict[str, Any]:
+        """Recognize the intent of a query, reusing recent results for the same normalized query."""
+        self._count("total_queries")
+        key = query.strip().lower()
+        
+        with self._intent_cache_lock:
+            cached = self._intent_cache.get(key)
+        if cached is not None:
+            self._count("cache_hits")
+            return copy.deepcopy(cached)
+        
+        inflight = self._inflight_for_running_loop()
+        task = inflight.get(key)
+        if task is None:
+            task = inflight[key] = asyncio.ensure_future(self._recognize_and_cache(key, query))
+            task.add_done_callback(lambda done: inflight.pop(key, None) if inflight.get(key) is done else None)
+        # Shielded so one cancelled caller doesn't cancel the recognition for the others
+        return copy.deepcopy(await asyncio.shield(task))
+    
+    def _inflight_for_running_loop(self) -> Dict[str, asyncio.Task]:
+        loop = asyncio.get_running_loop()
+        with self._intent_cache_lock:
+            inflight = self._inflight.get(loop)
+            if inflight is None:
+                inflight = self._inflight[loop] = {}
+        return inflight
+    
+    async def _recognize_and_cache(self, key: str, query: str) -> Dict[str, Any]:
+        result = await self._recognize_intent_uncached(query)
+        # Failures are not cached so the next attempt retries both recognizers
+        if result.get("method_used") != "failed":
+            with self._intent_cache_lock:
+                self._intent_cache[key] = copy.deepcopy(result)
+        return result
+    
+    async def _recognize_intent_uncached(self, query: str) -> Dict[str, Any]:
         """
         Simple 2-step process:
         1. Try DistilBERT if available and confident (>= 0.8)
         2. Otherwise use LLM (always works)
+        
+        In speculative mode the LLM call starts alongside DistilBERT and is
+        cancelled when DistilBERT is confident, so a miss costs the slower of
+        the two instead of their sum.
         """
         start_time = time.time()
-        self.stats["total_queries"] += 1
         
-        # Step 1: Try DistilBERT for speed
-        if self.distilbert:
-            try:
-                result = self.distilbert.predict_intent(query)
-                confidence = result.get("confidence", 0)
-                
-                # Use DistilBERT if highly confident
-                if confidence >= 0.8:
-                    result["method_used"] = "distilbert"
-                    result["total_response_time_ms"] = (time.time() - start_time) * 1000
-                    self.stats["distilbert_used"] += 1
-                    
-                    logger.info(f"DistilBERT: {result['intent']} (confidence: {confidence:.3f})")
-                    return result
-                else:
-                    logger.info(f"DistilBERT low confidence ({confidence:.3f}), using LLM fallback")
-                    
-            except Exception as e:
-                logger.warning(f"DistilBERT failed: {e}")
+        llm_task = None
+        if self.distilbert and self.speculative:
+            llm_task = asyncio.create_task(self.llm_recognizer.recognize_intent(query))
         
-        # Step 2: LLM fallback (always use if DistilBERT unavailable/low confidence)
         try:
-            result = await self.llm_recognizer.recognize_intent(query)
-            result["method_used"] = "llm_fallback"
-            result["total_response_time_ms"] = (time.time() - start_time) * 1000
-            self.stats["llm_used"] += 1
-            
-            logger.info(f"LLM: {result['intent']} (confidence: {result.get('confidence', 0):.3f})")
-            return result
+            # Step 1: Try DistilBERT for speed
+            if self.distilbert:
+                try:
+                    # Inference is CPU-bound: run it off the event loop so concurrent requests
+                    # (and the LLM fallback of others) keep making progress meanwhile
+                    result = await asyncio.to_thread(self.distilbert.predict_intent, query)
+                    confidence = result.get("confidence", 0)
+                    
+                    # Use DistilBERT if highly confident
+                    if confidence >= 0.8:
+                        result["method_used"] = "distilbert"
+                        result["total_response_time_ms"] = (time.time() - start_time) * 1000
+                        self._count("distilbert_used")
+                        
+                        logger.info("DistilBERT: %s (confidence: %.3f)", result['intent'], confidence)
+                        return result
+                    else:
+                        logger.info("DistilBERT low confidence (%.3f), using LLM fallback", confidence)
+                        
+                except Exception as e:
+                    logger.warning("DistilBERT failed: %s", e)
             
-        except Exception as e:
-            logger.error(f"Both DistilBERT and LLM failed: {e}")
-            return {
-                "intent": "unknown",
-                "confidence": 0.0,
-                "method_used": "failed",
-                "error": str(e),
-                "total_response_time_ms": (time.time() - start_time) * 1000
-            }
+            # Step 2: LLM fallback (always use if DistilBERT unavailable/low confidence)
+            try:
+                if llm_task is not None:
+                    result = await llm_task
+                else:
+                    result = await self.llm_recognizer.recognize_intent(query)
+                result["method_used"] = "llm_fallback"
+                result["total_response_time_ms"] = (time.time() - start_time) * 1000
+                self._count("llm_used")
+                
+                logger.info("LLM: %s (confidence: %.3f)", result['intent'], result.get('confidence', 0))
+                return result
+                
+            except Exception as e:
+                logger.error("Both DistilBERT and LLM failed: %s", e)
+                return {
+                    "intent": "unknown",
+                    "confidence": 0.0,
+                    "method_used": "failed",
+                    "error": str(e),
+                    "total_response_time_ms": (time.time() - start_time) * 1000
+                }
+        finally:
+            if llm_task is not None:
+                self._discard_speculative(llm_task)
+    
+    @staticmethod
+    def _discard_speculative(task: asyncio.Task):
+        """Cancel an unneeded speculative LLM call, or consume its outcome if it already finished."""
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled():
+            # Mark a failure as retrieved so asyncio doesn't log it as unhandled
+            task.exception()
+    
+    def _count(self, name: str):
+        """Increment one usage counter"""
+        with self._stats_lock:
+            self.stats[name] += 1
     
     def get_usage_statistics(self) -> Dict[str, Any]:
         """Simple stats for monitoring."""
-        total = self.stats["total_queries"]
+        # One consistent snapshot, so the ratios below add up
+        with self._stats_lock:
+            stats = dict(self.stats)
+        total = stats.get("total_queries", 0)
         if total == 0:
             return {"message": "No queries processed yet"}
         
+        cache_hits = stats.get("cache_hits", 0)
+        distilbert_used = stats.get("distilbert_used", 0)
+        llm_used = stats.get("llm_used", 0)
         return {
             "total_queries": total,
-            "distilbert_usage": f"{self.stats['distilbert_used']}/{total} ({self.stats['distilbert_used']/total*100:.1f}%)",
-            "llm_usage": f"{self.stats['llm_used']}/{total} ({self.stats['llm_used']/total*100:.1f}%)",
-            "session_duration": str(datetime.now() - self.stats["start_time"]),
+            "cache_hits": f"{cache_hits}/{total} ({cache_hits/total*100:.1f}%)",
+            "distilbert_usage": f"{distilbert_used}/{total} ({distilbert_used/total*100:.1f}%)",
+            "llm_usage": f"{llm_used}/{total} ({llm_used/total*100:.1f}%)",
+            "session_duration": str(datetime.now() - self.start_time),
             "distilbert_available": self.distilbert is not None
         }
\ No newline at end of file
@@ -12,6 +12,7 @@ from utils.enhanced_errors import (
     SAPAssistantError
 )
 from utils.url_validator import ODataURLValidator
+from utils.sap_context import get_metadata_manager
 from config import get_sap_credentials
 import logging
 from datetime import datetime
@@ -19,6 +20,90 @@ from datetime import datetime
 # Set up logger
 logger = logging.getLogger(__name__)
 
+# SAP B1 domain knowledge rules applied by _inject_domain_knowledge, compiled once
+
+# 1.-3., 5.-6. Status, boolean, null, date and numeric corrections in one scan: each
+# alternative is a named group, and _apply_domain_fix dispatches on the one that matched
+_DOMAIN_FIX_RE = re.compile(
+    # 1. Document Status corrections (most critical); longest values first
+    r"(?P<status>DocumentStatus\s+eq\s+'?(?P<status_value>[Oo]pen|[Cc]losed|[Cc]ancelled|[Oo]|[Cc])\b'?)"
+    # 2. Boolean field corrections
+    r"|(?P<boolean>(?P<bool_field>Paid|Active|Valid)\s+eq\s+'?(?P<bool_value>[Tt]rue|[Ff]alse)'?)"
+    # 3. Null value corrections
+    r"|(?P<null>\s+(?P<null_op>eq|ne)\s+(?:None\b|'None'))"
+    # 5. Date format corrections: datetime prefix for date fields, and 'now'
+    r"|(?P<date>(?P<date_field>CreateDate|DocDate|ReferenceDate|UpdateDate|DueDate|PostingDate|TaxDate)"
+    r"\s+(?P<date_op>[gl]e|eq)\s+'(?P<date_value>\d{4}-\d{2}-\d{2})')"
+    r"|(?P<now>(?P<now_op>[gl]e|eq)\s+'now')"
+    # 6. Numeric field corrections (remove quotes from numbers)
+    r"|(?P<numeric>(?P<num_field>DocEntry|DocNum|DocTotal|LineTotal|Price|Quantity|QuantityOnStock|Series)"
+    r"\s+(?P<num_op>[gl]e|eq)\s+'(?P<num_value>\d+(?:\.\d+)?)'(?=\s|&|$))"
+)
+
+_DOCUMENT_STATUS_CODES = {
+    "o": "bost_Open",
+    "open": "bost_Open",
+    "c": "bost_Close",
+    "closed": "bost_Close",
+    "cancelled": "bost_Cancelled",
+}
+
+def _fix_status(m):
+    return f"DocumentStatus eq '{_DOCUMENT_STATUS_CODES[m.group('status_value').lower()]}'"
+
+def _fix_boolean(m):
+    value = "tYES" if m.group("bool_value").lower() == "true" else "tNO"
+    return f"{m.group('bool_field')} eq '{value}'"
+
+def _fix_null(m):
+    return f" {m.group('null_op')} null"
+
+def _fix_date(m):
+    return f"{m.group('date_field')} {m.group('date_op')} datetime'{m.group('date_value')}T00:00:00'"
+
+def _fix_now(m):
+    return f"{m.group('now_op')} datetime'{datetime.now().strftime('%Y-%m-%d')}T00:00:00'"
+
+def _fix_numeric(m):
+    return f"{m.group('num_field')} {m.group('num_op')} {m.group('num_value')}"
+
+_DOMAIN_FIX_HANDLERS = {
+    "status": _fix_status,
+    "boolean": _fix_boolean,
+    "null": _fix_null,
+    "date": _fix_date,
+    "now": _fix_now,
+    "numeric": _fix_numeric,
+}
+
+def _apply_domain_fix(m):
+    # lastgroup is the outer named group of the alternative that matched
+    return _DOMAIN_FIX_HANDLERS[m.lastgroup](m)
+
+# 4. String field quoting (add quotes to unquoted strings)
+_STRING_FIELD_RE = re.compile(r"(CardName|ItemName|CardCode|ItemCode|Reference|Memo)\s+eq\s+([^'\s&][^\s&]*)")
+
+# 7. Quoted strings in filter conditions, for apostrophe escaping
+_APOSTROPHE_RE = re.compile(r"(\w+\s+eq\s+')([^']*(?:'[^']*)*)'(?=\s|&|$)")
+
+# 8./9. Entity-specific status corrections
+_PRODUCTION_ORDER_OPEN_RE = re.compile(r"DocumentStatus\s+eq\s+'bost_Open'")
+_SERVICE_CALL_OPEN_RE = re.compile(r"Status\s+eq\s+'open'")
+_SERVICE_CALL_CLOSED_RE = re.compile(r"Status\s+eq\s+'closed'")
+
+def _escape_quotes(match):
+    field_part = match.group(1)  # "CardName eq '"
+    string_value = match.group(2)  # "O'Neill Inc."
+    # Only escape if not already escaped
+    if "'" in string_value and "''" not in string_value:
+        escaped_value = string_value.replace("'", "''")
+        return f"{field_part}{escaped_value}'"
+    return match.group(0)
+
+def _fix_apostrophes_in_strings(url):
+    """Double apostrophes inside quoted filter values (O'Neill -> O''Neill)"""
+    return _APOSTROPHE_RE.sub(_escape_quotes, url)
+
 class ODataConstructorTool:
     
     def __init__(self, base_url=None, entity_registry=None):
@@ -43,6 +128,9 @@ class ODataConstructorTool:
         # Store entity registry reference
         self.entity_registry = entity_registry    
         
+        # Flattened {field name: type} per entity type; schemas don't change while the process runs
+        self._field_types_cache: Dict[str, Dict[str, str]] = {}
+        
         # Ensure the base URL has a trailing slash
         if not self.base_url.endswith("/"):
             self.base_url += "/"
@@ -74,18 +162,24 @@ class ODataConstructorTool:
                 return ""
 
             # Get field type information from entity registry
-            field_types = {}
-            if self.entity_registry and entity_type:
-                try:
-                    schema = await self.entity_registry.get_entity_schema(entity_type)
-                    properties = schema.get('properties', [])
+            field_types = self._field_types_cache.get(entity_type)
+            if field_types is None:
+                field_types = {}
+                if self.entity_registry and entity_type:
+                    try:
+                        schema = await self.entity_registry.get_entity_schema(entity_type)
+                        properties = schema.get('properties', [])
+                        
+                        if isinstance(properties, list):
+                            for prop in properties:
+                                if isinstance(prop, dict) and 'name' in prop and 'type' in prop:
+                                    field_types[prop['name']] = prop['type']
+                    except Exception as e:
+                        print(f"Error getting schema for {entity_type}: {str(e)}")
                     
-                    if isinstance(properties, list):
-                        for prop in properties:
-                            if isinstance(prop, dict) and 'name' in prop and 'type' in prop:
-                                field_types[prop['name']] = prop['type']
-                except Exception as e:
-                    print(f"Error getting schema for {entity_type}: {str(e)}")
+                    # An empty result may be a registry that isn't loaded yet: ask again next time
+                    if field_types:
+                        self._field_types_cache[entity_type] = field_types
             
             # SAP B1 specific field classifications
             date_fields = ['DocDate', 'CreateDate', 'UpdateDate', 'DueDate', 'TaxDate', 'PostingDate', 'ReferenceDate']
@@ -179,90 +273,26 @@ class ODataConstructorTool:
             # ENHANCED: Comprehensive SAP B1 knowledge rules
             enhanced_url = url
             
-            # 1. Document Status corrections (most critical)
-            status_fixes = [
-                (r"DocumentStatus\s+eq\s+'?([Oo]|[Oo]pen)'?", "DocumentStatus eq 'bost_Open'"),
-                (r"DocumentStatus\s+eq\s+'?([Cc]|[Cc]losed)'?", "DocumentStatus eq 'bost_Close'"),
-                (r"DocumentStatus\s+eq\s+'?([Cc]ancelled)'?", "DocumentStatus eq 'bost_Cancelled'"),
-                # Handle single letter codes
-                (r"DocumentStatus\s+eq\s+'O'", "DocumentStatus eq 'bost_Open'"),
-                (r"DocumentStatus\s+eq\s+'C'", "DocumentStatus eq 'bost_Close'"),
-            ]
-            
-            for pattern, replacement in status_fixes:
-                enhanced_url = re.sub(pattern, replacement, enhanced_url)
-            
-            # 2. Boolean field corrections  
-            boolean_fixes = [
-                (r"(Paid|Active|Valid)\s+eq\s+'?([Tt]rue)'?", r"\1 eq 'tYES'"),
-                (r"(Paid|Active|Valid)\s+eq\s+'?([Ff]alse)'?", r"\1 eq 'tNO'"),
-            ]
-            
-            for pattern, replacement in boolean_fixes:
-                enhanced_url = re.sub(pattern, replacement, enhanced_url)
-            
-            # 3. Null value corrections
-            null_fixes = [
-                (r"\s+eq\s+None\b", " eq null"),
-                (r"\s+ne\s+None\b", " ne null"),
-                (r"\s+eq\s+'None'", " eq null"),
-                (r"\s+ne\s+'None'", " ne null"),
-            ]
+            # 1.-3., 5.-6. Status, boolean, null, date and numeric corrections, in a single pass
+            enhanced_url = _DOMAIN_FIX_RE.sub(_apply_domain_fix, enhanced_url)
             
-            for pattern, replacement in null_fixes:
-                enhanced_url = re.sub(pattern, replacement, enhanced_url)
-            
-            # 4. String field quoting (add quotes to unquoted strings)
-            string_field_pattern = r"(CardName|ItemName|CardCode|ItemCode|Reference|Memo)\s+eq\s+([^'\s&][^\s&]*)"
-            enhanced_url = re.sub(string_field_pattern, r"\1 eq '\2'", enhanced_url)
-            
-            # 5. Date format corrections
-            date_fixes = [
-                # Add datetime prefix for date fields
-                (r"(CreateDate|DocDate|ReferenceDate|UpdateDate|DueDate|PostingDate|TaxDate)\s+([gl]e|eq)\s+'(\d{4}-\d{2}-\d{2})'", 
-                 r"\1 \2 datetime'\3T00:00:00'"),
-                 
-                # Fix 'now' patterns
-                (r"([gl]e|eq)\s+'now'", lambda m: f"{m.group(1)} datetime'{datetime.now().strftime('%Y-%m-%d')}T00:00:00'"),
-            ]
-            
-            for pattern, replacement in date_fixes:
-                if callable(replacement):
-                    enhanced_url = re.sub(pattern, replacement, enhanced_url)
-                else:
-                    enhanced_url = re.sub(pattern, replacement, enhanced_url)
-            
-            # 6. Numeric field corrections (remove quotes from numbers)
-            numeric_pattern = r"(DocEntry|DocNum|DocTotal|LineTotal|Price|Quantity|QuantityOnStock|Series)\s+([gl]e|eq)\s+'(\d+(?:\.\d+)?)'(?:\s|&|$)"
-            enhanced_url = re.sub(numeric_pattern, r"\1 \2 \3", enhanced_url)
+            # 4. String field quoting (add quotes to unquoted strings); runs after the null
+            # corrections, as before, but now also after the 'now' rule, so a value quoted
+            # here (CardName eq now -> 'now') stays a string instead of becoming a datetime
+            enhanced_url = _STRING_FIELD_RE.sub(r"\1 eq '\2'", enhanced_url)
             
             # 7. String escaping for names with apostrophes
-            def fix_apostrophes_in_strings(url):
-                # Pattern to find quoted strings in filter conditions
-                pattern = r"(\w+\s+eq\s+')([^']*(?:'[^']*)*)'(?=\s|&|$)"
-                
-                def escape_quotes(match):
-                    field_part = match.group(1)  # "CardName eq '"
-                    string_value = match.group(2)  # "O'Neill Inc."
-                    # Only escape if not already escaped
-                    if "'" in string_value and "''" not in string_value:
-                        escaped_value = string_value.replace("'", "''")
-                        return f"{field_part}{escaped_value}'"
-                    return match.group(0)
-                
-                return re.sub(pattern, escape_quotes, url)
-
-            enhanced_url = fix_apostrophes_in_strings(enhanced_url)
+            enhanced_url = _fix_apostrophes_in_strings(enhanced_url)
             
             # 8. Entity-specific corrections
             if entity_type == "ProductionOrders":
                 # Fix ProductionOrder status
-                enhanced_url = re.sub(r"DocumentStatus\s+eq\s+'bost_Open'", "ProductionOrderStatus eq 'boposReleased'", enhanced_url)
+                enhanced_url = _PRODUCTION_ORDER_OPEN_RE.sub("ProductionOrderStatus eq 'boposReleased'", enhanced_url)
                 
             # 9. ServiceCall status corrections
             if entity_type == "ServiceCalls":
-                enhanced_url = re.sub(r"Status\s+eq\s+'open'", "Status eq -1", enhanced_url)
-                enhanced_url = re.sub(r"Status\s+eq\s+'closed'", "Status eq 1", enhanced_url)
+                enhanced_url = _SERVICE_CALL_OPEN_RE.sub("Status eq -1", enhanced_url)
+                enhanced_url = _SERVICE_CALL_CLOSED_RE.sub("Status eq 1", enhanced_url)
             
             # Log changes if any were made
             if enhanced_url != url:
@@ -446,8 +476,8 @@ class ODataConstructorTool:
                     url += "?" + "&".join(params)
             
             # **NEW: PROACTIVE ERROR PREVENTION - ADD THIS SECTION HERE**
-            if "metadata_manager" in state and state["metadata_manager"]:
-                metadata_manager = state["metadata_manager"]
+            metadata_manager = get_metadata_manager(state)
+            if metadata_manager:
                 
                 # Assess risk before applying any fixes
                 risk_assessment = metadata_manager.assess_query_risk(structured_query, url)
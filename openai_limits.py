@@ -0,0 +1,158 @@
+# utils/openai_limits.py
+
+import asyncio
+import collections
+import os
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import httpx
+
+# Shared by every component that calls OpenAI (agent runs, intent recognition, email
+# classification) so that together they stay under the account's rate limits instead
+# of running into 429 retry storms. Applied per HTTP request by the transports below
+OPENAI_CONCURRENCY = int(os.getenv("OPENAI_CONCURRENCY", "8"))
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))  # 0 disables the per-minute cap
+
+class OpenAIRequestLimiter:
+    """
+    Process-wide cap on concurrent OpenAI requests and requests per minute.
+
+    Thread-safe, so sync clients (worker threads) and async clients (any event loop)
+    draw from the same slots and the same token bucket. Async waiters park a future on
+    their own loop rather than a thread, so a burst of queued requests can't exhaust the
+    default executor that Gmail and SAP calls also run on.
+    """
+
+    def __init__(self, concurrency: int, rpm: int):
+        self._free = concurrency
+        self._waiters = collections.deque()  # threading.Event (sync) or (loop, future) (async), FIFO
+        self._slots_lock = threading.Lock()
+        self._rpm = rpm
+        self._tokens = float(rpm)
+        self._updated = time.monotonic()
+        self._bucket_lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Take a token from the bucket and return how long to wait before using it"""
+        if self._rpm <= 0:
+            return 0.0
+        with self._bucket_lock:
+            now = time.monotonic()
+            self._tokens = min(self._rpm, self._tokens + (now - self._updated) * self._rpm / 60)
+            self._updated = now
+            # A negative balance queues the request behind the tokens still to refill
+            self._tokens -= 1
+            return max(0.0, -self._tokens * 60 / self._rpm)
+
+    def _release(self):
+        """Hand the slot to the next waiter, or return it to the pool when nobody waits"""
+        with self._slots_lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if isinstance(waiter, threading.Event):
+                    waiter.set()
+                    return
+                loop, future = waiter
+                try:
+                    loop.call_soon_threadsafe(self._deliver, future)
+                    return
+                except RuntimeError:
+                    continue  # The waiter's loop is closed: try the next one
+            self._free += 1
+
+    def _deliver(self, future: asyncio.Future):
+        """Complete an async waiter on its own loop; a waiter cancelled meanwhile passes the slot on"""
+        if future.done():
+            self._release()
+        else:
+            future.set_result(None)
+
+    @contextmanager
+    def slot(self):
+        """Hold a request slot in a synchronous caller"""
+        with self._slots_lock:
+            if self._free > 0:
+                self._free -= 1
+                waiter = None
+            else:
+                waiter = threading.Event()
+                self._waiters.append(waiter)
+        if waiter is not None:
+            waiter.wait()
+        try:
+            time.sleep(self._reserve())
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        """Hold a request slot without blocking the event loop"""
+        with self._slots_lock:
+            if self._free > 0:
+                self._free -= 1
+                waiter = None
+            else:
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                waiter = (loop, future)
+                self._waiters.append(waiter)
+        if waiter is not None:
+            try:
+                await future
+            except asyncio.CancelledError:
+                with self._slots_lock:
+                    try:
+                        self._waiters.remove(waiter)
+                        granted = False
+                    except ValueError:
+                        granted = True  # _release already picked this waiter
+                if granted and future.done() and not future.cancelled():
+                    self._release()
+                # A grant still in flight finds the future cancelled and _deliver passes it on
+                raise
+        try:
+            await asyncio.sleep(self._reserve())
+            yield
+        finally:
+            self._release()
+
+OPENAI_LIMITER = OpenAIRequestLimiter(OPENAI_CONCURRENCY, OPENAI_RPM)
+
+class LimitedTransport(httpx.BaseTransport):
+    """Sync httpx transport sending each request within OPENAI_LIMITER"""
+
+    def __init__(self, transport: httpx.BaseTransport):
+        self._transport = transport
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        with OPENAI_LIMITER.slot():
+            return self._transport.handle_request(request)
+
+    def close(self):
+        self._transport.close()
+
+class LimitedAsyncTransport(httpx.AsyncBaseTransport):
+    """Async httpx transport sending each request within OPENAI_LIMITER"""
+
+    def __init__(self, transport: httpx.AsyncBaseTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        async with OPENAI_LIMITER.aslot():
+            return await self._transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+def limited_http_client(timeout=None, **transport_kwargs) -> httpx.Client:
+    """httpx.Client for OpenAI SDK clients; transport_kwargs go to httpx.HTTPTransport (http2, limits)"""
+    return httpx.Client(transport=LimitedTransport(httpx.HTTPTransport(**transport_kwargs)), timeout=timeout)
+
+def limited_async_http_client(timeout=None, **transport_kwargs) -> httpx.AsyncClient:
+    """Async variant of limited_http_client"""
+    return httpx.AsyncClient(
+        transport=LimitedAsyncTransport(httpx.AsyncHTTPTransport(**transport_kwargs)), timeout=timeout
+    )
@@ -10,6 +10,7 @@ import re
 from langchain.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain.schema import StrOutputParser
+from utils.sap_context import get_metadata_manager
 
 logger = logging.getLogger("QueryOrchestrator")
 
@@ -607,8 +608,8 @@ Remember to:
                 # Get metadata and examples if available
                 metadata = {}
                 examples = []
-                if "metadata_manager" in state and state["metadata_manager"]:
-                    metadata_manager = state["metadata_manager"]
+                metadata_manager = get_metadata_manager(state)
+                if metadata_manager:
                     
                     # Get relevant metadata
                     metadata = metadata_manager.get_relevant_metadata(intent, entities)
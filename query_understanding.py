@@ -1,6 +1,6 @@
 # agents/query_understanding.py (entityextraction phase)
 
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
 from langchain.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain.schema import StrOutputParser
@@ -361,15 +361,17 @@ class QueryUnderstandingAgent:
             print(f"Error enhancing query with registry: {str(e)}")
             return structured_query
     
-    def _ensure_customer_filters(self, query_text: str, structured_query: Dict[str, Any]) -> Dict[str, Any]:
+    def _ensure_customer_filters(self, query_text: str, structured_query: Dict[str, Any],
+                                 is_customer_query: Optional[bool] = None) -> Dict[str, Any]:
         """
         Ensure customer queries have proper filter conditions.
         This handles cases like "Show me details for customer XYZ".
         """
-        query_lower = query_text.lower()
+        if is_customer_query is None:
+            is_customer_query = "customer" in query_text.casefold()
         
         # Check if this is a customer query
-        if "customer" in query_lower and structured_query.get("entity_type") == "BusinessPartners":
+        if is_customer_query and structured_query.get("entity_type") == "BusinessPartners":
             has_card_filter = False
             has_card_type = False
             
@@ -552,8 +554,9 @@ class QueryUnderstandingAgent:
                     else:
                         raise ValueError("Could not extract JSON from LLM response")
 
-                # Post-process structured query
-                structured_query = self._ensure_customer_filters(state['query'], structured_query)
+                # Post-process structured query (the customer check is shared with schema validation)
+                is_customer_query = "customer" in state['query'].casefold()
+                structured_query = self._ensure_customer_filters(state['query'], structured_query, is_customer_query)
                 structured_query = await self._enhance_query_with_registry(structured_query, state['query'])
                 
                 # ========== NEW: CRITICAL SCHEMA VALIDATION STEP ==========
@@ -561,7 +564,7 @@ class QueryUnderstandingAgent:
                 if hasattr(self.entity_registry, 'validate_and_fix_structured_query'):
                     original_query = state['query']
                     validated_query = await self.entity_registry.validate_and_fix_structured_query(
-                        structured_query, original_query
+                        structured_query, original_query, is_customer_query=is_customer_query
                     )
                     structured_query = validated_query
                     print("✅ Schema validation completed")
@@ -13,6 +13,7 @@ from utils.exceptions import (
     format_user_friendly_error,
     ConnectionError as SAPConnectionError
 )
+from utils.sap_context import get_metadata_manager
 
 import logging
 
@@ -178,6 +179,7 @@ class RequestExecutorTool:
 
     def _execute_single_request(self, state: Dict[str, Any]) -> Dict[str, Any]:
         """Enhanced request execution with prevention tracking"""
+        metadata_manager = get_metadata_manager(state)
         try:
             # Start tracking execution time
             execution_start_time = time.time()
@@ -239,8 +241,8 @@ class RequestExecutorTool:
                     # If failed and was high-risk, count as prevention failure
                     if was_high_risk:
                         logger.warning(f"Prevention failed for high-risk query")
-                        if "metadata_manager" in state and state["metadata_manager"]:
-                            state["metadata_manager"].update_prevention_success(original_risk_score, False)
+                        if metadata_manager:
+                            metadata_manager.update_prevention_success(original_risk_score, False)
                     
                     error_message = response.get("error", "Unknown error")
                     state["error"] = {
@@ -253,8 +255,7 @@ class RequestExecutorTool:
                     state["output"] = format_user_friendly_error(state["error"])
                     
                     # Learning from failures
-                    if "metadata_manager" in state and state["metadata_manager"]:
-                        metadata_manager = state["metadata_manager"]
+                    if metadata_manager:
                         
                         # Store error example
                         metadata_manager.store_error_example(
@@ -295,12 +296,11 @@ class RequestExecutorTool:
                         logger.info(f"Prevention success! Rate: {success_rate:.3f}")
                         
                         # Update metadata manager with prevention success
-                        if "metadata_manager" in state and state["metadata_manager"]:
-                            state["metadata_manager"].update_prevention_success(original_risk_score, True)
+                        if metadata_manager:
+                            metadata_manager.update_prevention_success(original_risk_score, True)
                     
                     # Success case - store and learn from successful query
-                    if "metadata_manager" in state and state["metadata_manager"]:
-                        metadata_manager = state["metadata_manager"]
+                    if metadata_manager:
                         
                         filter_conditions = state.get("structured_query", {}).get("filter_conditions", [])
                         entities = {}
@@ -335,8 +335,8 @@ class RequestExecutorTool:
                 # If failed and was high-risk, count as prevention failure
                 if was_high_risk:
                     logger.warning(f"Prevention failed for high-risk query (auth error)")
-                    if "metadata_manager" in state and state["metadata_manager"]:
-                        state["metadata_manager"].update_prevention_success(original_risk_score, False)
+                    if metadata_manager:
+                        metadata_manager.update_prevention_success(original_risk_score, False)
                 
                 print(f"Authentication error: {str(e)}")
                 state["error"] = {
@@ -349,8 +349,7 @@ class RequestExecutorTool:
                 state["output"] = format_user_friendly_error(state["error"])
                 
                 # Track error for learning
-                if "metadata_manager" in state and state["metadata_manager"]:
-                    metadata_manager = state["metadata_manager"]
+                if metadata_manager:
                     metadata_manager.store_error_example(
                         intent=state.get("intent", "unknown"),
                         endpoint=state.get("endpoint", "unknown"),
@@ -366,8 +365,8 @@ class RequestExecutorTool:
                 # If failed and was high-risk, count as prevention failure
                 if was_high_risk:
                     logger.warning(f"Prevention failed for high-risk query (connection error)")
-                    if "metadata_manager" in state and state["metadata_manager"]:
-                        state["metadata_manager"].update_prevention_success(original_risk_score, False)
+                    if metadata_manager:
+                        metadata_manager.update_prevention_success(original_risk_score, False)
                 
                 print(f"Connection error: {str(e)}")
                 state["error"] = {
@@ -380,8 +379,7 @@ class RequestExecutorTool:
                 state["output"] = format_user_friendly_error(state["error"])
                 
                 # Track error for learning
-                if "metadata_manager" in state and state["metadata_manager"]:
-                    metadata_manager = state["metadata_manager"]
+                if metadata_manager:
                     metadata_manager.store_error_example(
                         intent=state.get("intent", "unknown"),
                         endpoint=state.get("endpoint", "unknown"),
@@ -397,8 +395,8 @@ class RequestExecutorTool:
                 # If failed and was high-risk, count as prevention failure
                 if was_high_risk:
                     logger.warning(f"Prevention failed for high-risk query (request error)")
-                    if "metadata_manager" in state and state["metadata_manager"]:
-                        state["metadata_manager"].update_prevention_success(original_risk_score, False)
+                    if metadata_manager:
+                        metadata_manager.update_prevention_success(original_risk_score, False)
                 
                 print(f"Request error: {str(e)}")
                 state["error"] = {
@@ -411,8 +409,7 @@ class RequestExecutorTool:
                 state["output"] = format_user_friendly_error(state["error"])
                 
                 # Track error and analyze with LLM
-                if "metadata_manager" in state and state["metadata_manager"]:
-                    metadata_manager = state["metadata_manager"]
+                if metadata_manager:
                     metadata_manager.store_error_example(
                         intent=state.get("intent", "unknown"),
                         endpoint=state.get("endpoint", "unknown"),
@@ -444,8 +441,8 @@ class RequestExecutorTool:
                 # If failed and was high-risk, count as prevention failure
                 if was_high_risk:
                     logger.warning(f"Prevention failed for high-risk query (OData error)")
-                    if "metadata_manager" in state and state["metadata_manager"]:
-                        state["metadata_manager"].update_prevention_success(original_risk_score, False)
+                    if metadata_manager:
+                        metadata_manager.update_prevention_success(original_risk_score, False)
                 
                 print(f"SAP API error: {str(e)}")
                 state["error"] = {
@@ -458,8 +455,7 @@ class RequestExecutorTool:
                 state["output"] = format_user_friendly_error(state["error"])
                 
                 # Track error for learning
-                if "metadata_manager" in state and state["metadata_manager"]:
-                    metadata_manager = state["metadata_manager"]
+                if metadata_manager:
                     metadata_manager.store_error_example(
                         intent=state.get("intent", "unknown"),
                         endpoint=state.get("endpoint", "unknown"),
@@ -477,8 +473,8 @@ class RequestExecutorTool:
             if was_high_risk:
                 original_risk_score = state["proactive_intervention"]["risk_score"]
                 logger.warning(f"Prevention failed for high-risk query (unexpected error)")
-                if "metadata_manager" in state and state["metadata_manager"]:
-                    state["metadata_manager"].update_prevention_success(original_risk_score, False)
+                if metadata_manager:
+                    metadata_manager.update_prevention_success(original_risk_score, False)
             
             print(f"Error in request executor: {str(e)}")
             state["error"] = {
@@ -491,9 +487,8 @@ class RequestExecutorTool:
             state["output"] = format_user_friendly_error(state["error"])
             
             # Track unexpected errors too
-            if "metadata_manager" in state and state["metadata_manager"]:
+            if metadata_manager:
                 try:
-                    metadata_manager = state["metadata_manager"]
                     metadata_manager.store_error_example(
                         intent=state.get("intent", "unknown"),
                         endpoint=state.get("endpoint", "unknown"),
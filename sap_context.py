@@ -0,0 +1,32 @@
+# utils/sap_context.py
+
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import Any, Dict, Optional
+
+@dataclass(frozen=True)
+class SAPResources:
+    """Shared, non-serializable objects used by workflow nodes"""
+    metadata_manager: Any
+    sap_client: Any
+    entity_registry: Any
+
+# Holds the resources for the workflow run in progress, keeping them out of the
+# (checkpointable) workflow state
+SAP_CTX: ContextVar[SAPResources] = ContextVar("sap_ctx")
+
+def get_sap_resources() -> Optional[SAPResources]:
+    """Return the resources bound to the current workflow run, if any"""
+    return SAP_CTX.get(None)
+
+def get_metadata_manager(state: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Resolve the metadata manager for a workflow node.
+    
+    A manager passed explicitly in the state takes precedence so tools can still
+    be invoked directly with a hand-built state.
+    """
+    if state and state.get("metadata_manager"):
+        return state["metadata_manager"]
+    resources = SAP_CTX.get(None)
+    return resources.metadata_manager if resources else None
@@ -17,8 +17,9 @@ class CrystalReportsGenerator:
         self.reports_directory = reports_directory
         os.makedirs(reports_directory, exist_ok=True)
     
-    async def get_crystal_report(self, report_type: str, record_id: str, record_data: Dict[str, Any] = None) -> Dict[str, Any]:
-        """Generate Crystal Report for invoice or order"""
+    async def get_crystal_report(self, report_type: str, record_id: str, record_data: Dict[str, Any] = None,
+                                 in_memory: bool = False) -> Dict[str, Any]:
+        """Generate Crystal Report for invoice or order (in_memory returns the PDF bytes instead of saving a file)"""
         try:
             logger.info(f"Generating Crystal Report: {report_type} for {record_id}")
             
@@ -46,19 +47,26 @@ class CrystalReportsGenerator:
             # 4. Save it to the specified path
             
             # For now, we'll create a mock PDF file
-            await self._create_mock_report(report_path, report_type, record_id, record_data)
+            report_bytes = self._render_mock_report(report_type, record_id, record_data)
             
             result = {
                 "status": "success",
                 "report_type": report_type,
                 "record_id": record_id,
-                "report_path": report_path,
                 "report_filename": report_filename,
                 "generated_at": datetime.now().isoformat(),
-                "file_size": self._get_file_size(report_path)
+                "file_size": self._format_size(len(report_bytes))
             }
             
-            logger.info(f"Crystal Report generated: {report_path}")
+            if in_memory:
+                # Handed straight to the caller (e.g. as an email attachment), no disk round-trip
+                result["bytes"] = report_bytes
+                logger.info(f"Crystal Report generated in memory: {report_filename}")
+            else:
+                with open(report_path, 'wb') as f:
+                    f.write(report_bytes)
+                result["report_path"] = report_path
+                logger.info(f"Crystal Report generated: {report_path}")
             return result
             
         except Exception as e:
@@ -68,8 +76,8 @@ class CrystalReportsGenerator:
                 "message": f"Error generating Crystal Report: {str(e)}"
             }
     
-    async def _create_mock_report(self, report_path: str, report_type: str, record_id: str, record_data: Dict[str, Any]):
-        """Create a mock report file (replace with actual Crystal Reports integration)"""
+    def _render_mock_report(self, report_type: str, record_id: str, record_data: Dict[str, Any]) -> bytes:
+        """Render a mock report (replace with actual Crystal Reports integration)"""
         # This is a placeholder - in reality you'd integrate with Crystal Reports
         mock_content = f"""CRYSTAL REPORT - {report_type.upper()}
 Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
@@ -80,23 +88,16 @@ Record ID: {record_id}
 
 --- END REPORT ---
 """
-        
-        # Write mock content to file
-        with open(report_path, 'w') as f:
-            f.write(mock_content)
+        return mock_content.encode("utf-8")
     
-    def _get_file_size(self, file_path: str) -> str:
-        """Get human-readable file size"""
-        try:
-            size_bytes = os.path.getsize(file_path)
-            if size_bytes < 1024:
-                return f"{size_bytes} B"
-            elif size_bytes < 1024 * 1024:
-                return f"{size_bytes / 1024:.1f} KB"
-            else:
-                return f"{size_bytes / (1024 * 1024):.1f} MB"
-        except:
-            return "Unknown size"
+    def _format_size(self, size_bytes: int) -> str:
+        """Human-readable file size"""
+        if size_bytes < 1024:
+            return f"{size_bytes} B"
+        elif size_bytes < 1024 * 1024:
+            return f"{size_bytes / 1024:.1f} KB"
+        else:
+            return f"{size_bytes / (1024 * 1024):.1f} MB"
 
 class SAVTicketSystem:
     """Service After Sale (SAV) ticket system integration"""
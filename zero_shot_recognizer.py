@@ -9,6 +9,8 @@ from langchain.prompts import ChatPromptTemplate
 from langchain_openai import ChatOpenAI
 from langchain.schema import StrOutputParser
 
+from utils.openai_limits import limited_async_http_client, limited_http_client
+
 logger = logging.getLogger("ZeroShotRecognizer")
 
 class ZeroShotIntentRecognizer:
@@ -16,15 +18,21 @@ class ZeroShotIntentRecognizer:
     def __init__(self, entity_registry_integration=None):
         self.entity_registry = entity_registry_integration
         
+        # Requests go through the process-wide OpenAI concurrency and rate limits
+        http_clients = {
+            "http_client": limited_http_client(),
+            "http_async_client": limited_async_http_client(),
+        }
+        
         # Initialize the LLM with an appropriate model
         try:
-            self.llm = ChatOpenAI(model="gpt-4-turbo", temperature=0.1)
+            self.llm = ChatOpenAI(model="gpt-4-turbo", temperature=0.1, **http_clients)
         except:
             try:
-                self.llm = ChatOpenAI(model="gpt-4", temperature=0.1)
+                self.llm = ChatOpenAI(model="gpt-4", temperature=0.1, **http_clients)
             except:
                 # Fallback to GPT-3.5-turbo
-                self.llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.1)
+                self.llm = ChatOpenAI(model="gpt-3.5-turbo", temperature=0.1, **http_clients)
     
     async def generate_intent_descriptions(self):
         """Generate descriptions for possible intents based on entity registry"""